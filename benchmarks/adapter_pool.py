@@ -0,0 +1,180 @@
+"""Benchmark the placement of connections on simulated bluetooth adapters.
+
+Lights are spread across two rooms, each room close to one adapter. Every
+light sends a command and stays connected, first with all the connections on
+the first adapter, then with an adapter pool. Adapters refuse connections
+beyond their slots and weak signals make connecting slower and less reliable.
+
+    python benchmarks/adapter_pool.py --lights 12 --slots 7 --flaky-rate 0.3
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bleak.backends.device import BLEDevice  # noqa: E402
+from bleak.exc import BleakError  # noqa: E402
+from bleak_retry_connector import BleakOutOfConnectionSlotsError  # noqa: E402
+
+from custom_components.chihiros.chihiros_led_control.device import (  # noqa: E402
+    get_model_class_from_name,
+)
+from custom_components.chihiros.chihiros_led_control.device.adapters import (  # noqa: E402
+    AdapterPool,
+    adapter_of,
+)
+
+ADAPTERS = ("hci0", "hci1")
+
+
+class _Characteristic:
+    def __init__(self, uuid: str) -> None:
+        self.uuid = uuid
+
+
+class _Services:
+    def get_characteristic(self, uuid: str) -> _Characteristic:
+        return _Characteristic(uuid)
+
+
+class _Client:
+    """Connected client of a simulated adapter."""
+
+    def __init__(self, adapter: "_Adapter", address: str) -> None:
+        self.is_connected = True
+        self.services = _Services()
+        self._adapter = adapter
+        self._address = address
+
+    async def get_services(self) -> _Services:
+        return self.services
+
+    async def start_notify(self, char: Any, callback: Callable[..., None]) -> None:
+        pass
+
+    async def stop_notify(self, char: Any) -> None:
+        pass
+
+    async def write_gatt_char(self, char: Any, data: bytes, response: bool) -> None:
+        await asyncio.sleep(0.005)
+
+    async def disconnect(self) -> None:
+        self.is_connected = False
+        self._adapter.connected.discard(self._address)
+
+
+class _Adapter:
+    """Adapter with a fixed number of connection slots."""
+
+    def __init__(self, name: str, slots: int, failure_rate: float) -> None:
+        self.name = name
+        self.slots = slots
+        self.failure_rate = failure_rate
+        self.connected: set[str] = set()
+
+    async def connect(self, address: str, rssi: int, rng: random.Random) -> _Client:
+        # weak signals take longer to connect and fail more often
+        await asyncio.sleep(0.05 + max(0, -rssi - 50) / 200)
+        if len(self.connected) >= self.slots:
+            raise BleakOutOfConnectionSlotsError(f"{self.name}: no free slot")
+        weak = min(0.9, max(0.0, (-rssi - 75) / 20))
+        if rng.random() < max(weak, self.failure_rate):
+            raise BleakError(f"{self.name}: connection failed")
+        self.connected.add(address)
+        return _Client(self, address)
+
+
+def _on_adapter(address: str, name: str, adapter: str) -> BLEDevice:
+    path = f"/org/bluez/{adapter}/dev_{address.replace(':', '_')}"
+    return BLEDevice(address, name, {"path": path, "props": {}}, 0)
+
+
+async def _round(args: argparse.Namespace, pooled: bool) -> None:
+    rng = random.Random(args.seed)
+    adapters = {
+        "hci0": _Adapter("hci0", args.slots, 0.0),
+        "hci1": _Adapter("hci1", args.slots, args.flaky_rate),
+    }
+    pool = AdapterPool(ADAPTERS if pooled else ADAPTERS[:1])
+    signals: dict[str, dict[str, int]] = {}
+    devices = []
+    for index in range(args.lights):
+        address = f"00:00:00:00:00:{index:02X}"
+        near = ADAPTERS[index % 2]
+        signals[address] = {
+            adapter: rng.randint(-60, -50) if adapter == near else rng.randint(-85, -70)
+            for adapter in ADAPTERS
+        }
+        for adapter, rssi in signals[address].items():
+            pool.observe(_on_adapter(address, "DYNA2", adapter), rssi)
+
+        async def _connect(
+            ble_device: BLEDevice, disconnected_callback: Callable[..., None]
+        ) -> _Client:
+            adapter = adapter_of(ble_device) or "hci0"
+            return await adapters[adapter].connect(
+                ble_device.address, signals[ble_device.address][adapter], rng
+            )
+
+        device = get_model_class_from_name("DYNA2")(
+            _on_adapter(address, "DYNA2", "hci0")
+        )
+        device.set_connector(_connect)  # type: ignore[arg-type]
+        device.set_adapter_pool(pool)
+        devices.append(device)
+
+    latencies: list[float] = []
+    failures = 0
+
+    async def _command(device: Any) -> None:
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            await device.turn_on()
+        except Exception:  # pylint: disable=broad-except
+            failures += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(_command(device) for device in devices))
+    mean = sum(latencies) / len(latencies) if latencies else 0.0
+    print(
+        f"{'pool' if pooled else 'single adapter':<15} ok: {len(latencies):3d}  "
+        f"failed: {failures:3d}  mean latency: {mean * 1000:6.1f} ms"
+    )
+    for pool_adapter in pool.adapters.values():
+        rate = pool_adapter.success_rate
+        print(
+            f"  {pool_adapter.name}: "
+            f"{len(pool_adapter.connected)}/{pool_adapter.capacity} connected, "
+            f"{pool_adapter.attempts} attempts, "
+            f"success rate {'-' if rate is None else f'{rate:.0%}'}"
+        )
+    for device in devices:
+        await device.disconnect()
+
+
+async def _run(args: argparse.Namespace) -> None:
+    """Connect the lights without and with a pool."""
+    await _round(args, False)
+    await _round(args, True)
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lights", type=int, default=12)
+    parser.add_argument("--slots", type=int, default=7)
+    parser.add_argument("--flaky-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark the mapping of a fleet wide color effect to channel levels.
+
+Every frame of a rainbow effect gives each light of a mixed fleet its own hue,
+which is mapped to the levels of the channels of its model. The time per light
+is reported with numpy, when installed, and with the pure python fallback.
+
+    python benchmarks/color_pipeline.py --lights 1000 --frames 50
+"""
+
+import argparse
+import importlib.util
+import random
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from custom_components.chihiros.chihiros_led_control import color  # noqa: E402
+from custom_components.chihiros.chihiros_led_control.device.catalog import (  # noqa: E402
+    MODEL_CATALOG,
+)
+
+
+def _run(args: argparse.Namespace, models: list[str], label: str) -> None:
+    """Map the frames of the effect and print the time per light."""
+    color._pipeline_for_model.cache_clear()
+    color.fleet_levels(
+        models, color.hs_to_rgb([0.0] * len(models), [100] * len(models))
+    )
+    start = time.perf_counter()
+    for frame in range(args.frames):
+        hues = [
+            (index * 360 / len(models) + frame * 7) % 360
+            for index in range(len(models))
+        ]
+        rgb = color.hs_to_rgb(hues, [100] * len(models))
+        color.fleet_levels(models, rgb, 200)
+    elapsed = time.perf_counter() - start
+    per_light = elapsed / args.frames / len(models)
+    print(f"{label:<7} {per_light * 1e6:7.2f} us per light and frame")
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lights", type=int, default=1000)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    models = [rng.choice(MODEL_CATALOG).class_name for _ in range(args.lights)]
+    if importlib.util.find_spec("numpy") is not None:
+        _run(args, models, "numpy")
+    # the fallback used when numpy is not installed
+    with mock.patch.object(color, "np", None):
+        _run(args, models, "python")
+
+
+if __name__ == "__main__":
+    main()
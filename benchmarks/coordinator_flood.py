@@ -0,0 +1,115 @@
+"""Benchmark the advertisement handling of the coordinator under a flood.
+
+Advertisements with a jittering RSSI are sent to the coordinator of one device,
+the cost per advertisement and the number of device and listener updates are
+reported. Home Assistant must be installed.
+
+    python benchmarks/coordinator_flood.py --advertisements 100000
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bleak.backends.device import BLEDevice  # noqa: E402
+from bleak.backends.scanner import AdvertisementData  # noqa: E402
+from homeassistant.components.bluetooth import (  # noqa: E402
+    BluetoothChange,
+    BluetoothServiceInfoBleak,
+    update_coordinator,
+)
+
+from custom_components.chihiros.chihiros_led_control.device import (  # noqa: E402
+    get_model_class_from_name,
+)
+from custom_components.chihiros.coordinator import (  # noqa: E402
+    ChihirosDataUpdateCoordinator,
+)
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+NAME = "DYNWRGB0123456789AB"
+
+
+def _service_infos(
+    count: int, adapters: int, seed: int
+) -> list[BluetoothServiceInfoBleak]:
+    """Build advertisements seen by several adapters with a noisy RSSI."""
+    rng = random.Random(seed)
+    infos = []
+    for index in range(count):
+        rssi = int(rng.gauss(-70, 4))
+        adapter = 0 if rng.random() > 0.001 else rng.randrange(adapters)
+        # like bleak, a new device object with every advertisement
+        device = BLEDevice(
+            ADDRESS,
+            NAME,
+            {"path": f"/org/bluez/hci{adapter}/dev", "props": {"RSSI": rssi}},
+            rssi,
+        )
+        advertisement = AdvertisementData(NAME, {}, {}, [], None, rssi, ())
+        infos.append(
+            BluetoothServiceInfoBleak(
+                NAME,
+                ADDRESS,
+                rssi,
+                {},
+                {},
+                [],
+                "hci0",
+                device,
+                advertisement,
+                True,
+                index * 0.01,
+            )
+        )
+    return infos
+
+
+async def _run(args: argparse.Namespace) -> None:
+    """Flood a coordinator."""
+    hass = mock.MagicMock()
+    ble_device = BLEDevice(ADDRESS, NAME, {"path": "/org/bluez/hci0/dev"}, -70)
+    device = get_model_class_from_name(NAME)(ble_device)
+    with mock.patch.object(update_coordinator, "async_address_present") as present:
+        present.return_value = True
+        coordinator = ChihirosDataUpdateCoordinator(hass, device, ble_device)
+    listener_calls = 0
+
+    def _listener() -> None:
+        nonlocal listener_calls
+        listener_calls += 1
+
+    coordinator.async_add_listener(_listener)
+    infos = _service_infos(args.advertisements, args.adapters, args.seed)
+
+    handle = coordinator._async_handle_bluetooth_event
+    start = time.perf_counter()
+    for info in infos:
+        handle(info, BluetoothChange.ADVERTISEMENT)
+    elapsed = time.perf_counter() - start
+
+    presence = coordinator.presence
+    print(f"advertisements:   {presence.advertisements}")
+    print(f"cost per advert:  {elapsed / len(infos) * 1e6:.2f} us")
+    print(f"device updates:   {presence.device_updates}")
+    print(f"listener updates: {listener_calls}")
+    print(f"smoothed RSSI:    {presence.rssi:.1f}")
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--advertisements", type=int, default=100_000)
+    parser.add_argument("--adapters", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
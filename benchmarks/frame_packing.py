@@ -0,0 +1,134 @@
+"""Benchmark packing several frames per write against a simulated link.
+
+The link carries a bounded number of writes per connection event, the writes
+are packed up to the link mtu minus the attribute protocol header. A schedule upload and
+multi-channel sets are sent one frame per write and packed, the effective
+number of frames per second and the number of connection events are reported.
+
+    python benchmarks/frame_packing.py --settings 12 --mtu 247 --interval-ms 15
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bleak.backends.device import BLEDevice  # noqa: E402
+
+from custom_components.chihiros.chihiros_led_control.device.base_device import (  # noqa: E402,E501
+    BaseDevice,
+)
+from custom_components.chihiros.chihiros_led_control.device.wrgb2_pro import (  # noqa: E402
+    WRGBIIPro,
+)
+
+
+class _Characteristic:
+    uuid = "simulated"
+
+
+class _Services:
+    def get_characteristic(self, uuid: str) -> _Characteristic:
+        return _Characteristic()
+
+
+class _Link:
+    """Client whose writes wait for a free slot of a connection event."""
+
+    def __init__(self, mtu: int, interval: float, writes_per_event: int) -> None:
+        self.mtu_size = mtu
+        self.interval = interval
+        self.writes_per_event = writes_per_event
+        self.is_connected = True
+        self.services = _Services()
+        self.events = 0
+        self._slots = 0
+        self._next_event: float | None = None
+
+    async def start_notify(self, *args: Any) -> None:
+        pass
+
+    async def stop_notify(self, *args: Any) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def write_gatt_char(self, char: Any, data: bytes, response: bool) -> None:
+        loop = asyncio.get_running_loop()
+        if self._next_event is None:
+            self._next_event = loop.time()
+        if not self._slots:
+            # wait for the next connection event
+            await asyncio.sleep(max(0.0, self._next_event - loop.time()))
+            self._next_event = max(self._next_event, loop.time()) + self.interval
+            self._slots = self.writes_per_event
+            self.events += 1
+        self._slots -= 1
+
+
+async def _encode(dev: BaseDevice, settings: int) -> dict[str, list[bytes]]:
+    """Return the frames of a schedule upload and of multi-channel sets."""
+    start = datetime(2024, 1, 1, 6)
+    with dev.capture_commands() as upload:
+        await dev.reset_settings()
+        for index in range(settings):
+            sunrise = start + timedelta(minutes=30 * index)
+            await dev.add_rgb_setting(
+                sunrise, sunrise + timedelta(minutes=20), (index % 100, 80, 60)
+            )
+        await dev.enable_auto_mode(force=True)
+    with dev.capture_commands() as sets:
+        for level in range(0, 100, 10):
+            await dev.set_colors_brightness(
+                {0: level, 1: level + 1, 2: level + 2, 3: level + 3}, force=True
+            )
+    return {"schedule upload": upload, "channel sets": sets}
+
+
+async def _send(
+    args: argparse.Namespace, label: str, frames: list[bytes], pack: bool
+) -> None:
+    link = _Link(args.mtu, args.interval_ms / 1000, args.writes_per_event)
+
+    async def _connector(ble_device: BLEDevice, disconnected: Any) -> Any:
+        return link
+
+    dev = WRGBIIPro(BLEDevice("AA:BB:CC:DD:EE:FF", "DYWPRO30", None, 0))
+    dev.set_connector(_connector)
+    dev.set_frame_packing(pack)
+    dev.writer.min_gap = 0
+    await dev.send_commands(frames)
+    await dev.disconnect()
+    stats = dev.writer.stats
+    mode = "packed" if pack else "one per write"
+    print(
+        f"{label:<16} {mode:<14} frames: {stats.frames:4}  writes: {stats.writes:4}  "
+        f"events: {link.events:4}  fps: {stats.fps or 0:7.1f}"
+    )
+
+
+async def _run(args: argparse.Namespace) -> None:
+    """Send the frames one per write, then packed."""
+    dev = WRGBIIPro(BLEDevice("AA:BB:CC:DD:EE:FF", "DYWPRO30", None, 0))
+    for label, frames in (await _encode(dev, args.settings)).items():
+        await _send(args, label, frames, False)
+        await _send(args, label, frames, True)
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--settings", type=int, default=12)
+    parser.add_argument("--mtu", type=int, default=247)
+    parser.add_argument("--interval-ms", type=float, default=15.0)
+    parser.add_argument("--writes-per-event", type=int, default=1)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
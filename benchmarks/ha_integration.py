@@ -0,0 +1,437 @@
+"""Benchmark the Home Assistant integration against simulated lights.
+
+Config entries are set up through the `async_setup_entry` of the integration
+and of its light platform on a minimal stand-in of Home Assistant, with the
+bluetooth stack replaced by simulated lights. The harness then floods the
+coordinators with advertisements and sends storms of light service calls.
+The setup time of the entries, the cost of an advertisement, the latency of
+the service calls and the lag of the event loop are reported. With
+`--resync`, the lights are restored as lit and the time until the startup
+resync converged them is reported too. Home Assistant must be installed.
+
+    python benchmarks/ha_integration.py --entries 40 --advertisements 50000 --calls 200
+"""
+
+import argparse
+import asyncio
+import importlib
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bleak.backends.device import BLEDevice  # noqa: E402
+from bleak.backends.scanner import AdvertisementData  # noqa: E402
+from homeassistant.components import bluetooth  # noqa: E402
+from homeassistant.components.bluetooth import (  # noqa: E402
+    BluetoothChange,
+    BluetoothServiceInfoBleak,
+    update_coordinator,
+)
+from homeassistant.const import CONF_ADDRESS, CONF_NAME  # noqa: E402
+from homeassistant.core import CoreState, HassJob, State  # noqa: E402
+from homeassistant.exceptions import HomeAssistantError  # noqa: E402
+from homeassistant.helpers.entity import Entity  # noqa: E402
+from homeassistant.helpers.restore_state import RestoreEntity  # noqa: E402
+
+from custom_components.chihiros import async_setup_entry  # noqa: E402
+from custom_components.chihiros.const import (  # noqa: E402
+    CONF_COMBINED_LIGHT,
+    CONF_RESYNC_ON_START,
+    DOMAIN,
+)
+from custom_components.chihiros.resync import DATA_RESYNC  # noqa: E402
+
+MODELS = ("DYNA2", "DYNWRGB", "DYWPRO30", "DYU550")
+
+
+class _Characteristic:
+    def __init__(self, uuid: str) -> None:
+        self.uuid = uuid
+
+
+class _Services:
+    def get_characteristic(self, uuid: str) -> _Characteristic:
+        return _Characteristic(uuid)
+
+
+class _Client:
+    """Connected client of a simulated light."""
+
+    def __init__(self, fixture: "_Fixture") -> None:
+        self.is_connected = True
+        self.services = _Services()
+        self._fixture = fixture
+
+    async def get_services(self) -> _Services:
+        return self.services
+
+    async def start_notify(self, char: Any, callback: Callable[..., None]) -> None:
+        pass
+
+    async def stop_notify(self, char: Any) -> None:
+        pass
+
+    async def write_gatt_char(self, char: Any, data: bytes, response: bool) -> None:
+        await asyncio.sleep(self._fixture.write_time)
+        self._fixture.frames += 1
+
+    async def disconnect(self) -> None:
+        self.is_connected = False
+
+
+class _Fixture:
+    """Simulated light, connections go through an adapter with a few slots."""
+
+    def __init__(
+        self, index: int, args: argparse.Namespace, adapter: asyncio.Semaphore
+    ) -> None:
+        code = MODELS[index % len(MODELS)]
+        self.address = f"00:00:00:00:{index // 256:02X}:{index % 256:02X}"
+        self.name = f"{code}{index:012X}"
+        self.ble_device = BLEDevice(self.address, self.name, None, -60)
+        self.rssi = -50 - index % 40
+        self.connect_time = args.connect_ms / 1000
+        self.write_time = args.write_ms / 1000
+        self.frames = 0
+        self._adapter = adapter
+        self._rng = random.Random(index)
+
+    async def connect(
+        self, ble_device: BLEDevice, disconnected_callback: Callable[..., None]
+    ) -> _Client:
+        async with self._adapter:
+            await asyncio.sleep(self.connect_time * self._rng.uniform(0.5, 1.5))
+        return _Client(self)
+
+    def service_info(self, rssi: int, when: float) -> BluetoothServiceInfoBleak:
+        advertisement = AdvertisementData(self.name, {}, {}, [], None, rssi, ())
+        return BluetoothServiceInfoBleak(
+            self.name,
+            self.address,
+            rssi,
+            {},
+            {},
+            [],
+            "hci0",
+            self.ble_device,
+            advertisement,
+            True,
+            when,
+        )
+
+
+class _ConfigEntry:
+    """Config entry of a simulated light."""
+
+    def __init__(self, fixture: _Fixture, options: dict[str, Any]) -> None:
+        self.entry_id = fixture.address.replace(":", "").lower()
+        self.unique_id = fixture.address
+        self.title = fixture.name
+        self.data = {CONF_ADDRESS: fixture.address, CONF_NAME: fixture.name}
+        self.options = options
+        self.on_unload: list[Callable[[], Any]] = []
+
+    def async_on_unload(self, func: Callable[[], Any]) -> None:
+        self.on_unload.append(func)
+
+    def add_update_listener(self, listener: Any) -> Callable[[], None]:
+        return lambda: None
+
+
+def _entity_id(platform: str, unique_id: Any) -> str:
+    """Return the entity id of a unique id."""
+    return f"{platform}.{str(unique_id).replace(':', '').lower()}"
+
+
+class _ConfigEntries:
+    """Config entries manager setting up the platforms in process."""
+
+    def __init__(self, hass: "_Hass") -> None:
+        self._hass = hass
+
+    def async_update_entry(self, entry: _ConfigEntry, **changes: Any) -> None:
+        for key, value in changes.items():
+            setattr(entry, key, value)
+
+    async def async_forward_entry_setups(
+        self, entry: _ConfigEntry, platforms: list[str]
+    ) -> None:
+        for platform in platforms:
+            module = importlib.import_module(f"custom_components.chihiros.{platform}")
+            added: list[Entity] = []
+            await module.async_setup_entry(self._hass, entry, added.extend)
+            for entity in added:
+                entity.hass = self._hass  # type: ignore[assignment]
+                entity.entity_id = _entity_id(platform, entity.unique_id)
+                self._hass.entities[entity.entity_id] = entity
+                await entity.async_added_to_hass()
+
+
+class _Hass:
+    """The parts of Home Assistant used by the integration."""
+
+    def __init__(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.data: dict[str, Any] = {}
+        self.state = CoreState.running
+        self.config_entries = _ConfigEntries(self)
+        self.entities: dict[str, Entity] = {}
+        # last written state of each entity
+        self.states: dict[str, tuple[bool | None, int | None]] = {}
+        self.state_writes = 0
+        self.restored: dict[str, State] = {}
+
+    def async_create_task(self, target: Any, name: str | None = None) -> Any:
+        return self.loop.create_task(target)
+
+    def async_create_background_task(self, target: Any, name: str) -> Any:
+        return self.loop.create_task(target)
+
+    def async_run_hass_job(self, job: HassJob[..., Any], *args: Any) -> Any:
+        result = job.target(*args)
+        if asyncio.iscoroutine(result):
+            return self.loop.create_task(result)
+        return result
+
+
+class _LagMonitor:
+    """Measure how late the event loop runs a periodic callback."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.lags: list[float] = []
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - start - self.interval)
+
+    def __enter__(self) -> "_LagMonitor":
+        self.lags.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _percentiles(values: list[float]) -> str:
+    """Format the percentiles of durations, in milliseconds."""
+    if not values:
+        return "-"
+    ordered = sorted(values)
+
+    def _at(share: float) -> float:
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000
+
+    return (
+        f"p50 {_at(0.5):7.2f} ms  p95 {_at(0.95):7.2f} ms  "
+        f"p99 {_at(0.99):7.2f} ms  max {ordered[-1] * 1000:7.2f} ms"
+    )
+
+
+def _patches(hass: _Hass, fixtures: dict[str, _Fixture]) -> list[Any]:
+    """Replace the bluetooth stack and the state machine of Home Assistant."""
+
+    def _write_state(entity: Entity) -> None:
+        hass.state_writes += 1
+        hass.states[entity.entity_id] = (
+            getattr(entity, "is_on", None),
+            getattr(entity, "brightness", None),
+        )
+
+    async def _last_state(entity: RestoreEntity) -> State | None:
+        return hass.restored.get(entity.entity_id)
+
+    return [
+        mock.patch.object(
+            bluetooth,
+            "async_ble_device_from_address",
+            lambda _, address, connectable: fixtures[address].ble_device,
+        ),
+        mock.patch.object(update_coordinator, "async_address_present", lambda *_: True),
+        mock.patch.object(
+            update_coordinator, "async_register_callback", lambda *_: lambda: None
+        ),
+        mock.patch.object(
+            update_coordinator, "async_track_unavailable", lambda *_: lambda: None
+        ),
+        mock.patch.object(Entity, "async_write_ha_state", _write_state),
+        mock.patch.object(
+            Entity, "schedule_update_ha_state", lambda entity, *_: _write_state(entity)
+        ),
+        mock.patch.object(RestoreEntity, "async_get_last_state", _last_state),
+    ]
+
+
+async def _setup(
+    args: argparse.Namespace, hass: _Hass, fixtures: dict[str, _Fixture]
+) -> None:
+    """Set up an entry per light, all at once like Home Assistant does."""
+    options = {
+        CONF_COMBINED_LIGHT: args.combined,
+        CONF_RESYNC_ON_START: args.resync,
+    }
+    entries = [_ConfigEntry(fixture, options) for fixture in fixtures.values()]
+    if args.resync:
+        for fixture in fixtures.values():
+            for color in ("white", "red", "green", "blue", "combined"):
+                entity_id = _entity_id("light", f"{fixture.address}_{color}")
+                hass.restored[entity_id] = State(
+                    entity_id,
+                    "on",
+                    {"brightness": 200, "rgb_color": (255, 128, 64), "mode": "manual"},
+                )
+    durations: list[float] = []
+
+    async def _setup_entry(entry: _ConfigEntry) -> None:
+        start = time.perf_counter()
+        await async_setup_entry(hass, entry)  # type: ignore[arg-type]
+        durations.append(time.perf_counter() - start)
+        device = hass.data[DOMAIN][entry.entry_id].device
+        device.set_connector(fixtures[device.address].connect)
+
+    start = time.perf_counter()
+    with _LagMonitor() as lag:
+        await asyncio.gather(*(_setup_entry(entry) for entry in entries))
+    elapsed = time.perf_counter() - start
+    print(f"setup of {len(entries)} entries: {elapsed * 1000:.1f} ms")
+    print(f"  per entry       {_percentiles(durations)}")
+    print(f"  event loop lag  {_percentiles(lag.lags)}")
+    print(f"  entities        {len(hass.entities)}")
+    if args.resync:
+        await _resync(hass, start)
+
+
+async def _resync(hass: _Hass, start: float) -> None:
+    """Wait for the startup resync to converge the lights."""
+    manager = hass.data[DATA_RESYNC]
+    with _LagMonitor() as lag:
+        while manager.last_report is None:
+            await asyncio.sleep(0.05)
+    report = manager.last_report
+    print(
+        f"resync: {report.resynced} of {report.devices} lights in "
+        f"{report.duration * 1000:.1f} ms, converged "
+        f"{(time.perf_counter() - start) * 1000:.1f} ms after the setup started"
+    )
+    print(f"  event loop lag  {_percentiles(lag.lags)}")
+
+
+async def _flood(
+    args: argparse.Namespace, hass: _Hass, fixtures: dict[str, _Fixture]
+) -> None:
+    """Dispatch advertisements to the coordinators in bursts."""
+    rng = random.Random(args.seed)
+    coordinators = [data.coordinator for data in hass.data[DOMAIN].values()]
+    infos = []
+    for index in range(args.advertisements):
+        coordinator = rng.choice(coordinators)
+        fixture = fixtures[coordinator.address]
+        infos.append(
+            (
+                coordinator._async_handle_bluetooth_event,
+                fixture.service_info(int(rng.gauss(fixture.rssi, 4)), index * 0.001),
+            )
+        )
+    writes = hass.state_writes
+    busy = 0.0
+    with _LagMonitor() as lag:
+        for offset in range(0, len(infos), args.burst):
+            start = time.perf_counter()
+            for handle, info in infos[offset : offset + args.burst]:  # noqa: E203
+                handle(info, BluetoothChange.ADVERTISEMENT)
+            busy += time.perf_counter() - start
+            await asyncio.sleep(0)
+    print(f"flood of {len(infos)} advertisements in bursts of {args.burst}:")
+    print(f"  cost per advert {busy / max(1, len(infos)) * 1e6:.2f} us")
+    print(f"  state writes    {hass.state_writes - writes}")
+    print(f"  event loop lag  {_percentiles(lag.lags)}")
+
+
+async def _storm(
+    args: argparse.Namespace, hass: _Hass, fixtures: dict[str, _Fixture]
+) -> None:
+    """Send concurrent light service calls to random entities."""
+    rng = random.Random(args.seed)
+    entities = list(hass.entities.values())
+    latencies: list[float] = []
+    failures = 0
+
+    async def _call(entity: Any, turn_on: bool, brightness: int) -> None:
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            if turn_on:
+                await entity.async_turn_on(brightness=brightness)
+            else:
+                await entity.async_turn_off()
+        except HomeAssistantError:
+            failures += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    calls = [
+        _call(rng.choice(entities), rng.random() < 0.7, rng.randint(1, 255))
+        for _ in range(args.calls)
+    ]
+    start = time.perf_counter()
+    with _LagMonitor() as lag:
+        await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - start
+    frames = sum(fixture.frames for fixture in fixtures.values())
+    print(f"storm of {args.calls} service calls: {elapsed * 1000:.1f} ms")
+    print(f"  latency         {_percentiles(latencies)}")
+    print(f"  failed calls    {failures}")
+    print(f"  frames written  {frames}")
+    print(f"  event loop lag  {_percentiles(lag.lags)}")
+
+
+async def _run(args: argparse.Namespace) -> None:
+    """Set up the entries, then flood them and send service calls."""
+    hass = _Hass()
+    adapter = asyncio.Semaphore(args.parallel_connects)
+    fixtures = {
+        fixture.address: fixture
+        for fixture in (_Fixture(index, args, adapter) for index in range(args.entries))
+    }
+    patches = _patches(hass, fixtures)
+    for patch in patches:
+        patch.start()
+    try:
+        await _setup(args, hass, fixtures)
+        await _flood(args, hass, fixtures)
+        await _storm(args, hass, fixtures)
+        for data in hass.data[DOMAIN].values():
+            await data.device.disconnect()
+    finally:
+        for patch in patches:
+            patch.stop()
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=40)
+    parser.add_argument("--advertisements", type=int, default=50_000)
+    parser.add_argument("--burst", type=int, default=100)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--connect-ms", type=float, default=100.0)
+    parser.add_argument("--write-ms", type=float, default=5.0)
+    parser.add_argument("--parallel-connects", type=int, default=2)
+    parser.add_argument("--combined", action="store_true")
+    parser.add_argument("--resync", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
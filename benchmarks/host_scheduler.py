@@ -0,0 +1,138 @@
+"""Benchmark driving a cloud effect on a fleet of lights from the host.
+
+Each simulated light gets new levels every few hundred milliseconds with a
+random phase, as clouds passing over a tank would. The effect is driven by a
+task sleeping per light, then by the timer wheel of `FleetScheduler`. The
+number of sends and the lag of the actions after their due time are reported.
+
+    python benchmarks/host_scheduler.py --lights 500 --duration 5 --step-ms 200
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from custom_components.chihiros.chihiros_led_control.scheduler import (  # noqa: E402
+    FleetScheduler,
+)
+
+# the effect starts after this delay, once all its actions are scheduled
+LEAD_TIME = 1.0
+
+
+class _Light:
+    """Light taking `write_time` seconds to receive levels."""
+
+    def __init__(self, address: str, write_time: float) -> None:
+        self.address = address
+        self.write_time = write_time
+        self.sends = 0
+
+    async def set_colors_brightness(self, levels: Any, deadline: Any = None) -> None:
+        self.sends += 1
+        await asyncio.sleep(self.write_time)
+
+
+def _program(
+    args: argparse.Namespace, lights: dict[str, _Light]
+) -> dict[str, list[tuple[float, dict[str | int, int]]]]:
+    """Return the delays and levels of the effect of each light."""
+    rng = random.Random(args.seed)
+    step = args.step_ms / 1000
+    program: dict[str, list[tuple[float, dict[str | int, int]]]] = {}
+    for address in lights:
+        phase = LEAD_TIME + rng.random() * step
+        program[address] = [
+            (phase + index * step, {"white": rng.randint(40, 100)})
+            for index in range(int(args.duration / step))
+        ]
+    return program
+
+
+def _percentiles(label: str, sends: int, actions: int, lags: list[float]) -> None:
+    lags = sorted(lags)
+
+    def _at(percentile: float) -> float:
+        return lags[min(len(lags) - 1, int(len(lags) * percentile / 100))] * 1000
+
+    print(
+        f"{label:<14} actions: {actions:6}  sends: {sends:6}  lag ms "
+        f"p50 {_at(50):7.2f}  p95 {_at(95):7.2f}  max {lags[-1] * 1000:7.2f}"
+    )
+
+
+async def _sleeping_tasks(args: argparse.Namespace) -> None:
+    """Drive the effect with a task sleeping until each action of a light."""
+    lights = {
+        f"AA:BB:CC:{i >> 8:02X}:{i & 255:02X}:00": _Light("", args.write_ms / 1000)
+        for i in range(args.lights)
+    }
+    program = _program(args, lights)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    lags: list[float] = []
+
+    async def _drive(light: _Light, actions: list[Any]) -> None:
+        for delay, levels in actions:
+            await asyncio.sleep(max(0.0, start + delay - loop.time()))
+            lags.append(loop.time() - start - delay)
+            await light.set_colors_brightness(levels)
+
+    await asyncio.gather(
+        *(_drive(lights[address], actions) for address, actions in program.items())
+    )
+    sends = sum(light.sends for light in lights.values())
+    _percentiles("sleeping tasks", sends, len(lags), lags)
+
+
+async def _timer_wheel(args: argparse.Namespace) -> None:
+    """Drive the effect with the timer wheel of a scheduler."""
+    lights = {
+        f"AA:BB:CC:{i >> 8:02X}:{i & 255:02X}:00": _Light("", args.write_ms / 1000)
+        for i in range(args.lights)
+    }
+    program = _program(args, lights)
+    scheduler = FleetScheduler(
+        lights,  # type: ignore[arg-type]
+        resolution=args.resolution_ms / 1000,
+        max_concurrency=args.lights,
+    )
+    start = time.perf_counter()
+    async with scheduler:
+        for address, actions in program.items():
+            for delay, levels in actions:
+                scheduler.schedule_in(address, delay, levels)
+        scheduled = time.perf_counter() - start
+        await asyncio.sleep(LEAD_TIME + args.duration + args.write_ms / 1000 + 0.5)
+    stats = scheduler.stats
+    sends = sum(light.sends for light in lights.values())
+    # the lags of the ticks, the actions of a tick are due at most one tick earlier
+    _percentiles("timer wheel", sends, stats.fired, list(stats.recent_lags))
+    print(
+        f"{'':<14} ticks: {stats.ticks}  coalesced: {stats.coalesced}  "
+        f"scheduled in {scheduled * 1000:.1f} ms"
+    )
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lights", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--step-ms", type=float, default=200.0)
+    parser.add_argument("--write-ms", type=float, default=30.0)
+    parser.add_argument("--resolution-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(_sleeping_tasks(args))
+    asyncio.run(_timer_wheel(args))
+
+
+if __name__ == "__main__":
+    main()
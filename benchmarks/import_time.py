@@ -0,0 +1,96 @@
+"""Benchmark the startup time of chihirosctl.
+
+Each measurement runs in a fresh interpreter. The benchmark fails if the CLI
+imports the bluetooth stack, Home Assistant or the device modules at startup,
+or if the median startup time is above --max-ms.
+
+    python benchmarks/import_time.py --runs 10 --max-ms 300
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CLI_MODULE = "custom_components.chihiros.chihiros_led_control.chihirosctl"
+
+# modules that must only be imported once a command needs the radio
+LAZY_MODULES = [
+    "bleak",
+    "bleak_retry_connector",
+    "homeassistant",
+    "custom_components.chihiros.chihiros_led_control.device",
+]
+
+_IMPORT_SNIPPET = f"""
+import json, sys, time
+start = time.perf_counter()
+import {CLI_MODULE}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_ms": elapsed * 1000,
+    "loaded": [m for m in {LAZY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def _measure_import() -> tuple[float, list[str]]:
+    """Import the CLI in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SNIPPET],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output)
+    return result["import_ms"], result["loaded"]
+
+
+def _measure_help() -> float:
+    """Run `chihirosctl --help` in a fresh interpreter."""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", CLI_MODULE, "--help"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    import_times: list[float] = []
+    loaded: set[str] = set()
+    for _ in range(args.runs):
+        import_ms, loaded_modules = _measure_import()
+        import_times.append(import_ms)
+        loaded.update(loaded_modules)
+    help_times = [_measure_help() for _ in range(args.runs)]
+
+    import_median = statistics.median(import_times)
+    print(f"import {CLI_MODULE}: median {import_median:.1f} ms")
+    print(f"chihirosctl --help: median {statistics.median(help_times):.1f} ms")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: imported at startup: {', '.join(sorted(loaded))}")
+        failed = True
+    if args.max_ms is not None and import_median > args.max_ms:
+        print(f"FAIL: import median above {args.max_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Benchmark the flow controlled writer against a simulated fixture.
+
+The fixture buffers a few frames, drops the frames arriving while its buffer is
+full and acknowledges each processed frame with a notification. The number of
+frames per second and of dropped frames are reported for an upload.
+
+    python benchmarks/writer_flow.py --frames 500 --buffer 6 --process-ms 8
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from custom_components.chihiros.chihiros_led_control.device.writer import (  # noqa: E402
+    FlowControlledWriter,
+)
+
+
+class _Fixture:
+    """Fixture processing one frame at a time from a bounded buffer."""
+
+    def __init__(self, buffer: int, process_time: float, acks: bool) -> None:
+        self.buffer = buffer
+        self.process_time = process_time
+        self.acks = acks
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue()
+        self.dropped = 0
+        self.processed = 0
+        self.writer: FlowControlledWriter | None = None
+
+    async def write(self, frame: bytes) -> None:
+        await asyncio.sleep(0)
+        if self.queue.qsize() >= self.buffer:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(frame)
+
+    async def run(self) -> None:
+        while True:
+            frame = await self.queue.get()
+            await asyncio.sleep(self.process_time)
+            self.processed += 1
+            if self.acks and self.writer is not None:
+                self.writer.acknowledge(frame)
+
+
+async def _upload(args: argparse.Namespace, min_gap: float, acks: bool) -> None:
+    fixture = _Fixture(args.buffer, args.process_ms / 1000, acks)
+    writer = FlowControlledWriter(min_gap=min_gap)
+    fixture.writer = writer
+    task = asyncio.create_task(fixture.run())
+    # frames carry their message id in bytes 3 and 4, like the device commands
+    frames = [
+        bytes([90, 1, 6, index >> 8 & 255, index & 255, 7])
+        for index in range(args.frames)
+    ]
+    await writer.write(fixture.write, frames)
+    task.cancel()
+    label = f"gap {min_gap * 1000:.0f} ms, {'acks' if acks else 'no acks'}"
+    print(
+        f"{label:<22} fps: {writer.stats.fps or 0:7.1f}  "
+        f"dropped: {fixture.dropped:4}  window: {writer.window:4.1f}"
+    )
+
+
+async def _run(args: argparse.Namespace) -> None:
+    """Upload frames with and without flow control."""
+    await _upload(args, 0.0, False)
+    await _upload(args, args.process_ms / 1000, False)
+    await _upload(args, 0.0, True)
+    await _upload(args, args.min_gap_ms / 1000, True)
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--buffer", type=int, default=6)
+    parser.add_argument("--process-ms", type=float, default=8.0)
+    parser.add_argument("--min-gap-ms", type=float, default=2.0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
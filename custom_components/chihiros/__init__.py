@@ -3,45 +3,73 @@
 from __future__ import annotations
 
 import logging
+import time
+from typing import TYPE_CHECKING
 
-try:
-    from homeassistant.components import bluetooth
+from .const import DOMAIN
+
+if TYPE_CHECKING:
     from homeassistant.config_entries import ConfigEntry
-    from homeassistant.const import Platform
     from homeassistant.core import HomeAssistant
-    from homeassistant.exceptions import ConfigEntryNotReady
 
-    # TODO List the platforms that you want to support.
-    # For your initial PR, limit it to 1 platform.
-    PLATFORMS: list[Platform] = [Platform.LIGHT]
-except ModuleNotFoundError:
-    pass
+# This package is also the parent of the chihirosctl CLI: Home Assistant and the
+# bluetooth stack are imported when an entry is set up, not when it is imported.
 
-from .chihiros_led_control.device import BaseDevice, get_model_class_from_name
-from .const import DOMAIN
-from .coordinator import ChihirosDataUpdateCoordinator
-from .models import ChihirosData
+PLATFORMS: list[str] = ["light"]
 
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """Set up chihiros from a config entry."""
+    """Set up chihiros from a config entry.
+
+    The name and the model of the device are stored in the entry, so the entry
+    is set up even if the device has not advertised yet since Home Assistant
+    started. The device is then pending: its commands are rejected until its
+    first advertisement binds it to the real bluetooth device.
+    """
+    from bleak.backends.device import BLEDevice
+    from homeassistant.components import bluetooth
+    from homeassistant.const import CONF_MODEL, CONF_NAME
+    from homeassistant.exceptions import ConfigEntryNotReady
+
+    from .chihiros_led_control.device import (
+        MODEL_CLASSES,
+        BaseDevice,
+        get_model_class_from_name,
+    )
+    from .coordinator import ChihirosDataUpdateCoordinator
+    from .models import ChihirosData
+
+    setup_start = time.monotonic()
     if entry.unique_id is None:
         raise ConfigEntryNotReady(f"Entry doesn't have any unique_id {entry.title}")
-    address: str = entry.unique_id
-    ble_device = bluetooth.async_ble_device_from_address(hass, address.upper(), True)
-    if not ble_device:
+    address: str = entry.unique_id.upper()
+    ble_device = bluetooth.async_ble_device_from_address(hass, address, True)
+    name: str | None = entry.data.get(CONF_NAME)
+    if not name and ble_device is not None:
+        name = ble_device.name
+    if not name:
         raise ConfigEntryNotReady(
-            f"Could not find Chihiros BLE device with address {address}"
+            f"Could not find the name of Chihiros BLE device with address {address}"
         )
-    if not ble_device.name:
-        raise ConfigEntryNotReady(
-            f"Found Chihiros BLE device with address {address} but can not find its name"
+    model: str | None = entry.data.get(CONF_MODEL)
+    if model is not None and model in MODEL_CLASSES:
+        model_class = MODEL_CLASSES[model]
+    else:
+        model_class = get_model_class_from_name(name)
+        model = model_class.__name__
+    if entry.data.get(CONF_NAME) != name or entry.data.get(CONF_MODEL) != model:
+        hass.config_entries.async_update_entry(
+            entry, data={**entry.data, CONF_NAME: name, CONF_MODEL: model}
         )
-    model_class = get_model_class_from_name(ble_device.name)
-    # TODO add password support
+
+    pending = ble_device is None
+    if ble_device is None:
+        ble_device = BLEDevice(address, name, None, 0)
     chihiros_device: BaseDevice = model_class(ble_device)
+    if pending:
+        chihiros_device.mark_unavailable()
 
     coordinator = ChihirosDataUpdateCoordinator(
         hass,
@@ -49,19 +77,41 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         ble_device,
     )
 
+    entry.async_on_unload(coordinator.async_start())
+
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = ChihirosData(
         entry.title, chihiros_device, coordinator
     )
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    entry.async_on_unload(entry.add_update_listener(_async_update_listener))
+
+    coordinator.timings.setup_started = setup_start
+    coordinator.timings.setup_duration = time.monotonic() - setup_start
+    _LOGGER.debug(
+        "%s: set up in %.1f ms%s",
+        address,
+        coordinator.timings.setup_duration * 1000,
+        ", waiting for its first advertisement" if pending else "",
+    )
 
     return True
 
 
+async def _async_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the entry when its options change."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
-    if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+    from .resync import async_get_resync_manager
+
+    unload_ok: bool = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
+    if unload_ok:
         hass.data[DOMAIN].pop(entry.entry_id)
+        # the lights keep their levels, they are not resynchronized on a reload
+        async_get_resync_manager(hass).async_entry_unloaded(entry.entry_id)
 
     return unload_ok
@@ -0,0 +1,283 @@
+"""Module running batches of device operations."""
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from bleak.backends.device import BLEDevice
+
+from .cache import DeviceCache
+from .const import DEFAULT_MAX_CONCURRENCY
+from .device import BaseDevice, get_devices_from_addresses, get_model_class_from_name
+from .device.base_device import deadline_from_timeout
+from .profiling import phase
+from .spans import span
+from .weekday_encoding import WeekdaySelect
+
+if TYPE_CHECKING:
+    from .device.adapters import AdapterPool
+    from .trace import TraceRecorder
+
+SUPPORTED_OPERATIONS = [
+    "turn_on",
+    "turn_off",
+    "set_brightness",
+    "set_color_brightness",
+    "set_rgb_brightness",
+    "add_setting",
+    "add_rgb_setting",
+    "remove_setting",
+    "reset_settings",
+    "enable_auto_mode",
+]
+
+_TIME_PARAMETERS = ["sunrise", "sunset"]
+
+
+class InvalidScriptError(Exception):
+    """Raised when a batch script can not be parsed."""
+
+
+@dataclass
+class Operation:
+    """Operation to run on a device."""
+
+    address: str
+    command: str
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    name: str | None = None
+
+
+@dataclass
+class OperationResult:
+    """Result of an operation."""
+
+    operation: Operation
+    frames: list[bytes] = field(default_factory=list)
+    error: str | None = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Return whether the operation succeeded."""
+        return self.error is None
+
+
+@dataclass
+class DeviceResult:
+    """Result of all the operations of one device."""
+
+    address: str
+    operations: list[OperationResult] = field(default_factory=list)
+    error: str | None = None
+    elapsed: float = 0.0
+    model: str | None = None
+    # writes carrying the frames, fewer than the frames when they are packed
+    writes: int = 0
+    # frames per second while writing
+    fps: float | None = None
+
+    @property
+    def ok(self) -> bool:
+        """Return whether all the operations of the device succeeded."""
+        return self.error is None and all(op.ok for op in self.operations)
+
+
+def parse_kwargs(command: str, raw: dict[str, Any]) -> dict[str, Any]:
+    """Convert json values to the types expected by the device methods."""
+    kwargs: dict[str, Any] = {}
+    for key, value in raw.items():
+        key = key.replace("-", "_")
+        if key in _TIME_PARAMETERS:
+            try:
+                value = datetime.strptime(value, "%H:%M")
+            except (TypeError, ValueError) as ex:
+                raise InvalidScriptError(f"{command}: invalid {key} `{value}`") from ex
+        elif key == "weekdays":
+            try:
+                value = [WeekdaySelect(day) for day in value]
+            except ValueError as ex:
+                raise InvalidScriptError(f"{command}: {ex}") from ex
+        elif key == "brightness" and isinstance(value, list):
+            value = tuple(value)
+        elif key == "max_brightness" and isinstance(value, list):
+            value = tuple(value)
+        kwargs[key] = value
+    return kwargs
+
+
+def parse_operations(data: Any) -> list[Operation]:
+    """Parse a list of operations.
+
+    Each operation is an object with an `address`, a `command` and the
+    parameters of the command, e.g.
+    {"address": "...", "command": "add-setting", "sunrise": "08:00", "sunset": "18:00"}
+    The optional `name` is the advertised name used to resolve the model on dry
+    runs, the discovery cache is used when it is missing.
+    """
+    if isinstance(data, dict):
+        data = data.get("operations")
+    if not isinstance(data, list):
+        raise InvalidScriptError("Script must contain a list of operations")
+    operations: list[Operation] = []
+    for index, raw in enumerate(data):
+        if not isinstance(raw, dict):
+            raise InvalidScriptError(f"Operation #{index} must be an object")
+        raw = dict(raw)
+        address = raw.pop("address", None)
+        command = raw.pop("command", None)
+        name = raw.pop("name", None)
+        if not address or not command:
+            raise InvalidScriptError(
+                f"Operation #{index} needs an address and a command"
+            )
+        command = command.replace("-", "_")
+        if command not in SUPPORTED_OPERATIONS:
+            raise InvalidScriptError(f"Operation #{index}: unknown command `{command}`")
+        operations.append(Operation(address, command, parse_kwargs(command, raw), name))
+    return operations
+
+
+def load_script(path: Path) -> list[Operation]:
+    """Load operations from a json script file."""
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError) as ex:
+        raise InvalidScriptError(f"Can not read script {path}: {ex}") from ex
+    return parse_operations(data)
+
+
+def group_operations(operations: list[Operation]) -> dict[str, list[Operation]]:
+    """Group operations by device address, keeping their order."""
+    groups: dict[str, list[Operation]] = {}
+    for operation in operations:
+        groups.setdefault(operation.address.upper(), []).append(operation)
+    return groups
+
+
+async def _encode_operations(
+    dev: BaseDevice, operations: list[Operation]
+) -> list[OperationResult]:
+    """Encode the operations of a device without sending them."""
+    results: list[OperationResult] = []
+    for operation in operations:
+        result = OperationResult(operation)
+        start = time.perf_counter()
+        if not hasattr(dev, operation.command):
+            result.error = (
+                f"{dev.__class__.__name__} doesn't support {operation.command}"
+            )
+        else:
+            try:
+                with dev.capture_commands() as frames:
+                    await getattr(dev, operation.command)(**operation.kwargs)
+            except TypeError as ex:
+                result.error = str(ex)
+            else:
+                result.frames = frames
+        result.elapsed = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+async def _run_device_operations(
+    address: str,
+    operations: list[Operation],
+    dev: BaseDevice | None,
+    dry_run: bool,
+    timeout: float | None = None,
+) -> DeviceResult:
+    """Run all the operations of one device in a single connection."""
+    device_result = DeviceResult(address)
+    start = time.perf_counter()
+    deadline = deadline_from_timeout(timeout)
+    if dev is None:
+        device_result.error = "device not found"
+        return device_result
+    device_result.model = dev.model_name
+    with span("run_operations", device=address, operations=len(operations)) as current:
+        try:
+            with phase("encode", address):
+                device_result.operations = await _encode_operations(dev, operations)
+            if not dry_run:
+                await dev.send_operations(
+                    [result.frames for result in device_result.operations], deadline
+                )
+                device_result.writes = dev.writer.stats.writes
+                device_result.fps = dev.writer.stats.fps
+        except Exception as ex:  # pylint: disable=broad-except
+            device_result.error = f"{ex.__class__.__name__}: {ex}"
+            if current is not None:
+                current.error = device_result.error
+        finally:
+            if not dry_run:
+                await dev.disconnect()
+    device_result.elapsed = time.perf_counter() - start
+    return device_result
+
+
+def _get_offline_device(
+    address: str, operations: list[Operation], use_cache: bool
+) -> BaseDevice:
+    """Get a device that is never connected, used to encode dry runs."""
+    name = next((op.name for op in operations if op.name), None)
+    if name is None and use_cache and (cached := DeviceCache().get(address)):
+        name = cached.name
+    model_class = get_model_class_from_name(name or "")
+    return model_class(BLEDevice(address, name, None, 0))
+
+
+async def run_operations(
+    operations: list[Operation],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    dry_run: bool = False,
+    use_cache: bool = True,
+    timeout: float | None = None,
+    tracer: "TraceRecorder | None" = None,
+    pool: "AdapterPool | None" = None,
+    pack_frames: bool | None = None,
+) -> list[DeviceResult]:
+    """Run operations, one connection per device and devices concurrently.
+
+    All the devices are resolved by a single scan before running the operations.
+    Each device must complete its operations within `timeout` seconds, counted
+    once it gets its turn. The bluetooth sessions are recorded by `tracer`
+    and the connections are spread over the adapters of `pool`. `pack_frames`
+    overrides whether the frames are packed into the writes, see
+    `BaseDevice.set_frame_packing`.
+    """
+    groups = group_operations(operations)
+    devices: dict[str, BaseDevice]
+    if dry_run:
+        devices = {
+            address: _get_offline_device(address, device_operations, use_cache)
+            for address, device_operations in groups.items()
+        }
+    else:
+        devices = await get_devices_from_addresses(
+            groups, use_cache=use_cache, pool=pool
+        )
+        for dev in devices.values():
+            dev.set_frame_packing(pack_frames)
+            if tracer is not None:
+                dev.set_tracer(tracer)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(address: str, device_operations: list[Operation]) -> DeviceResult:
+        async with semaphore:
+            return await _run_device_operations(
+                address, device_operations, devices.get(address), dry_run, timeout
+            )
+
+    return list(
+        await asyncio.gather(
+            *(
+                _run(address, device_operations)
+                for address, device_operations in groups.items()
+            )
+        )
+    )
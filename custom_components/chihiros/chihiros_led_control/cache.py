@@ -0,0 +1,146 @@
+"""Module persisting discovered devices to skip bluetooth scans."""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from bleak.backends.device import BLEDevice
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+CACHE_VERSION = 1
+
+
+def default_cache_path() -> Path:
+    """Return the path of the cache file of the current user."""
+    if env_path := os.environ.get("CHIHIROS_CACHE_FILE"):
+        return Path(env_path)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "chihiros" / "devices.json"
+
+
+@dataclass
+class CachedDevice:
+    """Device seen during a previous scan."""
+
+    address: str
+    name: str
+    model: str
+    last_seen: float
+    rssi: int | None = None
+    # BlueZ object path and adapter, the only details needed to connect without a scan
+    path: str | None = None
+    adapter: str | None = None
+
+    def to_ble_device(self) -> BLEDevice | None:
+        """Build a BLEDevice from the cached data if it is possible on this platform."""
+        if self.path is None:
+            return None
+        props: dict[str, Any] = {"Address": self.address, "Name": self.name}
+        if self.adapter is not None:
+            props["Adapter"] = self.adapter
+        return BLEDevice(
+            self.address, self.name, {"path": self.path, "props": props}, self.rssi or 0
+        )
+
+
+class DeviceCache:
+    """On disk cache mapping device addresses to their last advertisement."""
+
+    def __init__(
+        self, path: Path | None = None, ttl: float = DEFAULT_CACHE_TTL
+    ) -> None:
+        """Create a new cache."""
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self._devices: dict[str, CachedDevice] | None = None
+        self._dirty = False
+
+    def _load(self) -> dict[str, CachedDevice]:
+        """Load the cache file once."""
+        if self._devices is not None:
+            return self._devices
+        self._devices = {}
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return self._devices
+        except (OSError, ValueError):
+            _LOGGER.debug("Ignoring unreadable cache %s", self.path, exc_info=True)
+            return self._devices
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            return self._devices
+        for raw in data.get("devices", []):
+            try:
+                device = CachedDevice(**raw)
+            except TypeError:
+                continue
+            self._devices[device.address] = device
+        return self._devices
+
+    def _save(self) -> None:
+        """Atomically write the cache file."""
+        self._dirty = False
+        devices = self._load()
+        data = {
+            "version": CACHE_VERSION,
+            "devices": [asdict(device) for device in devices.values()],
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(data, tmp_file, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            _LOGGER.debug("Can not write cache %s", self.path, exc_info=True)
+
+    def get(self, address: str) -> CachedDevice | None:
+        """Get a cached device if it has been seen within the ttl."""
+        device = self._load().get(address.upper())
+        if device is None or time.time() - device.last_seen > self.ttl:
+            return None
+        return device
+
+    def update(
+        self, ble_device: BLEDevice, model: str, rssi: int | None = None
+    ) -> None:
+        """Store or refresh a device after it has been seen advertising.
+
+        The change is only written by `flush`, once a scan is over.
+        """
+        if ble_device.name is None:
+            return
+        path: str | None = None
+        adapter: str | None = None
+        if isinstance(ble_device.details, dict):
+            path = ble_device.details.get("path")
+            props = ble_device.details.get("props")
+            if isinstance(props, dict):
+                adapter = props.get("Adapter")
+        self._load()[ble_device.address.upper()] = CachedDevice(
+            ble_device.address.upper(),
+            ble_device.name,
+            model,
+            time.time(),
+            rssi,
+            path,
+            adapter,
+        )
+        self._dirty = True
+
+    def invalidate(self, address: str) -> None:
+        """Remove a device from the cache, until the next `flush`."""
+        if self._load().pop(address.upper(), None) is not None:
+            self._dirty = True
+
+    def flush(self) -> None:
+        """Write the cache file if devices have been updated or removed."""
+        if self._dirty:
+            self._save()
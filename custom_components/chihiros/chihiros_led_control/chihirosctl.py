@@ -1,99 +1,358 @@
 """Chihiros led control CLI entrypoint."""
 
 import asyncio
-import inspect
+import time
+from contextlib import AbstractContextManager, aclosing, nullcontext
+from dataclasses import replace
 from datetime import datetime
-from typing import Any
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Coroutine, Optional, TypeVar
 
 import typer
-from bleak import BleakScanner
 from rich import print
 from rich.table import Table
 from typing_extensions import Annotated
 
 from . import commands
-from .device import get_device_from_address, get_model_class_from_name
+from .const import DEFAULT_MAX_CONCURRENCY
 from .weekday_encoding import WeekdaySelect
 
+if TYPE_CHECKING:
+    from .batch import Operation
+    from .device.adapters import AdapterPool
+    from .profiling import Profiler
+
+_T = TypeVar("_T")
+
+# The bluetooth stack and the device modules are imported by the commands
+# using them, so that the startup of the CLI stays fast.
+
 app = typer.Typer()
 
 msg_id = commands.next_message_id()
 
+_options: dict[str, Any] = {
+    "use_cache": True,
+    "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+    "groups_file": None,
+    "timeout": None,
+    "trace": None,
+    "adapters": None,
+    "profile": None,
+    "profile_sample_ms": None,
+    "pack_frames": None,
+}
+
+DeviceTargets = Annotated[
+    list[str],
+    typer.Argument(
+        help="Addresses of the lights or names of groups from the groups file.",
+        show_default=False,
+    ),
+]
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    use_cache: Annotated[
+        bool,
+        typer.Option(
+            "--cache/--no-cache",
+            help="Use the discovery cache instead of scanning for known devices.",
+        ),
+    ] = True,
+    max_concurrency: Annotated[
+        int, typer.Option(min=1, help="Maximum number of lights controlled at once.")
+    ] = DEFAULT_MAX_CONCURRENCY,
+    groups_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help="Json file mapping group names to addresses "
+            "[default: ~/.config/chihiros/groups.json]",
+        ),
+    ] = None,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option(
+            min=0, help="Give up on a light not done after that many seconds."
+        ),
+    ] = None,
+    trace: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False, help="Record the bluetooth sessions to a trace file."
+        ),
+    ] = None,
+    adapters: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--adapter",
+            help="Bluetooth adapter to spread the connections over, e.g. hci1. "
+            "Can be repeated.",
+            show_default=False,
+        ),
+    ] = None,
+    profile: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help="Write a profile of the command to a file in the Chrome trace "
+            "event format and print the time spent in each phase.",
+        ),
+    ] = None,
+    profile_sample_ms: Annotated[
+        Optional[float],
+        typer.Option(
+            min=0.1, help="Also sample the stack every that many milliseconds."
+        ),
+    ] = None,
+    spans: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help="Append the timed steps of the commands to a json lines file.",
+        ),
+    ] = None,
+    pack_frames: Annotated[
+        Optional[bool],
+        typer.Option(
+            "--pack-frames/--no-pack-frames",
+            help="Pack several frames per write as the link mtu allows "
+            "[default: only for the models known to support it]",
+            show_default=False,
+        ),
+    ] = None,
+) -> None:
+    """Control Chihiros LEDs over bluetooth."""
+    _options["use_cache"] = use_cache
+    _options["max_concurrency"] = max_concurrency
+    _options["groups_file"] = groups_file
+    _options["timeout"] = timeout
+    _options["trace"] = trace
+    _options["adapters"] = adapters
+    _options["profile"] = profile
+    _options["profile_sample_ms"] = profile_sample_ms
+    _options["pack_frames"] = pack_frames
+    if spans is not None:
+        from .spans import JsonLinesSpanExporter, set_span_exporter
+
+        exporter = JsonLinesSpanExporter(spans)
+        set_span_exporter(exporter)
+        ctx.call_on_close(exporter.close)
+
+
+def _run(coro: Coroutine[Any, Any, _T]) -> _T:
+    """Run a coroutine, profiled if the profile option is set."""
+    if _options["profile"] is None:
+        return asyncio.run(coro)
+    from .profiling import Profiler
+
+    sample_ms = _options["profile_sample_ms"]
+    profiler = Profiler(
+        _options["profile"], None if sample_ms is None else sample_ms / 1000
+    )
 
-def _run_device_func(device_address: str, **kwargs: Any) -> None:
-    command_name = inspect.stack()[1][3]
+    async def _profiled() -> _T:
+        async with profiler:
+            return await coro
 
-    async def _async_func() -> None:
-        dev = await get_device_from_address(device_address)
-        if hasattr(dev, command_name):
-            await getattr(dev, command_name)(**kwargs)
-        else:
-            print(f"{dev.__class__.__name__} doesn't support {command_name}")
-            raise typer.Abort()
+    try:
+        return asyncio.run(_profiled())
+    finally:
+        _print_profile(profiler)
+
+
+def _print_profile(profiler: "Profiler") -> None:
+    """Print the time spent in each phase of a profile."""
+    table = Table("Phase", "Count", "Total (ms)", "Mean (ms)", "Max (ms)")
+    for name, stats in sorted(
+        profiler.phases.items(), key=lambda item: item[1].total, reverse=True
+    ):
+        table.add_row(
+            name,
+            str(stats.count),
+            f"{stats.total * 1000:.1f}",
+            f"{stats.total / stats.count * 1000:.1f}",
+            f"{stats.max * 1000:.1f}",
+        )
+    print(table)
+    print(
+        f"Event loop blocked {profiler.stalls} times for more than "
+        f"{profiler.block_threshold * 1000:.0f} ms, profile written to {profiler.path}"
+    )
+
+
+def _tracer() -> AbstractContextManager[Any]:
+    """Return the recorder of the trace option, if any."""
+    if _options["trace"] is None:
+        return nullcontext()
+    from .trace import TraceRecorder
+
+    return TraceRecorder(_options["trace"])
+
+
+def _adapter_pool() -> "AdapterPool | None":
+    """Return the pool of the adapter options, if any."""
+    if not _options["adapters"]:
+        return None
+    from .device.adapters import AdapterPool
+
+    return AdapterPool(_options["adapters"])
+
+
+def _print_adapters(pool: "AdapterPool | None") -> None:
+    """Print the occupancy and the success rate of the adapters of a pool."""
+    if pool is None:
+        return
+    table = Table("Adapter", "Connected", "Capacity", "Attempts", "Success rate")
+    for adapter in pool.adapters.values():
+        rate = adapter.success_rate
+        table.add_row(
+            adapter.name,
+            str(len(adapter.connected)),
+            str(adapter.capacity),
+            str(adapter.attempts),
+            "" if rate is None else f"{rate:.0%}",
+        )
+    print(table)
 
-    asyncio.run(_async_func())
+
+def _resolve_targets(targets: list[str]) -> list[str]:
+    from .groups import InvalidGroupsError, load_groups, resolve_targets
+
+    try:
+        return resolve_targets(targets, load_groups(_options["groups_file"]))
+    except InvalidGroupsError as ex:
+        print(f"[red]{ex}[/red]")
+        raise typer.Exit(code=1)
+
+
+def _run_device_func(
+    command_name: str, device_targets: list[str], **kwargs: Any
+) -> None:
+    from .batch import Operation, run_operations
+
+    operations = [
+        Operation(address, command_name, kwargs)
+        for address in _resolve_targets(device_targets)
+    ]
+    pool = _adapter_pool()
+    start = time.perf_counter()
+    with _tracer() as tracer:
+        results = _run(
+            run_operations(
+                operations,
+                _options["max_concurrency"],
+                use_cache=_options["use_cache"],
+                timeout=_options["timeout"],
+                tracer=tracer,
+                pool=pool,
+                pack_frames=_options["pack_frames"],
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    table = Table("Address", "Model", "Status", "Time (ms)")
+    for device_result in results:
+        errors = [device_result.error] + [r.error for r in device_result.operations]
+        error = next((e for e in errors if e is not None), None)
+        table.add_row(
+            device_result.address,
+            device_result.model or "???",
+            "[green]ok[/green]" if error is None else f"[red]{error}[/red]",
+            f"{device_result.elapsed * 1000:.1f}",
+        )
+    print(table)
+    _print_adapters(pool)
+    print(f"Ran {command_name} on {len(results)} devices in {elapsed:.2f}s")
+    if not all(device_result.ok for device_result in results):
+        raise typer.Exit(code=1)
 
 
 @app.command()
-def list_devices(timeout: Annotated[int, typer.Option()] = 5) -> None:
-    """List all bluetooth devices.
+def list_devices(
+    timeout: Annotated[int, typer.Option()] = 5,
+    limit: Annotated[
+        Optional[int], typer.Option(min=1, help="Stop after finding that many devices.")
+    ] = None,
+    all_devices: Annotated[
+        bool, typer.Option("--all", help="Show all bluetooth devices.")
+    ] = False,
+) -> None:
+    """List Chihiros bluetooth devices."""
+    from .cache import DeviceCache
+    from .device import Fallback, discover_devices
 
-    TODO: add an option to show only Chihiros devices
-    """
-    table = Table("Name", "Address", "Model")
-    discovered_devices = asyncio.run(BleakScanner.discover(timeout=timeout))
-    for device in discovered_devices:
-        model_name = "???"
-        if device.name is not None:
-            model_class = get_model_class_from_name(device.name)
-            if model_class.model_code:  # type: ignore
-                model_name = model_class.model_name  # type: ignore
-        table.add_row(device.name, device.address, model_name)
+    table = Table("Name", "Address", "Model", "RSSI")
+
+    async def _async_func() -> None:
+        async with aclosing(
+            discover_devices(
+                timeout,
+                limit=limit,
+                chihiros_only=not all_devices,
+                cache=DeviceCache(),
+                pool=_adapter_pool(),
+            )
+        ) as discovered:
+            async for dev in discovered:
+                model_name = "???" if isinstance(dev, Fallback) else dev.model_name
+                table.add_row(
+                    dev.ble_device.name, dev.address, model_name, str(dev.rssi)
+                )
+
+    _run(_async_func())
     print("Discovered the following devices:")
     print(table)
 
 
 @app.command()
-def turn_on(device_address: str) -> None:
+def turn_on(device_address: DeviceTargets) -> None:
     """Turn on a light."""
-    _run_device_func(device_address)
+    _run_device_func("turn_on", device_address)
 
 
 @app.command()
-def turn_off(device_address: str) -> None:
+def turn_off(device_address: DeviceTargets) -> None:
     """Turn off a light."""
-    _run_device_func(device_address)
+    _run_device_func("turn_off", device_address)
 
 
 @app.command()
 def set_color_brightness(
-    device_address: str,
+    device_address: DeviceTargets,
     color: int,
     brightness: Annotated[int, typer.Argument(min=0, max=100)],
 ) -> None:
     """Set color brightness of a light."""
-    _run_device_func(device_address, color=color, brightness=brightness)
+    _run_device_func(
+        "set_color_brightness", device_address, color=color, brightness=brightness
+    )
 
 
 @app.command()
 def set_brightness(
-    device_address: str, brightness: Annotated[int, typer.Argument(min=0, max=100)]
+    device_address: DeviceTargets,
+    brightness: Annotated[int, typer.Argument(min=0, max=100)],
 ) -> None:
     """Set brightness of a light."""
-    set_color_brightness(device_address, color=0, brightness=brightness)
+    _run_device_func("set_brightness", device_address, brightness=brightness)
 
 
 @app.command()
 def set_rgb_brightness(
-    device_address: str, brightness: Annotated[tuple[int, int, int], typer.Argument()]
+    device_address: DeviceTargets,
+    brightness: Annotated[tuple[int, int, int], typer.Argument()],
 ) -> None:
     """Set brightness of a RGB light."""
-    _run_device_func(device_address, brightness=brightness)
+    _run_device_func("set_rgb_brightness", device_address, brightness=brightness)
 
 
 @app.command()
 def add_setting(
-    device_address: str,
+    device_address: DeviceTargets,
     sunrise: Annotated[datetime, typer.Argument(formats=["%H:%M"])],
     sunset: Annotated[datetime, typer.Argument(formats=["%H:%M"])],
     max_brightness: Annotated[int, typer.Option(max=100, min=0)] = 100,
@@ -102,6 +361,7 @@ def add_setting(
 ) -> None:
     """Add setting to a light."""
     _run_device_func(
+        "add_setting",
         device_address,
         sunrise=sunrise,
         sunset=sunset,
@@ -113,7 +373,7 @@ def add_setting(
 
 @app.command()
 def add_rgb_setting(
-    device_address: str,
+    device_address: DeviceTargets,
     sunrise: Annotated[datetime, typer.Argument(formats=["%H:%M"])],
     sunset: Annotated[datetime, typer.Argument(formats=["%H:%M"])],
     max_brightness: Annotated[tuple[int, int, int], typer.Option()] = (100, 100, 100),
@@ -122,6 +382,7 @@ def add_rgb_setting(
 ) -> None:
     """Add setting to a RGB light."""
     _run_device_func(
+        "add_rgb_setting",
         device_address,
         sunrise=sunrise,
         sunset=sunset,
@@ -133,7 +394,7 @@ def add_rgb_setting(
 
 @app.command()
 def remove_setting(
-    device_address: str,
+    device_address: DeviceTargets,
     sunrise: Annotated[datetime, typer.Argument(formats=["%H:%M"])],
     sunset: Annotated[datetime, typer.Argument(formats=["%H:%M"])],
     ramp_up_in_minutes: Annotated[int, typer.Option(min=0, max=150)] = 0,
@@ -141,6 +402,7 @@ def remove_setting(
 ) -> None:
     """Remove setting from a light."""
     _run_device_func(
+        "remove_setting",
         device_address,
         sunrise=sunrise,
         sunset=sunset,
@@ -150,15 +412,254 @@ def remove_setting(
 
 
 @app.command()
-def reset_settings(device_address: str) -> None:
+def reset_settings(device_address: DeviceTargets) -> None:
     """Reset settings from a light."""
-    _run_device_func(device_address)
+    _run_device_func("reset_settings", device_address)
 
 
 @app.command()
-def enable_auto_mode(device_address: str) -> None:
+def enable_auto_mode(device_address: DeviceTargets) -> None:
     """Enable auto mode in a light."""
-    _run_device_func(device_address)
+    _run_device_func("enable_auto_mode", device_address)
+
+
+@app.command()
+def run(
+    script: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    max_concurrency: Annotated[Optional[int], typer.Option(min=1)] = None,
+    dry_run: Annotated[bool, typer.Option()] = False,
+) -> None:
+    """Run a json script of operations on one or many lights.
+
+    The address of an operation can also be the name of a group.
+    """
+    from . import batch
+
+    try:
+        operations = [
+            replace(operation, address=address)
+            for operation in batch.load_script(script)
+            for address in _resolve_targets([operation.address])
+        ]
+    except batch.InvalidScriptError as ex:
+        print(f"[red]{ex}[/red]")
+        raise typer.Exit(code=1)
+    max_concurrency = max_concurrency or _options["max_concurrency"]
+
+    pool = _adapter_pool()
+    start = time.perf_counter()
+    with _tracer() as tracer:
+        results = _run(
+            batch.run_operations(
+                operations,
+                max_concurrency,
+                dry_run=dry_run,
+                use_cache=_options["use_cache"],
+                timeout=_options["timeout"],
+                tracer=tracer,
+                pool=pool,
+                pack_frames=_options["pack_frames"],
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    table = Table("Address", "Operation", "Status", "Frames", "Time (ms)")
+    for device_result in results:
+        for result in device_result.operations:
+            error = result.error or device_result.error
+            frames = "\n".join(frame.hex() for frame in result.frames)
+            table.add_row(
+                device_result.address,
+                result.operation.command,
+                "[green]ok[/green]" if error is None else f"[red]{error}[/red]",
+                frames if dry_run else str(len(result.frames)),
+                f"{result.elapsed * 1000:.1f}",
+            )
+        if not device_result.operations:
+            table.add_row(
+                device_result.address, "", f"[red]{device_result.error}[/red]", "", ""
+            )
+        writes = ""
+        if device_result.writes:
+            frame_count = sum(len(result.frames) for result in device_result.operations)
+            writes = f"{frame_count} in {device_result.writes} writes"
+            if device_result.fps is not None:
+                writes += f", {device_result.fps:.0f} fps"
+        table.add_row(
+            device_result.address,
+            "[bold]total[/bold]",
+            "",
+            writes,
+            f"{device_result.elapsed * 1000:.1f}",
+            end_section=True,
+        )
+    print(table)
+    _print_adapters(pool)
+    print(
+        f"Ran {len(operations)} operations on {len(results)} devices in {elapsed:.2f}s"
+    )
+    if not all(device_result.ok for device_result in results):
+        raise typer.Exit(code=1)
+
+
+def _describe(operation: "Operation") -> str:
+    """Return a short description of an operation of a plan."""
+    kwargs = operation.kwargs
+    if "sunrise" in kwargs:
+        return f"{operation.command} {kwargs['sunrise']:%H:%M}-{kwargs['sunset']:%H:%M}"
+    if operation.command == "set_color_brightness":
+        return f"{operation.command} {kwargs['color']}={kwargs['brightness']}"
+    return operation.command
+
+
+@app.command()
+def apply(
+    fleet_file: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    max_concurrency: Annotated[Optional[int], typer.Option(min=1)] = None,
+    retries: Annotated[int, typer.Option(min=0)] = 2,
+    full: Annotated[
+        bool,
+        typer.Option(help="Ignore the record of the applied states."),
+    ] = False,
+    dry_run: Annotated[bool, typer.Option(help="Only print the plan.")] = False,
+    yes: Annotated[bool, typer.Option("--yes", "-y")] = False,
+) -> None:
+    """Converge the lights to the states described by a json fleet file.
+
+    Only the changes since the last applied states are sent, applying the
+    same fleet again does nothing.
+    """
+    from . import fleet
+    from .groups import InvalidGroupsError, load_groups
+
+    try:
+        desired = fleet.load_fleet(fleet_file, load_groups(_options["groups_file"]))
+    except (fleet.InvalidFleetError, InvalidGroupsError) as ex:
+        print(f"[red]{ex}[/red]")
+        raise typer.Exit(code=1)
+    record = fleet.AppliedRecord()
+    plan = fleet.plan_fleet(desired, record, full)
+    if not plan:
+        print(f"Nothing to do, {len(desired)} lights are up to date")
+        return
+
+    table = Table("Address", "Changes")
+    for address, operations in plan.items():
+        table.add_row(address, "\n".join(_describe(op) for op in operations))
+    print(table)
+    print(f"{len(plan)} of {len(desired)} lights to change")
+    if dry_run or not (yes or typer.confirm("Apply?")):
+        return
+
+    pool = _adapter_pool()
+    start = time.perf_counter()
+    with _tracer() as tracer:
+        results, attempts = _run(
+            fleet.apply_plan(
+                plan,
+                desired,
+                record,
+                max_concurrency or _options["max_concurrency"],
+                retries,
+                use_cache=_options["use_cache"],
+                timeout=_options["timeout"],
+                tracer=tracer,
+                pool=pool,
+                pack_frames=_options["pack_frames"],
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    table = Table("Address", "Status", "Attempts", "Time (ms)")
+    for address, result in results.items():
+        error = result.error or next(
+            (op.error for op in result.operations if op.error is not None), None
+        )
+        table.add_row(
+            address,
+            "[green]ok[/green]" if error is None else f"[red]{error}[/red]",
+            str(attempts[address]),
+            f"{result.elapsed * 1000:.1f}",
+        )
+    print(table)
+    _print_adapters(pool)
+    failed = sum(not result.ok for result in results.values())
+    print(f"Applied {len(plan) - failed} of {len(plan)} lights in {elapsed:.2f}s")
+    if failed:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def predict(
+    script: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    at: Annotated[
+        Optional[datetime],
+        typer.Option(
+            formats=["%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M"],
+            help="Time of the prediction [default: now]",
+        ),
+    ] = None,
+) -> None:
+    """Predict the levels of lights in auto mode from the settings of a script.
+
+    The settings added, removed and reset by the script are assumed to be the
+    only ones of each light.
+    """
+    from .batch import InvalidScriptError, load_script
+    from .schedule import CHANNELS, ScheduleEvaluator
+
+    try:
+        evaluator = ScheduleEvaluator.from_operations(load_script(script))
+    except InvalidScriptError as ex:
+        print(f"[red]{ex}[/red]")
+        raise typer.Exit(code=1)
+    when = at or datetime.now()
+    table = Table("Address", *(f"Channel {channel}" for channel in range(CHANNELS)))
+    for address, levels in evaluator.evaluate(when).items():
+        table.add_row(address, *(str(level) for level in levels))
+    print(table)
+    print(f"Predicted levels on {when:%A %Y-%m-%d %H:%M}")
+
+
+@app.command()
+def replay(
+    trace: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    speed: Annotated[
+        float, typer.Option(min=0.01, help="Replay that many times faster.")
+    ] = 1.0,
+) -> None:
+    """Replay the commands of a trace against the recorded bluetooth sessions."""
+    from .trace import InvalidTraceError, replay_trace
+
+    def _latencies(values: list[float]) -> str:
+        if not values:
+            return ""
+        return f"{sum(values) / len(values) * 1000:.1f} / {max(values) * 1000:.1f}"
+
+    try:
+        results = asyncio.run(replay_trace(trace, speed))
+    except InvalidTraceError as ex:
+        print(f"[red]{ex}[/red]")
+        raise typer.Exit(code=1)
+    table = Table(
+        "Address",
+        "Name",
+        "Commands",
+        "Errors",
+        "Recorded mean / max (ms)",
+        "Replayed mean / max (ms)",
+    )
+    for result in results:
+        table.add_row(
+            result.address,
+            result.name,
+            str(len(result.replayed)),
+            f"{result.errors} ({result.recorded_errors} recorded)",
+            _latencies(result.recorded),
+            _latencies(result.replayed),
+        )
+    print(table)
+    print(f"Replayed {trace} at {speed:g}x")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,314 @@
+"""Map colors to the channel levels of the lights.
+
+Colors are given the Home Assistant way: rgb and white components and a
+brightness from 0 to 255, hue in degrees and saturation in percent, or a
+color temperature in kelvin. A `ColorPipeline` turns them into the levels
+(0-100) of the channels of a model, through per channel lookup tables built
+from the gamma and the channel gains of the model in the catalog. Colors of
+many lights are mapped in one call, with numpy when it is installed.
+"""
+
+from __future__ import annotations
+
+import functools
+import math
+from typing import Any, Sequence
+
+from .device.catalog import FALLBACK_SPEC, MODEL_SPECS, ModelSpec
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None  # type: ignore[assignment]
+
+MAX_LEVEL = 100
+# the lookup tables are indexed by a component (0-255) scaled by the brightness
+# (0-255), without numpy the levels are computed the same way one by one
+LUT_LAST = 255
+# color names driving a channel, in order of preference when a channel has several
+_SOURCES = ("red", "green", "blue", "white")
+_WHITE = 3
+
+
+def hs_to_rgb(hue: Any, saturation: Any) -> Any:
+    """Return the rgb colors (0-255) of hues (degrees) and saturations (0-100).
+
+    Scalars give a tuple, sequences give an array of shape (n, 3) with numpy or
+    a list of tuples without it.
+    """
+    if np is not None and not isinstance(hue, (int, float)):
+        hue = np.asarray(hue, dtype=np.float64)
+        saturation = np.clip(np.asarray(saturation, dtype=np.float64), 0, 100) / 100
+        channels = []
+        for offset in (5, 3, 1):
+            k = (offset + hue / 60) % 6
+            channels.append(
+                255 * (1 - saturation * np.clip(np.minimum(k, 4 - k), 0, 1))
+            )
+        return np.stack(channels, axis=-1)
+    if isinstance(hue, (int, float)):
+        return _hs_to_rgb(hue, saturation)
+    return [_hs_to_rgb(h, s) for h, s in zip(hue, saturation)]
+
+
+def _hs_to_rgb(hue: float, saturation: float) -> tuple[float, float, float]:
+    saturation = min(max(saturation, 0), 100) / 100
+    channels = []
+    for offset in (5, 3, 1):
+        k = (offset + hue / 60) % 6
+        channels.append(255 * (1 - saturation * min(max(min(k, 4 - k), 0), 1)))
+    return channels[0], channels[1], channels[2]
+
+
+def color_temperature_to_rgb(kelvin: Any) -> Any:
+    """Return the rgb colors (0-255) of color temperatures (1000-40000 K).
+
+    This is the approximation of the black body colors used by Home Assistant.
+    Scalars give a tuple, sequences give an array of shape (n, 3) with numpy or
+    a list of tuples without it.
+    """
+    if np is not None and not isinstance(kelvin, (int, float)):
+        temperature = np.clip(np.asarray(kelvin, dtype=np.float64), 1000, 40000) / 100
+        warm = temperature <= 66
+        # keep the unused branches finite
+        hot = np.maximum(temperature - 60, 1)
+        red = np.where(warm, 255, 329.698727446 * hot**-0.1332047592)
+        green = np.where(
+            warm,
+            99.4708025861 * np.log(temperature) - 161.1195681661,
+            288.1221695283 * hot**-0.0755148492,
+        )
+        blue = np.where(
+            temperature >= 66,
+            255,
+            np.where(
+                temperature <= 19,
+                0,
+                138.5177312231 * np.log(np.maximum(temperature - 10, 1))
+                - 305.0447927307,
+            ),
+        )
+        return np.clip(np.stack((red, green, blue), axis=-1), 0, 255)
+    if isinstance(kelvin, (int, float)):
+        return _color_temperature_to_rgb(kelvin)
+    return [_color_temperature_to_rgb(value) for value in kelvin]
+
+
+def _color_temperature_to_rgb(kelvin: float) -> tuple[float, float, float]:
+    temperature = min(max(kelvin, 1000), 40000) / 100
+    if temperature <= 66:
+        red = 255.0
+        green = 99.4708025861 * math.log(temperature) - 161.1195681661
+    else:
+        red = 329.698727446 * (temperature - 60) ** -0.1332047592
+        green = 288.1221695283 * (temperature - 60) ** -0.0755148492
+    if temperature >= 66:
+        blue = 255.0
+    elif temperature <= 19:
+        blue = 0.0
+    else:
+        blue = 138.5177312231 * math.log(temperature - 10) - 305.0447927307
+    red, green, blue = (min(max(value, 0.0), 255.0) for value in (red, green, blue))
+    return red, green, blue
+
+
+class ColorPipeline:
+    """Map colors to the channel levels of a model.
+
+    Each channel is driven by one color component: models with rgb channels
+    take the rgb components, a white channel takes the white component, or
+    without one the common part of rgb (the rgb channels then only get the
+    rest), and models with a white channel only take the highest component.
+    The intensity of a component scaled by the brightness goes through the
+    lookup table of its channel: `level = MAX_LEVEL * gain * intensity ** gamma`
+    rounded down, at least 1 for any intensity so that a dim light stays on.
+    With the default gamma of 1 and unit gains, brightness maps to the levels
+    `int(brightness / 255 * 100)` the lights always got.
+    """
+
+    def __init__(
+        self,
+        spec: ModelSpec,
+        gamma: float | None = None,
+        channel_gains: dict[str, float] | None = None,
+    ) -> None:
+        """Create the pipeline of a model, optionally calibrated differently."""
+        self.gamma = spec.gamma if gamma is None else gamma
+        gains = {**spec.channel_gains, **(channel_gains or {})}
+        names: dict[int, str] = {}
+        for source in _SOURCES:
+            if (channel := spec.colors.get(source)) is not None:
+                names.setdefault(channel, source)
+        # names of the channels of the levels, in the order of their ids
+        self.channels: tuple[str, ...] = tuple(names[key] for key in sorted(names))
+        self._sources = [_SOURCES.index(name) for name in self.channels]
+        self._white_only = self._sources == [_WHITE]
+        # position in `channels` of the channel of each color of the model
+        self._positions = {
+            color: sorted(names).index(channel)
+            for color, channel in spec.colors.items()
+        }
+        self._gains = [gains.get(name, 1.0) for name in self.channels]
+        self._numpy_luts: Any = None
+        self._numpy_sources: Any = None
+        if np is not None:
+            # levels of each channel for all the indexes, see `_level`
+            indexes = np.arange(LUT_LAST + 1, dtype=np.float64) / LUT_LAST
+            luts = np.minimum(
+                MAX_LEVEL,
+                np.floor(
+                    MAX_LEVEL
+                    * np.array(self._gains)[:, None]
+                    * indexes[None, :] ** self.gamma
+                ),
+            )
+            luts[:, 1:] = np.maximum(luts[:, 1:], 1)
+            self._numpy_luts = luts.astype(np.uint8)
+            self._numpy_sources = np.array(self._sources, dtype=np.intp)
+
+    def _level(self, channel: int, component: float, brightness: float) -> int:
+        """Return the level of a channel for a component at a brightness."""
+        index = round(component * brightness / 255)
+        if not index:
+            return 0
+        level: float = (
+            MAX_LEVEL * self._gains[channel] * (index / LUT_LAST) ** self.gamma
+        )
+        return max(1, min(MAX_LEVEL, math.floor(level)))
+
+    @classmethod
+    def for_model(cls, class_name: str, gamma: float | None = None) -> ColorPipeline:
+        """Return the pipeline of a model of the catalog, e.g. `WRGBII`.
+
+        `gamma` replaces the one of the model, e.g. `PERCEPTUAL_GAMMA`.
+        """
+        return _pipeline_for_model(class_name, gamma)
+
+    def channel_level(self, color: str, brightness: float = 255) -> int:
+        """Return the level of the channel of a color at a brightness (0-255)."""
+        return self._level(
+            self._positions.get(color, 0), 255, min(max(brightness, 0), 255)
+        )
+
+    def levels_array(self, rgb: Any, brightness: Any = 255, white: Any = None) -> Any:
+        """Return the levels of the channels of many lights.
+
+        `rgb` holds a color per light, `brightness` and `white` (0-255) a value
+        per light or one for all. The result has a row per light and a column
+        per channel of `channels`: an integer array with numpy, else a list of
+        tuples.
+        """
+        if np is not None:
+            return self._levels_numpy(rgb, brightness, white)
+        count = len(rgb)
+        brightness = _per_light(brightness, count)
+        whites = None if white is None else _per_light(white, count)
+        return [
+            self._levels_python(color, level, None if whites is None else whites[index])
+            for index, (color, level) in enumerate(zip(rgb, brightness))
+        ]
+
+    def levels(
+        self, rgb: Any, brightness: Any = 255, white: Any = None
+    ) -> list[dict[str, int]]:
+        """Return the levels of many lights, keyed by channel name."""
+        rows = self.levels_array(rgb, brightness, white)
+        if np is not None:
+            rows = rows.tolist()
+        return [dict(zip(self.channels, row)) for row in rows]
+
+    def _levels_numpy(self, rgb: Any, brightness: Any, white: Any) -> Any:
+        """Map the colors in one vectorized pass."""
+        rgb = np.clip(np.asarray(rgb, dtype=np.float64).reshape(-1, 3), 0, 255)
+        brightness = np.clip(
+            np.asarray(brightness, dtype=np.float64).reshape(-1, 1), 0, 255
+        )
+        if white is not None:
+            white = np.clip(np.asarray(white, dtype=np.float64).reshape(-1, 1), 0, 255)
+        elif self._white_only:
+            white = rgb.max(axis=1, keepdims=True)
+        else:
+            white = rgb.min(axis=1, keepdims=True)
+            if _WHITE in self._sources:
+                rgb = rgb - white
+        components = np.concatenate(
+            (rgb, np.broadcast_to(white, (len(rgb), 1))), axis=1
+        )
+        indexes = np.rint(components[:, self._numpy_sources] * brightness / 255)
+        return self._numpy_luts[
+            np.arange(len(self.channels)), indexes.astype(np.intp)
+        ].astype(np.intp)
+
+    def _levels_python(
+        self, color: Sequence[float], brightness: float, white: float | None
+    ) -> tuple[int, ...]:
+        """Map the color of a single light."""
+        red, green, blue = (min(max(value, 0), 255) for value in color)
+        brightness = min(max(brightness, 0), 255)
+        if white is not None:
+            white = min(max(white, 0), 255)
+        elif self._white_only:
+            white = max(red, green, blue)
+        else:
+            white = min(red, green, blue)
+            if _WHITE in self._sources:
+                red, green, blue = red - white, green - white, blue - white
+        components = (red, green, blue, white)
+        return tuple(
+            self._level(channel, components[source], brightness)
+            for channel, source in enumerate(self._sources)
+        )
+
+
+def _per_light(value: Any, count: int) -> list[Any]:
+    """Return a value per light from a value for all or a sequence."""
+    if isinstance(value, (int, float)):
+        return [value] * count
+    return list(value)
+
+
+@functools.lru_cache(maxsize=None)
+def _pipeline_for_model(class_name: str, gamma: float | None = None) -> ColorPipeline:
+    return ColorPipeline(MODEL_SPECS.get(class_name, FALLBACK_SPEC), gamma)
+
+
+def fleet_levels(
+    models: Sequence[str], rgb: Any, brightness: Any = 255, white: Any = None
+) -> list[dict[str, int]]:
+    """Return the levels of lights of mixed models, keyed by channel name.
+
+    `models` holds the model (class name) of each light, the colors of the
+    lights of a model are mapped in one call.
+    """
+    count = len(models)
+    groups: dict[str, list[int]] = {}
+    for index, model in enumerate(models):
+        groups.setdefault(model, []).append(index)
+    result: list[dict[str, int]] = [{} for _ in range(count)]
+    if np is not None:
+        rgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3)
+        brightness = np.broadcast_to(np.asarray(brightness, dtype=np.float64), (count,))
+        if white is not None:
+            white = np.broadcast_to(np.asarray(white, dtype=np.float64), (count,))
+    else:
+        rgb = list(rgb)
+        brightness = _per_light(brightness, count)
+        if white is not None:
+            white = _per_light(white, count)
+    for model, indexes in groups.items():
+        pipeline = _pipeline_for_model(model)
+        if np is not None:
+            group_levels = pipeline.levels(
+                rgb[indexes],
+                brightness[indexes],
+                None if white is None else white[indexes],
+            )
+        else:
+            group_levels = pipeline.levels(
+                [rgb[index] for index in indexes],
+                [brightness[index] for index in indexes],
+                None if white is None else [white[index] for index in indexes],
+            )
+        for index, levels in zip(indexes, group_levels):
+            result[index] = levels
+    return result
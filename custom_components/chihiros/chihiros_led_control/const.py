@@ -3,3 +3,7 @@
 UART_SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
 UART_RX_CHAR_UUID = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"
 UART_TX_CHAR_UUID = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+
+DEFAULT_DISCOVERY_TIMEOUT = 10.0
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_PROBE_TIMEOUT = 20.0
@@ -1,47 +1,95 @@
-"""Module defining Chihiros devices."""
-
-import inspect
-import sys
-from typing import Callable
-
-from bleak import BleakScanner
-from bleak.backends.device import BLEDevice
-
-from ..exception import DeviceNotFound
-from .a2 import AII
-from .base_device import BaseDevice
-from .c2 import CII
-from .c2rgb import CIIRGB
-from .commander1 import Commander1
-from .fallback import Fallback
-from .tiny_terrarium_egg import TinyTerrariumEgg
-from .universal_wrgb import UniversalWRGB
-from .wrgb2 import WRGBII
-from .wrgb2_pro import WRGBIIPro
-from .wrgb2_slim import WRGBIISlim
-
-CODE2MODEL = {}
-for name, obj in inspect.getmembers(sys.modules[__name__]):
-    if inspect.isclass(obj) and issubclass(obj, BaseDevice):
-        for model_code in obj._model_codes:
-            CODE2MODEL[model_code] = obj
-
-
-def get_model_class_from_name(device_name: str) -> Callable[[BLEDevice], BaseDevice]:
+"""Module defining Chihiros devices.
+
+Device classes and the bluetooth helpers are imported on first access so that
+classifying a device name does not import the bluetooth stack.
+"""
+
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Mapping
+
+from .catalog import MODEL_CATALOG, MODEL_SPECS
+from .registry import MODEL_REGISTRY
+
+if TYPE_CHECKING:
+    from .a2 import AII
+    from .base_device import BaseDevice
+    from .c2 import CII
+    from .c2rgb import CIIRGB
+    from .commander1 import Commander1
+    from .discovery import (
+        ProbeResult,
+        discover_devices,
+        get_device_from_address,
+        get_devices_from_addresses,
+        probe_devices,
+    )
+    from .fallback import Fallback
+    from .priority import Priority, command_priority
+    from .tiny_terrarium_egg import TinyTerrariumEgg
+    from .universal_wrgb import UniversalWRGB
+    from .wrgb2 import WRGBII
+    from .wrgb2_pro import WRGBIIPro
+    from .wrgb2_slim import WRGBIISlim
+
+_LAZY_ATTRIBUTES: dict[str, str] = {
+    "BaseDevice": "base_device",
+    "Priority": "priority",
+    "command_priority": "priority",
+    "discover_devices": "discovery",
+    "get_device_from_address": "discovery",
+    "get_devices_from_addresses": "discovery",
+    "ProbeResult": "discovery",
+    "probe_devices": "discovery",
+    **{spec.class_name: spec.module for spec in MODEL_SPECS.values()},
+}
+
+
+class _LazyModelMapping(Mapping[str, "type[BaseDevice]"]):
+    """Mapping to model classes that are imported on first access."""
+
+    def __init__(self, class_names: dict[str, str]) -> None:
+        self._class_names = class_names
+
+    def __getitem__(self, key: str) -> type[BaseDevice]:
+        return MODEL_REGISTRY.get_class(MODEL_SPECS[self._class_names[key]])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._class_names)
+
+    def __len__(self) -> int:
+        return len(self._class_names)
+
+
+CODE2MODEL: Mapping[str, type[BaseDevice]] = _LazyModelMapping(
+    {code: spec.class_name for spec in MODEL_CATALOG for code in spec.codes}
+)
+
+MODEL_CLASSES: Mapping[str, type[BaseDevice]] = _LazyModelMapping(
+    {class_name: class_name for class_name in MODEL_SPECS}
+)
+
+
+def get_model_class_from_name(
+    device_name: str | None, service_uuids: Iterable[str] = ()
+) -> type[BaseDevice]:
     """Get device class name from device name."""
-    return CODE2MODEL.get(device_name[:-12], Fallback)
+    return MODEL_REGISTRY.get_class_from_name(device_name, service_uuids)
+
 
+def is_chihiros_advertisement(name: str | None, service_uuids: Iterable[str]) -> bool:
+    """Return whether an advertisement comes from a Chihiros device."""
+    return MODEL_REGISTRY.match(name, service_uuids) is not None
 
-async def get_device_from_address(device_address: str) -> BaseDevice:
-    """Get BLEDevice object from mac address."""
-    # TODO Add logger
-    ble_dev = await BleakScanner.find_device_by_address(device_address)  # type: ignore
-    if ble_dev and ble_dev.name is not None:
-        model_class = get_model_class_from_name(ble_dev.name)
-        dev: BaseDevice = model_class(ble_dev)
-        return dev
 
-    raise DeviceNotFound
+def __getattr__(name: str) -> Any:
+    """Import device classes and bluetooth helpers on first access."""
+    if (module_name := _LAZY_ATTRIBUTES.get(name)) is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
 
 
 __all__ = [
@@ -54,10 +102,17 @@ __all__ = [
     "CII",
     "CIIRGB",
     "UniversalWRGB",
-    "FallBack",
+    "Fallback",
     "BaseDevice",
-    "RGBMode",
+    "Priority",
+    "command_priority",
     "CODE2MODEL",
+    "MODEL_CLASSES",
+    "discover_devices",
     "get_device_from_address",
+    "get_devices_from_addresses",
+    "ProbeResult",
+    "probe_devices",
+    "is_chihiros_advertisement",
     "get_model_class_from_name",
 ]
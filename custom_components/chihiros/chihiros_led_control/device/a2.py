@@ -1,13 +1,15 @@
 """A2 device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["AII"]
 
 
 class AII(BaseDevice):
     """Chihiros A II device Class."""
 
-    _model_name = "A II"
-    _model_codes = ["DYNA2", "DYNA2N"]
-    _colors: dict[str, int] = {
-        "white": 0,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -0,0 +1,263 @@
+"""Pool of bluetooth adapters shared by the devices."""
+
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+from bleak.backends.device import BLEDevice
+from bleak_retry_connector import BleakOutOfConnectionSlotsError
+
+# connections held at once by an adapter until it is seen saturating sooner
+DEFAULT_MAX_CONNECTIONS = 5
+# sightings older than this are ignored, in seconds
+RSSI_MAX_AGE = 60.0
+# adapters whose rssi is within this margin of the best one are equivalent, in dBm
+RSSI_MARGIN = 6
+# an adapter failing that many connections in a row is avoided for a while
+MAX_CONSECUTIVE_FAILURES = 3
+FAILURE_COOLDOWN = 30.0
+
+_ADAPTER_IN_PATH = re.compile(r"^/org/bluez/([^/]+)")
+
+
+def adapter_of(ble_device: BLEDevice) -> str | None:
+    """Return the adapter a device was seen by, when known (BlueZ only)."""
+    details = ble_device.details
+    if not isinstance(details, dict):
+        return None
+    if adapter := details.get("props", {}).get("Adapter"):
+        return str(adapter).rsplit("/", 1)[-1]
+    if match := _ADAPTER_IN_PATH.match(details.get("path") or ""):
+        return match.group(1)
+    return None
+
+
+def _on_adapter(ble_device: BLEDevice, adapter: str) -> BLEDevice:
+    """Return the device as seen by another adapter."""
+    if adapter_of(ble_device) == adapter or not isinstance(ble_device.details, dict):
+        return ble_device
+    device_path = "dev_" + ble_device.address.upper().replace(":", "_")
+    props = {**ble_device.details.get("props", {}), "Adapter": f"/org/bluez/{adapter}"}
+    return BLEDevice(
+        ble_device.address,
+        ble_device.name,
+        {"path": f"/org/bluez/{adapter}/{device_path}", "props": props},
+        0,
+    )
+
+
+@dataclass
+class Adapter:
+    """Bluetooth adapter of a pool with its connections and counters."""
+
+    name: str
+    capacity: int = DEFAULT_MAX_CONNECTIONS
+    # addresses of the devices connected through the adapter
+    connected: set[str] = field(default_factory=set)
+    attempts: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    saturations: int = 0
+    avoid_until: float = float("-inf")
+
+    @property
+    def occupancy(self) -> float:
+        """Return the share of the connection slots in use."""
+        return len(self.connected) / self.capacity
+
+    @property
+    def free_slots(self) -> int:
+        """Return the number of connections the adapter can still take."""
+        return max(0, self.capacity - len(self.connected))
+
+    @property
+    def success_rate(self) -> float | None:
+        """Return the share of the connection attempts that succeeded."""
+        if not self.attempts:
+            return None
+        return (self.attempts - self.failures) / self.attempts
+
+
+@dataclass
+class _Sighting:
+    ble_device: BLEDevice
+    rssi: int
+    seen_at: float
+
+
+class AdapterPool:
+    """Place the connections of the devices on several bluetooth adapters.
+
+    A connection goes to the adapter that saw the device with the best recent
+    rssi, adapters within `RSSI_MARGIN` of it being equivalent, and then to
+    the least occupied one. Adapters with no free slot or failing repeatedly
+    are avoided, and so is the adapter of the last failed attempt of a device.
+    When an adapter saturates or keeps failing, the idle devices connected
+    through it are asked to migrate to a better one.
+    """
+
+    def __init__(
+        self,
+        adapters: Iterable[str],
+        capacity: int = DEFAULT_MAX_CONNECTIONS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Create a pool of the given adapters, e.g. hci0 and hci1."""
+        self.adapters = {name: Adapter(name, capacity) for name in adapters}
+        if not self.adapters:
+            raise ValueError("An adapter pool needs at least one adapter")
+        self._clock = clock
+        self._sightings: dict[str, dict[str, _Sighting]] = {}
+        self._placements: dict[str, str] = {}
+        # adapter of the last failed connection of a device, tried last
+        self._failed_on: dict[str, str] = {}
+        self._migration_callbacks: dict[str, Callable[[], bool]] = {}
+
+    def observe(
+        self, ble_device: BLEDevice, rssi: int, adapter: str | None = None
+    ) -> None:
+        """Record an advertisement received by an adapter of the pool."""
+        if (adapter := adapter or adapter_of(ble_device)) not in self.adapters:
+            return
+        self._sightings.setdefault(ble_device.address.upper(), {})[adapter] = _Sighting(
+            ble_device, rssi, self._clock()
+        )
+
+    def rssi(self, address: str, adapter: str) -> int | None:
+        """Return the recent rssi of a device seen by an adapter."""
+        sighting = self._sightings.get(address.upper(), {}).get(adapter)
+        if sighting is None or self._clock() - sighting.seen_at > RSSI_MAX_AGE:
+            return None
+        return sighting.rssi
+
+    def placement(self, address: str) -> str | None:
+        """Return the adapter a device is connected through."""
+        return self._placements.get(address.upper())
+
+    def register_migration_callback(
+        self, address: str, callback: Callable[[], bool]
+    ) -> Callable[[], None]:
+        """Register the callback disconnecting an idle device to move it.
+
+        The callback returns whether the device is disconnecting, busy devices
+        stay. Return a function unregistering it.
+        """
+        address = address.upper()
+        self._migration_callbacks[address] = callback
+
+        def _unregister() -> None:
+            if self._migration_callbacks.get(address) is callback:
+                del self._migration_callbacks[address]
+
+        return _unregister
+
+    def _candidates(self, address: str, exclude: str | None = None) -> list[Adapter]:
+        """Return the adapters a device can be placed on, best first."""
+        now = self._clock()
+        adapters = [
+            adapter
+            for adapter in self.adapters.values()
+            if adapter.name != exclude and address not in adapter.connected
+        ]
+        usable = [
+            adapter
+            for adapter in adapters
+            if adapter.free_slots and adapter.avoid_until <= now
+        ] or [adapter for adapter in adapters if adapter.free_slots]
+        if not usable:
+            return []
+        signals = {adapter.name: self.rssi(address, adapter.name) for adapter in usable}
+        known = [rssi for rssi in signals.values() if rssi is not None]
+        best = max(known, default=None)
+
+        def _key(adapter: Adapter) -> tuple[bool, float, int]:
+            rssi = signals[adapter.name]
+            close = best is None or (rssi is not None and rssi >= best - RSSI_MARGIN)
+            return not close, adapter.occupancy, -(rssi or -127)
+
+        return sorted(usable, key=_key)
+
+    def place(self, ble_device: BLEDevice) -> tuple[str, BLEDevice]:
+        """Choose the adapter of a connection attempt.
+
+        Return its name and the device to connect to through it.
+        """
+        address = ble_device.address.upper()
+        candidates = self._candidates(address, self._failed_on.get(address))
+        candidates = candidates or self._candidates(address)
+        if candidates:
+            adapter = candidates[0]
+        else:
+            # every adapter is full, let the connection fail on the least busy
+            adapter = min(self.adapters.values(), key=lambda adapter: adapter.occupancy)
+        adapter.attempts += 1
+        sighting = self._sightings.get(address, {}).get(adapter.name)
+        if sighting is not None:
+            return adapter.name, sighting.ble_device
+        return adapter.name, _on_adapter(ble_device, adapter.name)
+
+    def connected(self, address: str, adapter: str) -> None:
+        """Record a successful connection."""
+        address = address.upper()
+        self.released(address)
+        pooled = self.adapters[adapter]
+        pooled.consecutive_failures = 0
+        pooled.connected.add(address)
+        # it took more connections than expected
+        pooled.capacity = max(pooled.capacity, len(pooled.connected))
+        self._placements[address] = adapter
+        self._failed_on.pop(address, None)
+
+    def failed(self, address: str, adapter: str, ex: Exception) -> None:
+        """Record a failed connection and re-balance the adapter if needed."""
+        self._failed_on[address.upper()] = adapter
+        pooled = self.adapters[adapter]
+        pooled.failures += 1
+        pooled.consecutive_failures += 1
+        if isinstance(ex, BleakOutOfConnectionSlotsError):
+            # the controller holds fewer connections than expected
+            pooled.saturations += 1
+            pooled.capacity = max(1, len(pooled.connected))
+            self.rebalance(adapter)
+        elif pooled.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            pooled.avoid_until = self._clock() + FAILURE_COOLDOWN
+            self.rebalance(adapter)
+
+    def released(self, address: str) -> None:
+        """Record the disconnection of a device."""
+        address = address.upper()
+        if (adapter := self._placements.pop(address, None)) is not None:
+            self.adapters[adapter].connected.discard(address)
+
+    def rebalance(self, adapter: str) -> list[str]:
+        """Ask the devices connected through an adapter to move to a better one.
+
+        A device moves when another adapter has a free slot and, unless the
+        adapter is avoided, sees it about as well. Return their addresses.
+        """
+        pooled = self.adapters[adapter]
+        avoided = pooled.avoid_until > self._clock()
+        moved: list[str] = []
+        # slots promised to the devices moving, they reconnect later
+        promised: dict[str, int] = {}
+        for address in sorted(pooled.connected):
+            if (callback := self._migration_callbacks.get(address)) is None:
+                continue
+            candidates = [
+                candidate
+                for candidate in self._candidates(address, exclude=adapter)
+                if candidate.free_slots > promised.get(candidate.name, 0)
+            ]
+            if not candidates:
+                break
+            target = self.rssi(address, candidates[0].name)
+            current = self.rssi(address, adapter)
+            if not avoided and (
+                target is None or (current is not None and target < current)
+            ):
+                continue
+            if callback():
+                moved.append(address)
+                promised[candidates[0].name] = promised.get(candidates[0].name, 0) + 1
+        return moved
@@ -1,9 +1,13 @@
 """Module defining a base device class."""
 
 import asyncio
+import itertools
 import logging
+import sys
 from abc import ABC, ABCMeta
+from contextlib import contextmanager
 from datetime import datetime
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterator
 
 import typer
 from bleak.backends.device import BLEDevice
@@ -11,9 +15,10 @@ from bleak.backends.scanner import AdvertisementData
 from bleak.backends.service import BleakGATTCharacteristic  # type: ignore
 from bleak.backends.service import BleakGATTServiceCollection
 from bleak.exc import BleakDBusError
-from bleak_retry_connector import BLEAK_RETRY_EXCEPTIONS as BLEAK_EXCEPTIONS
 from bleak_retry_connector import BleakError  # type: ignore
 from bleak_retry_connector import (
+    BLEAK_RETRY_EXCEPTIONS,
+    MAX_CONNECT_ATTEMPTS,
     BleakClientWithServiceCache,
     BleakNotFoundError,
     establish_connection,
@@ -23,8 +28,32 @@ from typing_extensions import Annotated
 
 from .. import commands
 from ..const import UART_RX_CHAR_UUID, UART_TX_CHAR_UUID
-from ..exception import CharacteristicMissingError
+from ..exception import CharacteristicMissingError, DeadlineExceeded, DeviceUnavailable
+from ..profiling import phase
+from ..schedule import apply_setting_operation
+from ..spans import span
+from ..trace import TraceEvent
 from ..weekday_encoding import WeekdaySelect, encode_selected_weekdays
+from .priority import Priority, PriorityLock, QueueStats, resolve_priority
+from .state import DeviceMode, DeviceState, WriteStats
+from .writer import ATT_HEADER_SIZE, DEFAULT_MTU, FlowControlledWriter
+
+if sys.version_info >= (3, 11):
+    from asyncio import timeout_at
+else:
+    from async_timeout import timeout_at
+
+if TYPE_CHECKING:
+    from ..trace import TraceRecorder
+    from .adapters import AdapterPool
+
+# connects to a device instead of bleak, given its disconnection callback
+Connector = Callable[
+    [BLEDevice, Callable[[Any], None]], Awaitable[BleakClientWithServiceCache]
+]
+
+# errors of a connection or of a write, also used by the callers of the devices
+BLEAK_EXCEPTIONS = BLEAK_RETRY_EXCEPTIONS
 
 DEFAULT_ATTEMPTS = 3
 
@@ -32,18 +61,40 @@ DISCONNECT_DELAY = 120
 BLEAK_BACKOFF_TIME = 0.25
 
 
+def deadline_from_timeout(timeout: float | None) -> float | None:
+    """Return the deadline of a command that must complete within `timeout` seconds.
+
+    Deadlines are times of the running event loop clock.
+    """
+    if timeout is None:
+        return None
+    return asyncio.get_running_loop().time() + timeout
+
+
 class _classproperty(property):
     def __get__(self, owner_self: object, owner_cls: ABCMeta) -> str:  # type: ignore
         ret: str = self.fget(owner_cls)  # type: ignore
         return ret
 
 
+def _is_bluez_backend(backend: object) -> bool:
+    """Return whether the backend of a client is the BlueZ one."""
+    try:
+        from bleak.backends.bluezdbus.client import BleakClientBlueZDBus
+    except ImportError:
+        # only available on linux
+        return False
+    return isinstance(backend, BleakClientBlueZDBus)
+
+
 class BaseDevice(ABC):
     """Base device class used by device classes."""
 
     _model_name: str | None = None
     _model_codes: list[str] = []
     _colors: dict[str, int] = {}
+    # whether the model parses several frames concatenated in one write
+    _packed_writes: bool = False
     _msg_id = commands.next_message_id()
     _logger: logging.Logger
 
@@ -56,11 +107,26 @@ class BaseDevice(ABC):
         self._advertisement_data = advertisement_data
         self._client: BleakClientWithServiceCache | None = None
         self._disconnect_timer: asyncio.TimerHandle | None = None
-        self._operation_lock: asyncio.Lock = asyncio.Lock()
+        self._operation_queue = PriorityLock()
         self._read_char: BleakGATTCharacteristic | None = None
         self._write_char: BleakGATTCharacteristic | None = None
         self._connect_lock: asyncio.Lock = asyncio.Lock()
         self._expected_disconnect = False
+        self._captured_commands: list[bytes] | None = None
+        self._fallback_resolver: Callable[[], Awaitable[BLEDevice | None]] | None = None
+        self._available = True
+        self._availability_callbacks: list[Callable[[bool], None]] = []
+        self._state = DeviceState()
+        self._write_stats = WriteStats()
+        self._writer = FlowControlledWriter()
+        self._pack_frames = self._packed_writes
+        self._mtu: int | None = None
+        self._connector: Connector | None = None
+        self._adapter_pool: AdapterPool | None = None
+        self._unregister_migration: Callable[[], None] | None = None
+        self._tracer: TraceRecorder | None = None
+        self._trace_id = 0
+        self._trace_sequence = itertools.count()
         self.loop = asyncio.get_running_loop()
         assert self._model_name is not None
 
@@ -76,9 +142,16 @@ class BaseDevice(ABC):
     def set_ble_device_and_advertisement_data(
         self, ble_device: BLEDevice, advertisement_data: AdvertisementData
     ) -> None:
-        """Set the ble device."""
+        """Set the ble device.
+
+        The device advertises, so it is available again.
+        """
+        if not self._available:
+            # it may have been power cycled while out of reach
+            self._state.invalidate()
         self._ble_device = ble_device
         self._advertisement_data = advertisement_data
+        self._set_available(True)
 
     @property
     def current_msg_id(self) -> tuple[int, int]:
@@ -105,6 +178,11 @@ class BaseDevice(ABC):
         """Return the colors."""
         return self._colors
 
+    @property
+    def ble_device(self) -> BLEDevice:
+        """Return the ble device."""
+        return self._ble_device
+
     @property
     def address(self) -> str:
         """Return the address."""
@@ -124,49 +202,277 @@ class BaseDevice(ABC):
             return self._advertisement_data.rssi
         return None
 
+    @property
+    def state(self) -> DeviceState:
+        """Return the state last written to the device."""
+        return self._state
+
+    @property
+    def writer(self) -> FlowControlledWriter:
+        """Return the writer pacing the frames, e.g. to set its `min_gap`."""
+        return self._writer
+
+    @property
+    def frame_packing(self) -> bool:
+        """Return whether consecutive frames are packed into the writes."""
+        return self._pack_frames
+
+    def set_frame_packing(self, enabled: bool | None) -> None:
+        """Pack consecutive frames into as few writes as the link mtu allows.
+
+        None restores the default of the model: only the models known to
+        parse concatenated frames pack them, the others get one frame per write.
+        """
+        self._pack_frames = self._packed_writes if enabled is None else enabled
+
+    @property
+    def mtu(self) -> int | None:
+        """Return the mtu of the link, read on connection when packing frames."""
+        return self._mtu
+
+    @property
+    def queue_stats(self) -> dict[Priority, QueueStats]:
+        """Return the queue latency of each priority class."""
+        return self._operation_queue.stats
+
+    @property
+    def write_stats(self) -> WriteStats:
+        """Return the counters of sent and suppressed writes."""
+        return self._write_stats
+
+    def _record_suppressed(self, frames: int, whole_write: bool) -> None:
+        """Count frames not sent because the device already has their state."""
+        self._write_stats.suppressed_frames += frames
+        if whole_write:
+            self._write_stats.suppressed_writes += 1
+            self._logger.debug("%s: Write suppressed, state unchanged", self.name)
+
+    @property
+    def available(self) -> bool:
+        """Return whether the device is believed to be reachable.
+
+        A device is unavailable after failing to connect, until it is seen
+        advertising again. Commands sent meanwhile fail with `DeviceUnavailable`.
+        """
+        return self._available
+
+    def register_availability_callback(
+        self, callback: Callable[[bool], None]
+    ) -> Callable[[], None]:
+        """Register a callback called when the availability changes.
+
+        Return a function unregistering the callback.
+        """
+        self._availability_callbacks.append(callback)
+        return lambda: self._availability_callbacks.remove(callback)
+
+    def mark_unavailable(self) -> None:
+        """Reject the commands until the device is seen advertising.
+
+        Used for devices built from stored data before they are found again.
+        """
+        self._set_available(False)
+
+    def _set_available(self, available: bool) -> None:
+        """Set the availability and notify the callbacks of a change."""
+        if available is self._available:
+            return
+        self._available = available
+        self._logger.debug(
+            "%s: Device %s", self.name, "available" if available else "unavailable"
+        )
+        for callback in list(self._availability_callbacks):
+            callback(available)
+
+    def _check_available(self) -> None:
+        """Raise if the device is unavailable."""
+        if not self._available:
+            raise DeviceUnavailable(f"{self.name} is unavailable")
+
+    def set_fallback_resolver(
+        self, resolver: Callable[[], Awaitable[BLEDevice | None]] | None
+    ) -> None:
+        """Set the resolver used once to find the device again if connecting fails.
+
+        Used when the device has been built from cached data instead of a scan.
+        """
+        self._fallback_resolver = resolver
+
+    def set_connector(self, connector: Connector | None) -> None:
+        """Set the function connecting to the device, e.g. to replay a trace."""
+        self._connector = connector
+
+    def set_adapter_pool(self, pool: "AdapterPool | None") -> None:
+        """Connect through the adapter of a pool that suits the device best."""
+        if self._unregister_migration is not None:
+            self._unregister_migration()
+            self._unregister_migration = None
+        self._adapter_pool = pool
+        if pool is not None:
+            self._unregister_migration = pool.register_migration_callback(
+                self.address, self._migrate
+            )
+
+    @property
+    def adapter(self) -> str | None:
+        """Return the adapter of the pool the device is connected through."""
+        if self._adapter_pool is None:
+            return None
+        return self._adapter_pool.placement(self.address)
+
+    def _migrate(self) -> bool:
+        """Disconnect if idle, the next connection goes to a better adapter."""
+        if (
+            self._client is None
+            or self._operation_queue.locked()
+            or self._connect_lock.locked()
+        ):
+            return False
+        if self._disconnect_timer:
+            self._disconnect_timer.cancel()
+        self._logger.debug("%s: Moving to another adapter", self.name)
+        self._disconnect()
+        return True
+
+    def set_tracer(self, tracer: "TraceRecorder | None") -> None:
+        """Record the bluetooth session of the device to a trace."""
+        self._tracer = tracer
+        if tracer is not None:
+            self._trace_id = tracer.register(self.address, self.name)
+
+    def _trace(self, event: TraceEvent, payload: bytes = b"") -> None:
+        """Record an event to the trace, if any."""
+        if self._tracer is not None:
+            self._tracer.record(self._trace_id, event, payload)
+
+    def _trace_error(self, ex: BaseException) -> None:
+        """Record an error of the transport to the trace, if any."""
+        if self._tracer is not None:
+            self._tracer.record_error(self._trace_id, ex)
+
+    @contextmanager
+    def capture_commands(self) -> Iterator[list[bytes]]:
+        """Capture the commands issued in this block instead of sending them."""
+        captured: list[bytes] = []
+        self._captured_commands = captured
+        try:
+            yield captured
+        finally:
+            self._captured_commands = None
+
+    async def send_commands(
+        self,
+        commands: list[bytes],
+        deadline: float | None = None,
+        priority: Priority = Priority.AUTOMATION,
+    ) -> None:
+        """Send already encoded commands in one burst, as a single operation."""
+        if commands:
+            await self._send_command(commands, 3, deadline, priority)
+
+    async def send_operations(
+        self,
+        operations: list[list[bytes]],
+        deadline: float | None = None,
+        priority: Priority = Priority.AUTOMATION,
+    ) -> None:
+        """Send the already encoded commands of several operations in one burst.
+
+        Operations of a higher priority class can run between two of them,
+        never in the middle of one.
+        """
+        if operations := [frames for frames in operations if frames]:
+            await self._send_operations(operations, 3, deadline, priority)
+
     # Command methods
 
+    def _get_color_id(self, color: str | int) -> int | None:
+        """Get the channel id of a color name or id."""
+        if isinstance(color, int) and color in self._colors.values():
+            return color
+        if isinstance(color, str) and color in self._colors:
+            return self._colors[color]
+        self._logger.warning("Color not supported: `%s`", color)
+        return None
+
+    def _record_setting(self, command: str, **kwargs: Any) -> None:
+        """Record a change of the auto settings once it has been sent."""
+        apply_setting_operation(self._state.auto_settings, command, kwargs)
+
     async def set_color_brightness(
         self,
         brightness: Annotated[int, typer.Argument(min=0, max=100)],
         color: str | int = 0,
+        deadline: float | None = None,
+        force: bool = False,
     ) -> None:
         """Set brightness of a color."""
-        color_id: int | None = None
-        if isinstance(color, int) and color in self._colors.values():
-            color_id = color
-        elif isinstance(color, str) and color in self._colors:
-            color_id = self._colors.get(color)
-        if color_id is None:
-            self._logger.warning("Color not supported: `%s`", color)
+        await self.set_colors_brightness({color: brightness}, deadline, force)
+
+    async def set_colors_brightness(
+        self,
+        brightness: dict[str | int, int],
+        deadline: float | None = None,
+        force: bool = False,
+    ) -> None:
+        """Set the brightness of several colors in one burst.
+
+        Colors already at their level are skipped unless `force` is set.
+        """
+        levels: dict[int, int] = {}
+        for color, level in brightness.items():
+            if (color_id := self._get_color_id(color)) is not None:
+                levels[color_id] = level
+        if not levels:
             return
-        cmd = commands.create_manual_setting_command(
-            self.get_next_msg_id(), color_id, brightness
-        )
-        await self._send_command(cmd, 3)
+        changed = levels if force else self._state.changed_levels(levels)
+        if len(changed) < len(levels):
+            self._record_suppressed(len(levels) - len(changed), not changed)
+        if not changed:
+            return
+        cmds: list[bytes] = [
+            commands.create_manual_setting_command(
+                self.get_next_msg_id(), color_id, level
+            )
+            for color_id, level in changed.items()
+        ]
+        sending = self._captured_commands is None
+        with span("set_colors_brightness", device=self.address, levels=changed):
+            await self._send_command(cmds, 3, deadline, Priority.INTERACTIVE)
+        if sending:
+            self._state.set_levels(changed)
 
     async def set_brightness(
-        self, brightness: Annotated[int, typer.Argument(min=0, max=100)]
+        self,
+        brightness: Annotated[int, typer.Argument(min=0, max=100)],
+        deadline: float | None = None,
+        force: bool = False,
     ) -> None:
         """Set light brightness."""
-        await self.set_color_brightness(brightness)
+        await self.set_color_brightness(brightness, deadline=deadline, force=force)
 
     async def set_rgb_brightness(
-        self, brightness: Annotated[tuple[int, int, int], typer.Argument()]
+        self,
+        brightness: Annotated[tuple[int, int, int], typer.Argument()],
+        deadline: float | None = None,
+        force: bool = False,
     ) -> None:
         """Set RGB brightness."""
-        for c, b in enumerate(brightness):
-            await self.set_color_brightness(c, b)
+        await self.set_colors_brightness(dict(enumerate(brightness)), deadline, force)
 
-    async def turn_on(self) -> None:
+    async def turn_on(self, deadline: float | None = None, force: bool = False) -> None:
         """Turn on light."""
-        for color_name in self._colors:
-            await self.set_color_brightness(100, color_name)
+        await self.set_colors_brightness(
+            dict.fromkeys(self._colors, 100), deadline, force
+        )
 
-    async def turn_off(self) -> None:
+    async def turn_off(
+        self, deadline: float | None = None, force: bool = False
+    ) -> None:
         """Turn off light."""
-        for color_name in self._colors:
-            await self.set_color_brightness(0, color_name)
+        await self.set_colors_brightness(
+            dict.fromkeys(self._colors, 0), deadline, force
+        )
 
     async def add_setting(
         self,
@@ -177,6 +483,7 @@ class BaseDevice(ABC):
         weekdays: Annotated[list[WeekdaySelect], typer.Option()] = [
             WeekdaySelect.everyday
         ],
+        deadline: float | None = None,
     ) -> None:
         """Add an automation setting to the light."""
         cmd = commands.create_add_auto_setting_command(
@@ -187,7 +494,17 @@ class BaseDevice(ABC):
             ramp_up_in_minutes,
             encode_selected_weekdays(weekdays),
         )
-        await self._send_command(cmd, 3)
+        sending = self._captured_commands is None
+        await self._send_command(cmd, 3, deadline, Priority.AUTOMATION)
+        if sending:
+            self._record_setting(
+                "add_setting",
+                sunrise=sunrise,
+                sunset=sunset,
+                max_brightness=max_brightness,
+                ramp_up_in_minutes=ramp_up_in_minutes,
+                weekdays=weekdays,
+            )
 
     async def add_rgb_setting(
         self,
@@ -202,6 +519,7 @@ class BaseDevice(ABC):
         weekdays: Annotated[list[WeekdaySelect], typer.Option()] = [
             WeekdaySelect.everyday
         ],
+        deadline: float | None = None,
     ) -> None:
         """Add an automation setting to the RGB light."""
         cmd = commands.create_add_auto_setting_command(
@@ -212,7 +530,17 @@ class BaseDevice(ABC):
             ramp_up_in_minutes,
             encode_selected_weekdays(weekdays),
         )
-        await self._send_command(cmd, 3)
+        sending = self._captured_commands is None
+        await self._send_command(cmd, 3, deadline, Priority.AUTOMATION)
+        if sending:
+            self._record_setting(
+                "add_rgb_setting",
+                sunrise=sunrise,
+                sunset=sunset,
+                max_brightness=max_brightness,
+                ramp_up_in_minutes=ramp_up_in_minutes,
+                weekdays=weekdays,
+            )
 
     async def remove_setting(
         self,
@@ -222,6 +550,7 @@ class BaseDevice(ABC):
         weekdays: Annotated[list[WeekdaySelect], typer.Option()] = [
             WeekdaySelect.everyday
         ],
+        deadline: float | None = None,
     ) -> None:
         """Remove an automation setting from the light."""
         cmd = commands.create_delete_auto_setting_command(
@@ -231,50 +560,152 @@ class BaseDevice(ABC):
             ramp_up_in_minutes,
             encode_selected_weekdays(weekdays),
         )
-        await self._send_command(cmd, 3)
+        sending = self._captured_commands is None
+        await self._send_command(cmd, 3, deadline, Priority.AUTOMATION)
+        if sending:
+            self._record_setting(
+                "remove_setting",
+                sunrise=sunrise,
+                sunset=sunset,
+                ramp_up_in_minutes=ramp_up_in_minutes,
+                weekdays=weekdays,
+            )
 
-    async def reset_settings(self) -> None:
+    async def reset_settings(self, deadline: float | None = None) -> None:
         """Remove all automation settings from the light."""
         cmd = commands.create_reset_auto_settings_command(self.get_next_msg_id())
-        await self._send_command(cmd, 3)
+        sending = self._captured_commands is None
+        await self._send_command(cmd, 3, deadline, Priority.AUTOMATION)
+        if sending:
+            self._record_setting("reset_settings")
+
+    async def enable_auto_mode(
+        self, deadline: float | None = None, force: bool = False
+    ) -> None:
+        """Enable auto mode of the light.
 
-    async def enable_auto_mode(self) -> None:
-        """Enable auto mode of the light."""
-        switch_cmd = commands.create_switch_to_auto_mode_command(self.get_next_msg_id())
-        time_cmd = commands.create_set_time_command(self.get_next_msg_id())
-        await self._send_command(switch_cmd, 3)
-        await self._send_command(time_cmd, 3)
+        The switch is skipped if the light is already in auto mode and the time
+        is only set again once the last synchronization is old enough, unless
+        `force` is set.
+        """
+        cmds: list[bytes] = []
+        if force or self._state.mode is not DeviceMode.AUTO:
+            cmds.append(
+                commands.create_switch_to_auto_mode_command(self.get_next_msg_id())
+            )
+        sync_time = force or self._state.needs_time_sync()
+        if sync_time:
+            cmds.append(commands.create_set_time_command(self.get_next_msg_id()))
+        if len(cmds) < 2:
+            self._record_suppressed(2 - len(cmds), not cmds)
+        if not cmds:
+            return
+        sending = self._captured_commands is None
+        await self._send_command(cmds, 3, deadline, Priority.AUTOMATION)
+        if sending:
+            self._state.set_auto_mode(sync_time)
 
     # Bluetooth methods
 
     async def _send_command(
-        self, commands: list[bytes] | bytes, retry: int | None = None
+        self,
+        commands: list[bytes] | bytes,
+        retry: int | None = None,
+        deadline: float | None = None,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> None:
-        """Send command to device and read response."""
-        await self._ensure_connected()
-        # await self._resolve_protocol()
+        """Send command to device and read response.
+
+        Waiting for the locks, connecting and retrying are cancelled once the
+        deadline has passed, raising `DeadlineExceeded`. Commands are queued by
+        priority class, `command_priority` overrides the default one.
+        """
         if not isinstance(commands, list):
             commands = [commands]
-        await self._send_command_while_connected(commands, retry)
+        await self._send_operations([commands], retry, deadline, priority)
+
+    async def _send_operations(
+        self,
+        operations: list[list[bytes]],
+        retry: int | None,
+        deadline: float | None,
+        priority: Priority,
+    ) -> None:
+        """Send the commands of several operations, see `_send_command`."""
+        if self._captured_commands is not None:
+            for frames in operations:
+                self._captured_commands.extend(frames)
+            return
+        priority = resolve_priority(priority)
+        if (tracer := self._tracer) is None:
+            await self._send_frames(operations, retry, deadline, priority)
+            return
+        sequence = next(self._trace_sequence)
+        commands = [frame for frames in operations for frame in frames]
+        tracer.record_command(self._trace_id, sequence, priority, commands)
+        try:
+            await self._send_frames(operations, retry, deadline, priority)
+        except BaseException as ex:
+            tracer.record_command_end(self._trace_id, sequence, ex)
+            raise
+        tracer.record_command_end(self._trace_id, sequence)
+
+    async def _send_frames(
+        self,
+        operations: list[list[bytes]],
+        retry: int | None,
+        deadline: float | None,
+        priority: Priority,
+    ) -> None:
+        """Send the frames of operations to the device before the deadline."""
+        frame_count = sum(len(frames) for frames in operations)
+        with (
+            phase("command", self.address),
+            span(
+                "send_command",
+                device=self.address,
+                frames=frame_count,
+                priority=priority.name,
+            ),
+        ):
+            self._check_available()
+            if deadline is not None and deadline <= self.loop.time():
+                raise DeadlineExceeded(f"{self.name}: deadline exceeded before sending")
+            try:
+                async with timeout_at(deadline):
+                    await self._ensure_connected()
+                    # await self._resolve_protocol()
+                    await self._send_command_while_connected(
+                        operations, retry, priority
+                    )
+            except asyncio.TimeoutError as ex:
+                # not an alias of TimeoutError before python 3.11
+                if deadline is None or self.loop.time() < deadline:
+                    raise
+                raise DeadlineExceeded(f"{self.name}: deadline exceeded") from ex
+            self._write_stats.sent_frames += frame_count
 
     async def _send_command_while_connected(
-        self, commands: list[bytes], retry: int | None = None
+        self,
+        operations: list[list[bytes]],
+        retry: int | None = None,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> None:
         """Send command to device and read response."""
         self._logger.debug(
             "%s: Sending commands %s",
             self.name,
-            [command.hex() for command in commands],
+            [[command.hex() for command in frames] for frames in operations],
         )
-        if self._operation_lock.locked():
+        if self._operation_queue.locked():
             self._logger.debug(
                 "%s: Operation already in progress, waiting for it to complete; RSSI: %s",
                 self.name,
                 self.rssi,
             )
-        async with self._operation_lock:
+        async with self._operation_queue.hold(priority) as enqueued:
             try:
-                await self._send_command_locked(commands)
+                await self._send_command_locked(operations, priority, enqueued)
                 return
             except BleakNotFoundError:
                 self._logger.error(
@@ -283,6 +714,7 @@ class BaseDevice(ABC):
                     self.rssi,
                     exc_info=True,
                 )
+                self._set_available(False)
                 raise
             except CharacteristicMissingError as ex:
                 self._logger.debug(
@@ -300,10 +732,15 @@ class BaseDevice(ABC):
         raise RuntimeError("Unreachable")
 
     @retry_bluetooth_connection_error(DEFAULT_ATTEMPTS)
-    async def _send_command_locked(self, commands: list[bytes]) -> None:
+    async def _send_command_locked(
+        self, operations: list[list[bytes]], priority: Priority, enqueued: float
+    ) -> None:
         """Send command to device and read response."""
         try:
-            await self._execute_command_locked(commands)
+            with span("send_command_locked", device=self.address):
+                # a previous attempt or a preempting operation may have disconnected
+                await self._ensure_connected()
+                await self._execute_command_locked(operations, priority, enqueued)
         except BleakDBusError as ex:
             # Disconnect so we can reset state and try again
             await asyncio.sleep(BLEAK_BACKOFF_TIME)
@@ -324,34 +761,80 @@ class BaseDevice(ABC):
             await self._execute_disconnect()
             raise
 
-    async def _execute_command_locked(self, commands: list[bytes]) -> None:
-        """Execute command and read response."""
+    async def _execute_command_locked(
+        self, operations: list[list[bytes]], priority: Priority, enqueued: float
+    ) -> None:
+        """Execute command and read response.
+
+        Operations of a higher priority class run between the given operations,
+        whose frames are always written together: the state recorded once an
+        operation is sent must not be overtaken by a preempting one.
+        """
         assert self._client is not None  # nosec
         if not self._read_char:
             raise CharacteristicMissingError("Read characteristic missing")
         if not self._write_char:
             raise CharacteristicMissingError("Write characteristic missing")
-        for command in commands:
-            await self._client.write_gatt_char(self._write_char, command, False)
+
+        async def _write_frame(frame: bytes) -> None:
+            if self._client is None or self._write_char is None:
+                raise BleakError("Disconnected by a preempting operation")
+            self._trace(TraceEvent.WRITE, frame)
+            try:
+                with span("write_gatt_char", device=self.address, size=len(frame)):
+                    await self._client.write_gatt_char(self._write_char, frame, False)
+            except BaseException as ex:
+                self._trace_error(ex)
+                raise
+            self._write_stats.sent_writes += 1
+            self._trace(TraceEvent.WRITTEN)
+
+        max_write_size = None
+        if self._pack_frames:
+            max_write_size = (self._mtu or DEFAULT_MTU) - ATT_HEADER_SIZE
+
+        async def _between_operations() -> None:
+            await self._operation_queue.yield_to_waiters(priority, enqueued)
+
+        with phase("write", self.address):
+            await self._writer.write_operations(
+                _write_frame, operations, _between_operations, max_write_size
+            )
+        self._logger.debug(
+            "%s: %s frames written; window: %.1f; frames per write: %s; "
+            "sustained fps: %s",
+            self.name,
+            sum(len(frames) for frames in operations),
+            self._writer.window,
+            self._writer.stats.frames_per_write,
+            self._writer.stats.fps,
+        )
 
     def _notification_handler(
         self, _sender: BleakGATTCharacteristic, data: bytearray
     ) -> None:
-        """Handle notification responses."""
-        self._logger.warning("%s: Notification received: %s", self.name, data)
+        """Handle notification responses, they acknowledge the frames."""
+        self._logger.debug("%s: Notification received: %s", self.name, data.hex())
+        self._trace(TraceEvent.NOTIFICATION, bytes(data))
+        self._writer.acknowledge(bytes(data))
 
     def _disconnected(self, client: BleakClientWithServiceCache) -> None:
         """Disconnected callback."""
+        if self._adapter_pool is not None:
+            self._adapter_pool.released(self.address)
         if self._expected_disconnect:
             self._logger.debug(
                 "%s: Disconnected from device; RSSI: %s", self.name, self.rssi
             )
             return
+        self._trace(TraceEvent.DISCONNECTED)
         self._logger.warning(
             "%s: Device unexpectedly disconnected; RSSI: %s",
             self.name,
             self.rssi,
         )
+        # it may have rebooted and lost the state written so far
+        self._state.invalidate()
 
     def _resolve_characteristics(self, services: BleakGATTServiceCollection) -> bool:
         """Resolve characteristics."""
@@ -376,33 +859,145 @@ class BaseDevice(ABC):
         if self._client and self._client.is_connected:
             self._reset_disconnect_timer()
             return
-        async with self._connect_lock:
-            # Check again while holding the lock
-            if self._client and self._client.is_connected:
+        with span("ensure_connected", device=self.address):
+            async with self._connect_lock:
+                # Check again while holding the lock
+                if self._client and self._client.is_connected:
+                    self._reset_disconnect_timer()
+                    return
+                # The connection may have failed while waiting for the lock
+                self._check_available()
+                self._logger.debug("%s: Connecting; RSSI: %s", self.name, self.rssi)
+                try:
+                    client = await self._connect_or_resolve()
+                except BLEAK_EXCEPTIONS:
+                    # Out of range: reject the queued commands until the device
+                    # advertises again. A cancelled connection says nothing
+                    # about the device and leaves it available.
+                    self._set_available(False)
+                    raise
+                self._logger.debug("%s: Connected; RSSI: %s", self.name, self.rssi)
+                with phase("services", self.address):
+                    resolved = self._resolve_characteristics(client.services)
+                    if not resolved:
+                        # Try to handle services failing to load
+                        resolved = self._resolve_characteristics(
+                            await client.get_services()
+                        )
+                self._trace(
+                    TraceEvent.SERVICES,
+                    ",".join(
+                        char.uuid
+                        for char in (self._read_char, self._write_char)
+                        if char
+                    ).encode(),
+                )
+
+                if self._pack_frames:
+                    with phase("mtu", self.address):
+                        self._mtu = await self._read_mtu(client)
+                    self._logger.debug("%s: MTU: %s", self.name, self._mtu)
+
+                self._client = client
                 self._reset_disconnect_timer()
-                return
-            self._logger.debug("%s: Connecting; RSSI: %s", self.name, self.rssi)
-            client = await establish_connection(
-                BleakClientWithServiceCache,
-                self._ble_device,
-                self.name,
-                self._disconnected,
-                use_services_cache=True,
-                ble_device_callback=lambda: self._ble_device,
-            )
-            self._logger.debug("%s: Connected; RSSI: %s", self.name, self.rssi)
-            resolved = self._resolve_characteristics(client.services)
-            if not resolved:
-                # Try to handle services failing to load
-                resolved = self._resolve_characteristics(await client.get_services())
 
-            self._client = client
-            self._reset_disconnect_timer()
+                self._logger.debug(
+                    "%s: Subscribe to notifications; RSSI: %s", self.name, self.rssi
+                )
+                with phase("subscribe", self.address):
+                    await client.start_notify(
+                        self._read_char, self._notification_handler  # type: ignore
+                    )
+
+    async def _read_mtu(self, client: BleakClientWithServiceCache) -> int:
+        """Return the mtu of the link.
 
+        BlueZ only knows the negotiated mtu once a write is acquired, like the
+        `mtu_size` example of bleak does; the default mtu is used if it fails.
+        """
+        backend: Any = getattr(client, "_backend", None)
+        if _is_bluez_backend(backend):
+            try:
+                await backend._acquire_mtu()
+            except (AttributeError, *BLEAK_EXCEPTIONS):
+                self._logger.debug(
+                    "%s: Failed to acquire the MTU", self.name, exc_info=True
+                )
+                return DEFAULT_MTU
+        return client.mtu_size
+
+    async def _connect_or_resolve(self) -> BleakClientWithServiceCache:
+        """Connect, finding the device again once if the connection fails."""
+        try:
+            return await self._connect_through_pool()
+        except BLEAK_EXCEPTIONS:
+            resolver = self._fallback_resolver
+            self._fallback_resolver = None
+            if resolver is None or (ble_device := await resolver()) is None:
+                raise
+            self._logger.debug(
+                "%s: Connection failed, retrying with a fresh device", self.name
+            )
+            self._ble_device = ble_device
+            return await self._establish_connection()
+
+    async def _connect_through_pool(self) -> BleakClientWithServiceCache:
+        """Connect, through another adapter of the pool if the first one fails."""
+        if self._adapter_pool is None or len(self._adapter_pool.adapters) < 2:
+            return await self._establish_connection()
+        try:
+            return await self._establish_connection()
+        except BLEAK_EXCEPTIONS:
             self._logger.debug(
-                "%s: Subscribe to notifications; RSSI: %s", self.name, self.rssi
+                "%s: Connection failed, retrying through another adapter", self.name
             )
-            await client.start_notify(self._read_char, self._notification_handler)  # type: ignore
+            return await self._establish_connection()
+
+    async def _establish_connection(self) -> BleakClientWithServiceCache:
+        """Establish the connection to the device.
+
+        With an adapter pool, the device is reached through the adapter it
+        places the connection on.
+        """
+        ble_device = self._ble_device
+        pool = self._adapter_pool
+        adapter = ""
+        if pool is not None:
+            adapter, ble_device = pool.place(ble_device)
+            self._logger.debug("%s: Connecting through %s", self.name, adapter)
+        self._trace(TraceEvent.CONNECT)
+        try:
+            with phase("connect", self.address):
+                client = await self._connect(ble_device)
+        except BaseException as ex:
+            self._trace_error(ex)
+            if pool is not None and isinstance(ex, Exception):
+                pool.failed(self.address, adapter, ex)
+            raise
+        self._trace(TraceEvent.CONNECTED)
+        if pool is not None:
+            pool.connected(self.address, adapter)
+        return client
+
+    async def _connect(self, ble_device: BLEDevice) -> BleakClientWithServiceCache:
+        """Connect to the device with the connector, or with bleak.
+
+        A device built from cached data is tried once, it is found again by a
+        scan rather than retried if its cached details are stale.
+        """
+        if self._connector is not None:
+            return await self._connector(ble_device, self._disconnected)
+        return await establish_connection(
+            BleakClientWithServiceCache,
+            ble_device,
+            self.name,
+            self._disconnected,
+            max_attempts=(
+                1 if self._fallback_resolver is not None else MAX_CONNECT_ATTEMPTS
+            ),
+            use_services_cache=True,
+            ble_device_callback=lambda: ble_device,
+        )
 
     def _reset_disconnect_timer(self) -> None:
         """Reset disconnect timer."""
@@ -427,7 +1022,12 @@ class BaseDevice(ABC):
             self._client = None
             self._read_char = None
             self._write_char = None
+            self._mtu = None
+            self._writer.reset()
+            if self._adapter_pool is not None:
+                self._adapter_pool.released(self.address)
             if client and client.is_connected:
+                self._trace(TraceEvent.DISCONNECT)
                 if read_char:
                     try:
                         await client.stop_notify(read_char)
@@ -1,13 +1,15 @@
 """CII device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["CII"]
 
 
 class CII(BaseDevice):
     """Chihiros CII device Class."""
 
-    _model_name = "C II"
-    _model_codes = ["DYNC2N"]
-    _colors: dict[str, int] = {
-        "white": 0,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -1,15 +1,15 @@
 """CII RGB device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["CIIRGB"]
 
 
 class CIIRGB(BaseDevice):
     """Chihiros CII RGB device Class."""
 
-    _model_name = "C II RGB"
-    _model_codes = ["DYNCRGP"]
-    _colors: dict[str, int] = {
-        "red": 0,
-        "green": 1,
-        "blue": 2,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -0,0 +1,147 @@
+"""Declarative catalog of the supported models.
+
+This module is pure data: it must stay cheap to import, device classes are
+only imported once a device of their model is found.
+"""
+
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping
+
+from ..const import UART_SERVICE_UUID
+
+# gamma of the opt-in perceptual brightness curve: Home Assistant colors and
+# brightness are encoded for the eye like sRGB, the channel levels drive the
+# leds linearly; the catalog models keep the linear mapping by default
+PERCEPTUAL_GAMMA = 2.2
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Description of a device model."""
+
+    class_name: str
+    module: str
+    model_name: str
+    # advertised names start with one of the codes followed by a serial number
+    codes: tuple[str, ...]
+    colors: Mapping[str, int]
+    # prefixes of the `local_name` patterns of manifest.json matching a whole family
+    family_prefixes: tuple[str, ...] = field(default=())
+    # services advertised by the model, they break the ties between models
+    # whose codes or families prefix the same name
+    service_uuids: tuple[str, ...] = field(default=())
+    # exponent from the requested intensity of a channel to its level, and
+    # share of the full level reached by each color; see `color.ColorPipeline`
+    gamma: float = 1.0
+    channel_gains: Mapping[str, float] = field(default_factory=dict)
+    # whether the model parses several frames concatenated in one write, the
+    # others get one frame per write
+    packed_writes: bool = False
+
+
+def _spec(
+    class_name: str,
+    module: str,
+    model_name: str,
+    codes: tuple[str, ...],
+    colors: dict[str, int],
+    family_prefixes: tuple[str, ...] = (),
+    service_uuids: tuple[str, ...] = (UART_SERVICE_UUID,),
+    gamma: float = 1.0,
+    channel_gains: dict[str, float] | None = None,
+    packed_writes: bool = False,
+) -> ModelSpec:
+    return ModelSpec(
+        class_name,
+        module,
+        model_name,
+        codes,
+        MappingProxyType(colors),
+        family_prefixes,
+        tuple(uuid.lower() for uuid in service_uuids),
+        gamma,
+        MappingProxyType(channel_gains or {}),
+        packed_writes,
+    )
+
+
+MODEL_CATALOG: tuple[ModelSpec, ...] = (
+    _spec("AII", "a2", "A II", ("DYNA2", "DYNA2N"), {"white": 0}),
+    _spec("CII", "c2", "C II", ("DYNC2N",), {"white": 0}),
+    _spec(
+        "CIIRGB", "c2rgb", "C II RGB", ("DYNCRGP",), {"red": 0, "green": 1, "blue": 2}
+    ),
+    _spec(
+        "Commander1",
+        "commander1",
+        "Commander 1",
+        ("DYCOM",),
+        {"white": 0, "red": 0, "green": 1, "blue": 2},
+    ),
+    _spec(
+        "TinyTerrariumEgg",
+        "tiny_terrarium_egg",
+        "Tiny Terrarium Egg",
+        ("DYDD",),
+        {"red": 0, "green": 1},
+    ),
+    _spec(
+        "UniversalWRGB",
+        "universal_wrgb",
+        "Universal WRGB",
+        (
+            "DYU550",
+            "DYU600",
+            "DYU700",
+            "DYU800",
+            "DYU920",
+            "DYU1000",
+            "DYU1200",
+            "DYU1500",
+        ),
+        {"red": 0, "green": 1, "blue": 2, "white": 3},
+        family_prefixes=("DYU",),
+    ),
+    _spec(
+        "WRGBII",
+        "wrgb2",
+        "WRGB II",
+        ("DYNWRGB", "DYNW30", "DYNW45", "DYNW60", "DYNW90", "DYNW12P"),
+        {"red": 0, "green": 1, "blue": 2},
+    ),
+    _spec(
+        "WRGBIIPro",
+        "wrgb2_pro",
+        "WRGB II Pro",
+        (
+            "DYWPRO30",
+            "DYWPRO45",
+            "DYWPRO60",
+            "DYWPRO80",
+            "DYWPRO90",
+            "DYWPRO120",
+        ),
+        {"red": 0, "green": 1, "blue": 2, "white": 3},
+        family_prefixes=("DYWPRO",),
+    ),
+    _spec(
+        "WRGBIISlim",
+        "wrgb2_slim",
+        "WRGB II Slim",
+        ("DYSILN",),
+        {"red": 0, "green": 1, "blue": 2},
+    ),
+)
+
+FALLBACK_SPEC = _spec(
+    "Fallback",
+    "fallback",
+    "fallback",
+    (),
+    {"white": 0, "red": 0, "green": 1, "blue": 2},
+)
+
+MODEL_SPECS: Mapping[str, ModelSpec] = MappingProxyType(
+    {spec.class_name: spec for spec in (*MODEL_CATALOG, FALLBACK_SPEC)}
+)
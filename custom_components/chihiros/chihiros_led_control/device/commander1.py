@@ -1,11 +1,15 @@
 """Commander 1 device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["Commander1"]
 
 
 class Commander1(BaseDevice):
     """Chihiros Commander 1 device Class."""
 
-    _model_name = "Commander 1"
-    _model_codes = ["DYCOM"]
-    _colors: dict[str, int] = {"white": 0, "red": 0, "green": 1, "blue": 2}
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
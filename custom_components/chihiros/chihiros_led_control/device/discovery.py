@@ -0,0 +1,317 @@
+"""Module discovering devices while scanning."""
+
+import asyncio
+import time
+from contextlib import AsyncExitStack, aclosing
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncGenerator, Callable, Iterable
+
+from bleak import BleakScanner
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+from bleak_retry_connector import BleakClientWithServiceCache, establish_connection
+
+from ..cache import DeviceCache
+from ..const import (
+    DEFAULT_DISCOVERY_TIMEOUT,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_PROBE_TIMEOUT,
+    UART_RX_CHAR_UUID,
+    UART_TX_CHAR_UUID,
+)
+from ..exception import DeviceNotFound
+from ..profiling import phase
+from .adapters import AdapterPool
+from .base_device import BLEAK_EXCEPTIONS, BaseDevice
+from .catalog import FALLBACK_SPEC, MODEL_SPECS
+from .registry import MODEL_REGISTRY
+
+
+async def scan(
+    timeout: float = DEFAULT_DISCOVERY_TIMEOUT,
+    addresses: Iterable[str] | None = None,
+    limit: int | None = None,
+    predicate: Callable[[BLEDevice, AdvertisementData], bool] | None = None,
+    pool: AdapterPool | None = None,
+) -> AsyncGenerator[tuple[BLEDevice, AdvertisementData], None]:
+    """Yield devices as soon as their first matching advertisement is received.
+
+    The scan stops after `timeout` seconds, once all the requested `addresses`
+    have been found or once `limit` devices have been yielded.
+    Each device is yielded only once. With an adapter pool, every adapter
+    scans and the pool records the rssi of all the advertisements.
+    """
+    queue: asyncio.Queue[tuple[BLEDevice, AdvertisementData]] = asyncio.Queue()
+    wanted = {address.upper() for address in addresses} if addresses else None
+    seen: set[str] = set()
+
+    def _detection_callback(
+        ble_device: BLEDevice, advertisement_data: AdvertisementData
+    ) -> None:
+        if pool is not None:
+            pool.observe(ble_device, advertisement_data.rssi)
+        address = ble_device.address.upper()
+        if address in seen or (wanted is not None and address not in wanted):
+            return
+        if predicate is not None and not predicate(ble_device, advertisement_data):
+            return
+        seen.add(address)
+        queue.put_nowait((ble_device, advertisement_data))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    yielded = 0
+    async with AsyncExitStack() as scanners:
+        scanners.enter_context(phase("scan"))
+        if pool is None:
+            await scanners.enter_async_context(
+                BleakScanner(detection_callback=_detection_callback)
+            )
+        else:
+            for adapter in pool.adapters:
+                await scanners.enter_async_context(
+                    BleakScanner(
+                        detection_callback=_detection_callback, adapter=adapter
+                    )
+                )
+        while (limit is None or yielded < limit) and (
+            wanted is None or yielded < len(wanted)
+        ):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                item = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return
+            yield item
+            yielded += 1
+
+
+async def discover_devices(
+    timeout: float = DEFAULT_DISCOVERY_TIMEOUT,
+    addresses: Iterable[str] | None = None,
+    limit: int | None = None,
+    chihiros_only: bool = True,
+    cache: DeviceCache | None = None,
+    pool: AdapterPool | None = None,
+) -> AsyncGenerator[BaseDevice, None]:
+    """Yield devices as their advertisements arrive during a single scan.
+
+    Requested `addresses` are yielded whatever their advertisement is, as long
+    as it contains a name. Otherwise only Chihiros devices are yielded unless
+    `chihiros_only` is disabled. All the adapters of `pool` scan.
+    The `cache` is written once, when the scan is over.
+    """
+
+    def _predicate(
+        ble_device: BLEDevice, advertisement_data: AdvertisementData
+    ) -> bool:
+        if ble_device.name is None:
+            return not chihiros_only
+        return (
+            addresses is not None
+            or not chihiros_only
+            or MODEL_REGISTRY.match(ble_device.name, advertisement_data.service_uuids)
+            is not None
+        )
+
+    try:
+        async with aclosing(
+            scan(timeout, addresses, limit, _predicate, pool)
+        ) as devices:
+            async for ble_device, advertisement_data in devices:
+                spec = MODEL_REGISTRY.match(
+                    ble_device.name, advertisement_data.service_uuids
+                )
+                if cache is not None and spec is not None and spec is not FALLBACK_SPEC:
+                    cache.update(ble_device, spec.class_name, advertisement_data.rssi)
+                model_class = MODEL_REGISTRY.get_class(spec or FALLBACK_SPEC)
+                yield model_class(ble_device, advertisement_data)
+    finally:
+        if cache is not None:
+            cache.flush()
+
+
+async def get_devices_from_addresses(
+    device_addresses: Iterable[str],
+    timeout: float = DEFAULT_DISCOVERY_TIMEOUT,
+    cache: DeviceCache | None = None,
+    use_cache: bool = True,
+    pool: AdapterPool | None = None,
+) -> dict[str, BaseDevice]:
+    """Get the devices of several mac addresses.
+
+    Devices found in the discovery cache are built without scanning, all the
+    others are resolved by a single scan that stops as soon as they are found.
+    Connecting to a cached device falls back to a scan if it fails.
+    Devices that can not be found are missing from the result. The devices
+    connect through the adapter `pool`.
+    """
+    devices: dict[str, BaseDevice] = {}
+    missing: list[str] = []
+    if use_cache:
+        cache = cache or DeviceCache()
+    else:
+        cache = None
+    for device_address in device_addresses:
+        device_address = device_address.upper()
+        cached = cache.get(device_address) if cache is not None else None
+        if (
+            cached is not None
+            and cached.model in MODEL_SPECS
+            and (cached_ble_dev := cached.to_ble_device()) is not None
+        ):
+            model_class = MODEL_REGISTRY.get_class(MODEL_SPECS[cached.model])
+            dev: BaseDevice = model_class(cached_ble_dev)
+            dev.set_fallback_resolver(
+                partial(_find_device_by_address, device_address, timeout, cache, pool)
+            )
+            devices[device_address] = dev
+        else:
+            missing.append(device_address)
+
+    if missing:
+        async with aclosing(
+            discover_devices(timeout, missing, cache=cache, pool=pool)
+        ) as discovered:
+            async for dev in discovered:
+                devices[dev.address.upper()] = dev
+    if pool is not None:
+        for dev in devices.values():
+            dev.set_adapter_pool(pool)
+    return devices
+
+
+async def _find_device_by_address(
+    device_address: str,
+    timeout: float,
+    cache: DeviceCache | None,
+    pool: AdapterPool | None = None,
+) -> BLEDevice | None:
+    """Scan for a device that could not be reached from the cache."""
+    if cache is not None:
+        cache.invalidate(device_address)
+    async with aclosing(
+        discover_devices(timeout, [device_address], cache=cache, pool=pool)
+    ) as discovered:
+        async for dev in discovered:
+            return dev.ble_device
+    return None
+
+
+async def get_device_from_address(
+    device_address: str,
+    timeout: float = DEFAULT_DISCOVERY_TIMEOUT,
+    cache: DeviceCache | None = None,
+    use_cache: bool = True,
+) -> BaseDevice:
+    """Get BLEDevice object from mac address.
+
+    Devices found in the discovery cache are built without scanning, a scan
+    is only done on a cache miss or if connecting to the cached device fails.
+    """
+    devices = await get_devices_from_addresses(
+        [device_address], timeout, cache, use_cache
+    )
+    if dev := devices.get(device_address.upper()):
+        return dev
+
+    raise DeviceNotFound
+
+
+@dataclass
+class ProbeResult:
+    """Outcome of a connection attempt to a device."""
+
+    address: str
+    name: str | None
+    # class name of the model picked from the advertisement
+    model: str
+    rssi: int | None = None
+    # seconds to connect and resolve the services
+    connect_time: float | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        """Return whether the device could be reached."""
+        return self.error is None
+
+    @property
+    def known_model(self) -> bool:
+        """Return whether the name matched a model, not the fallback one."""
+        return self.model != FALLBACK_SPEC.class_name
+
+
+async def probe_device(
+    ble_device: BLEDevice,
+    advertisement_data: AdvertisementData | None = None,
+    timeout: float = DEFAULT_PROBE_TIMEOUT,
+) -> ProbeResult:
+    """Connect to a device once and check that it has the UART characteristics.
+
+    The model is only classified from the advertisement, no device is built.
+    """
+    service_uuids = advertisement_data.service_uuids if advertisement_data else []
+    spec = MODEL_REGISTRY.match(ble_device.name, service_uuids) or FALLBACK_SPEC
+    result = ProbeResult(
+        ble_device.address,
+        ble_device.name,
+        spec.class_name,
+        advertisement_data.rssi if advertisement_data else None,
+    )
+    start = time.monotonic()
+    client: BleakClientWithServiceCache | None = None
+    try:
+        with phase("probe", ble_device.address):
+            client = await asyncio.wait_for(
+                establish_connection(
+                    BleakClientWithServiceCache,
+                    ble_device,
+                    ble_device.name or ble_device.address,
+                    max_attempts=1,
+                    use_services_cache=True,
+                ),
+                timeout,
+            )
+        result.connect_time = time.monotonic() - start
+        if not all(
+            client.services.get_characteristic(uuid)
+            for uuid in (UART_RX_CHAR_UUID, UART_TX_CHAR_UUID)
+        ):
+            result.error = "UART characteristics missing"
+    except BLEAK_EXCEPTIONS as ex:
+        result.error = str(ex) or ex.__class__.__name__
+    finally:
+        if client is not None:
+            try:
+                await client.disconnect()
+            except BLEAK_EXCEPTIONS:
+                pass
+    return result
+
+
+async def probe_devices(
+    devices: Iterable[tuple[BLEDevice, AdvertisementData | None]],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    timeout: float = DEFAULT_PROBE_TIMEOUT,
+) -> list[ProbeResult]:
+    """Probe devices concurrently, at most `max_concurrency` at once."""
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _probe(
+        ble_device: BLEDevice, advertisement_data: AdvertisementData | None
+    ) -> ProbeResult:
+        async with semaphore:
+            return await probe_device(ble_device, advertisement_data, timeout)
+
+    return list(
+        await asyncio.gather(
+            *(
+                _probe(ble_device, advertisement_data)
+                for ble_device, advertisement_data in devices
+            )
+        )
+    )
@@ -1,16 +1,15 @@
 """Module defining fallback device."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["Fallback"]
 
 
 class Fallback(BaseDevice):
     """Fallback device used when a device is not completely supported yet."""
 
-    _model_name = "fallback"
-    _model_codes = []
-    _colors: dict[str, int] = {
-        "white": 0,
-        "red": 0,
-        "green": 1,
-        "blue": 2,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -0,0 +1,175 @@
+"""Priority classes of the operations queued on a device."""
+
+import asyncio
+import itertools
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import AsyncIterator, Iterator
+
+from ..profiling import phase
+
+# a waiting operation gains one priority class per interval waited, in seconds
+AGING_INTERVAL = 1.0
+
+
+class Priority(IntEnum):
+    """Priority class of an operation, lower values run first."""
+
+    INTERACTIVE = 0
+    AUTOMATION = 1
+    BACKGROUND = 2
+
+
+_priority_override: ContextVar[Priority | None] = ContextVar(
+    "chihiros_priority_override", default=None
+)
+
+
+@contextmanager
+def command_priority(priority: Priority) -> Iterator[None]:
+    """Send the commands issued in this block with the given priority class."""
+    token = _priority_override.set(priority)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+
+def resolve_priority(default: Priority) -> Priority:
+    """Return the priority class of a command, `default` unless overridden."""
+    override = _priority_override.get()
+    return default if override is None else override
+
+
+@dataclass
+class QueueStats:
+    """Queue latency of a priority class, in seconds."""
+
+    operations: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    preemptions: int = 0
+
+    @property
+    def mean_wait(self) -> float | None:
+        """Return the mean time waited for the device."""
+        if not self.operations:
+            return None
+        return self.total_wait / self.operations
+
+
+@dataclass
+class _Waiter:
+    priority: Priority
+    enqueued: float
+    seq: int
+    future: "asyncio.Future[None]"
+
+
+class PriorityLock:
+    """Lock granted to the waiter of the highest priority class.
+
+    Waiters are aged so that background work keeps progressing: a waiter gains
+    one class per `aging_interval` seconds waited. The holder can let waiters
+    of a higher class run between two operations with `yield_to_waiters`.
+    """
+
+    def __init__(self, aging_interval: float = AGING_INTERVAL) -> None:
+        """Create an unlocked lock."""
+        self.aging_interval = aging_interval
+        self.stats = {priority: QueueStats() for priority in Priority}
+        self._locked = False
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+
+    def locked(self) -> bool:
+        """Return whether the lock is held."""
+        return self._locked
+
+    def _rank(self, waiter: _Waiter, now: float) -> tuple[float, int]:
+        """Return the rank of a waiter, the lowest is served first."""
+        aged = waiter.priority - (now - waiter.enqueued) / self.aging_interval
+        return aged, waiter.seq
+
+    async def acquire(
+        self, priority: Priority, enqueued: float | None = None, record: bool = True
+    ) -> None:
+        """Wait for the lock."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if not self._locked and not self._live_waiters():
+            self._locked = True
+        else:
+            waiter = _Waiter(
+                priority,
+                start if enqueued is None else enqueued,
+                next(self._seq),
+                loop.create_future(),
+            )
+            self._waiters.append(waiter)
+            try:
+                with phase("queue wait"):
+                    await waiter.future
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    # the lock may have been released while no waiter was live
+                    if not self._locked:
+                        self._wake_up_first()
+                elif not waiter.future.cancelled():
+                    # granted while being cancelled
+                    self.release()
+                raise
+        if record:
+            wait = loop.time() - start
+            stats = self.stats[priority]
+            stats.operations += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+
+    def release(self) -> None:
+        """Release the lock and grant it to the best waiter."""
+        self._locked = False
+        self._wake_up_first()
+
+    def _live_waiters(self) -> list[_Waiter]:
+        """Drop the cancelled waiters and return the others."""
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+        return self._waiters
+
+    def _wake_up_first(self) -> None:
+        """Grant the free lock to the best waiter, if any."""
+        if not (waiters := self._live_waiters()):
+            return
+        now = asyncio.get_running_loop().time()
+        waiter = min(waiters, key=lambda waiter: self._rank(waiter, now))
+        self._waiters.remove(waiter)
+        self._locked = True
+        waiter.future.set_result(None)
+
+    def has_waiter_above(self, priority: Priority) -> bool:
+        """Return whether a waiter ranks above the given class."""
+        now = asyncio.get_running_loop().time()
+        return any(
+            self._rank(waiter, now)[0] < priority for waiter in self._live_waiters()
+        )
+
+    async def yield_to_waiters(self, priority: Priority, enqueued: float) -> None:
+        """Let the waiters ranking above the holder run, then take the lock back."""
+        if not self.has_waiter_above(priority):
+            return
+        self.stats[priority].preemptions += 1
+        self.release()
+        await self.acquire(priority, enqueued, record=False)
+
+    @asynccontextmanager
+    async def hold(self, priority: Priority) -> AsyncIterator[float]:
+        """Hold the lock in this block, yield the time the request was made."""
+        enqueued = asyncio.get_running_loop().time()
+        await self.acquire(priority)
+        try:
+            yield enqueued
+        finally:
+            self.release()
@@ -0,0 +1,111 @@
+"""Module classifying advertised device names into models."""
+
+import importlib
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable
+
+from ..const import UART_SERVICE_UUID
+from .catalog import FALLBACK_SPEC, MODEL_CATALOG, ModelSpec
+
+if TYPE_CHECKING:
+    from .base_device import BaseDevice
+
+_UART_SERVICE_UUID = UART_SERVICE_UUID.lower()
+
+
+class _TrieNode:
+    """Node of the model code prefix trie."""
+
+    __slots__ = ("children", "specs")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _TrieNode] = {}
+        self.specs: tuple[ModelSpec, ...] = ()
+
+
+class ModelRegistry:
+    """Registry matching advertised names with the longest known model prefix."""
+
+    def __init__(self, catalog: Iterable[ModelSpec]) -> None:
+        """Compile the catalog into a prefix trie."""
+        self._root = _TrieNode()
+        self._classes: dict[str, type["BaseDevice"]] = {}
+        # family prefixes are inserted first so that model codes come first on
+        # conflicts
+        for spec in catalog:
+            for prefix in spec.family_prefixes:
+                self._insert(prefix, spec)
+        for spec in catalog:
+            for code in spec.codes:
+                self._insert(code, spec)
+        self.match_candidates = lru_cache(maxsize=1024)(self._match_candidates)
+
+    def _insert(self, prefix: str, spec: ModelSpec) -> None:
+        node = self._root
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        node.specs = (spec, *(other for other in node.specs if other is not spec))
+
+    def _match_candidates(self, name: str) -> tuple[ModelSpec, ...]:
+        """Return the models of all the codes prefixing the name, longest first."""
+        node = self._root
+        matched: list[ModelSpec] = []
+        for char in name:
+            next_node = node.children.get(char)
+            if next_node is None:
+                break
+            node = next_node
+            if node.specs:
+                matched = [
+                    *node.specs,
+                    *(spec for spec in matched if spec not in node.specs),
+                ]
+        return tuple(matched)
+
+    def match_name(self, name: str) -> ModelSpec | None:
+        """Return the model of the longest code prefixing the name."""
+        candidates = self.match_candidates(name)
+        return candidates[0] if candidates else None
+
+    def match(
+        self, name: str | None, service_uuids: Iterable[str] = ()
+    ) -> ModelSpec | None:
+        """Return the model of an advertisement, None if it is not a Chihiros device.
+
+        When several models match the name, the longest one advertising all its
+        services wins. Unknown names advertising the UART service are matched with
+        the fallback model.
+        """
+        candidates = self.match_candidates(name) if name else ()
+        if len(candidates) == 1:
+            return candidates[0]
+        advertised = {uuid.lower() for uuid in service_uuids}
+        if candidates:
+            return next(
+                (
+                    spec
+                    for spec in candidates
+                    if advertised.issuperset(spec.service_uuids)
+                ),
+                candidates[0],
+            )
+        if _UART_SERVICE_UUID in advertised:
+            return FALLBACK_SPEC
+        return None
+
+    def get_class(self, spec: ModelSpec) -> type["BaseDevice"]:
+        """Import the class of a model the first time it is needed."""
+        if (model_class := self._classes.get(spec.class_name)) is None:
+            module = importlib.import_module(f".{spec.module}", __package__)
+            model_class = getattr(module, spec.class_name)
+            self._classes[spec.class_name] = model_class
+        return model_class
+
+    def get_class_from_name(
+        self, name: str | None, service_uuids: Iterable[str] = ()
+    ) -> type["BaseDevice"]:
+        """Return the class of a device, the fallback class for unknown devices."""
+        return self.get_class(self.match(name, service_uuids) or FALLBACK_SPEC)
+
+
+MODEL_REGISTRY = ModelRegistry(MODEL_CATALOG)
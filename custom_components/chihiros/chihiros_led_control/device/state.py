@@ -0,0 +1,85 @@
+"""Model of the state last written to a device."""
+
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+
+from ..schedule import AutoSetting
+
+# the clock of a device is synchronized again when older than this, in seconds
+TIME_SYNC_MAX_AGE = 3600.0
+
+
+class DeviceMode(str, Enum):
+    """Mode of a device."""
+
+    MANUAL = "manual"
+    AUTO = "auto"
+
+
+@dataclass
+class WriteStats:
+    """Counters of the writes sent to a device and of the skipped ones."""
+
+    # gatt writes, a packed write carries several frames
+    sent_writes: int = 0
+    sent_frames: int = 0
+    # commands skipped as a whole
+    suppressed_writes: int = 0
+    suppressed_frames: int = 0
+
+
+@dataclass
+class DeviceState:
+    """State of a device as last written without error.
+
+    Unknown values are None or missing, they never suppress a write.
+    """
+
+    levels: dict[int, int] = field(default_factory=dict)
+    mode: DeviceMode | None = None
+    time_synced_at: float | None = None
+    # settings written to the device, they survive reboots
+    auto_settings: list[AutoSetting] = field(default_factory=list)
+
+    @property
+    def time_sync_age(self) -> float | None:
+        """Return the number of seconds since the clock was synchronized."""
+        if self.time_synced_at is None:
+            return None
+        return time.monotonic() - self.time_synced_at
+
+    def changed_levels(self, levels: dict[int, int]) -> dict[int, int]:
+        """Return the channel levels that differ from the known ones."""
+        if self.mode is not DeviceMode.MANUAL:
+            return dict(levels)
+        return {
+            channel: level
+            for channel, level in levels.items()
+            if self.levels.get(channel) != level
+        }
+
+    def set_levels(self, levels: dict[int, int]) -> None:
+        """Record channel levels set manually."""
+        if self.mode is not DeviceMode.MANUAL:
+            self.levels.clear()
+        self.mode = DeviceMode.MANUAL
+        self.levels.update(levels)
+
+    def needs_time_sync(self) -> bool:
+        """Return whether the clock of the device must be synchronized."""
+        age = self.time_sync_age
+        return age is None or age > TIME_SYNC_MAX_AGE
+
+    def set_auto_mode(self, time_synced: bool) -> None:
+        """Record the switch to auto mode, levels follow the schedule from now."""
+        self.mode = DeviceMode.AUTO
+        self.levels.clear()
+        if time_synced:
+            self.time_synced_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """Forget everything, e.g. when the device may have rebooted."""
+        self.levels.clear()
+        self.mode = None
+        self.time_synced_at = None
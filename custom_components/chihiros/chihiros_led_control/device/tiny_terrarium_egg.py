@@ -1,14 +1,15 @@
 """Tiny Terraform egg device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["TinyTerrariumEgg"]
 
 
 class TinyTerrariumEgg(BaseDevice):
     """Tiny Terraform egg device Class."""
 
-    _model_name = "Tiny Terrarium Egg"
-    _model_codes = ["DYDD"]
-    _colors: dict[str, int] = {
-        "red": 0,
-        "green": 1,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -1,25 +1,15 @@
 """Universal WRGB device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["UniversalWRGB"]
 
 
 class UniversalWRGB(BaseDevice):
     """Universal WRGB device Class."""
 
-    _model_name = "Universal WRGB"
-    _model_codes = [
-        "DYU550",
-        "DYU600",
-        "DYU700",
-        "DYU800",
-        "DYU920",
-        "DYU1000",
-        "DYU1200",
-        "DYU1500",
-    ]
-    _colors: dict[str, int] = {
-        "red": 0,
-        "green": 1,
-        "blue": 2,
-        "white": 3,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
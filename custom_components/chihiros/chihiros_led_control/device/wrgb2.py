@@ -1,15 +1,15 @@
 """WRGB II device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["WRGBII"]
 
 
 class WRGBII(BaseDevice):
     """Chihiros WRGB II device Class."""
 
-    _model_name = "WRGB II"
-    _model_codes = ["DYNWRGB", "DYNW30", "DYNW45", "DYNW60", "DYNW90", "DYNW12P"]
-    _colors: dict[str, int] = {
-        "red": 0,
-        "green": 1,
-        "blue": 2,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -1,23 +1,15 @@
 """WRGB II Pro device Model."""
 
 from .base_device import BaseDevice
+from .catalog import MODEL_SPECS
+
+_SPEC = MODEL_SPECS["WRGBIIPro"]
 
 
 class WRGBIIPro(BaseDevice):
     """Chihiros WRGB II Pro device Class."""
 
-    _model_name = "WRGB II Pro"
-    _model_codes = [
-        "DYWPRO30",
-        "DYWPRO45",
-        "DYWPRO60",
-        "DYWPRO80",
-        "DYWPRO90",
-        "DYWPRO120",
-    ]
-    _colors: dict[str, int] = {
-        "red": 0,
-        "green": 1,
-        "blue": 2,
-        "white": 3,
-    }
+    _model_name = _SPEC.model_name
+    _model_codes = list(_SPEC.codes)
+    _colors: dict[str, int] = dict(_SPEC.colors)
+    _packed_writes = _SPEC.packed_writes
@@ -0,0 +1,257 @@
+"""Flow controlled writer for write-without-response frames."""
+
+import asyncio
+import itertools
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+# minimum delay between two frames, in seconds
+DEFAULT_MIN_FRAME_GAP = 0.0
+DEFAULT_INITIAL_WINDOW = 4
+MAX_WINDOW = 32
+# a frame is considered lost when not acknowledged within this delay, in seconds,
+# until the round trip time of the device is known
+ACK_TIMEOUT = 0.5
+MIN_ACK_TIMEOUT = 0.05
+# the window only grows while the round trip time stays below this multiple of
+# the shortest one, longer ones mean that frames queue up in the device
+RTT_INFLATION = 2.0
+RTT_SMOOTHING = 0.125
+# size of the header of an attribute protocol write, a write carries at most
+# the link mtu minus this many bytes
+ATT_HEADER_SIZE = 3
+# mtu of a link before any negotiation
+DEFAULT_MTU = 23
+
+
+@dataclass
+class WriterStats:
+    """Counters of a writer."""
+
+    frames: int = 0
+    writes: int = 0
+    acks: int = 0
+    # notifications not acknowledging any frame in flight
+    unmatched: int = 0
+    losses: int = 0
+    busy_time: float = 0.0
+
+    @property
+    def fps(self) -> float | None:
+        """Return the sustained number of frames per second while writing."""
+        if not self.busy_time:
+            return None
+        return self.frames / self.busy_time
+
+    @property
+    def frames_per_write(self) -> float | None:
+        """Return the mean number of frames packed in a write."""
+        if not self.writes:
+            return None
+        return self.frames / self.writes
+
+
+def message_id(frame: bytes) -> bytes | None:
+    """Return the message id of a frame or of a notification answering it."""
+    if len(frame) < 5:
+        return None
+    return bytes(frame[3:5])
+
+
+def pack_frames(frames: list[bytes], max_size: int) -> list[list[bytes]]:
+    """Group consecutive frames into writes of at most `max_size` bytes.
+
+    The order of the frames is kept, a frame longer than `max_size` is
+    written alone.
+    """
+    writes: list[list[bytes]] = []
+    size = 0
+    for frame in frames:
+        if writes and size + len(frame) <= max_size:
+            writes[-1].append(frame)
+            size += len(frame)
+        else:
+            writes.append([frame])
+            size = len(frame)
+    return writes
+
+
+class FlowControlledWriter:
+    """Pace the frames written to a device.
+
+    Frames are spaced by at least `min_gap` seconds. A notification carrying
+    the message id of a frame in flight acknowledges it and the frames written
+    before it. Once the device has acknowledged a frame on the current
+    connection, at most `window` frames are in flight. The window grows by one
+    frame per window of acknowledged frames while they are not queued up in the
+    device, and is halved when a frame is not acknowledged in time or a write
+    fails (AIMD). A frame not acknowledged in time also stops the wait for
+    acknowledgements until the next one, so devices that never or only
+    sometimes acknowledge are only paced by `min_gap`. Frames packed in one
+    write are in flight together and acknowledged one by one.
+    """
+
+    def __init__(
+        self,
+        min_gap: float = DEFAULT_MIN_FRAME_GAP,
+        initial_window: int = DEFAULT_INITIAL_WINDOW,
+        max_window: int = MAX_WINDOW,
+    ) -> None:
+        """Create a writer."""
+        self.min_gap = min_gap
+        self.initial_window = initial_window
+        self.window = float(initial_window)
+        self.max_window = max_window
+        self.stats = WriterStats()
+        self._acks_seen = False
+        # message ids and send times of the frames in flight, oldest first
+        self._in_flight: deque[tuple[bytes | None, float]] = deque(
+            maxlen=4 * max_window
+        )
+        self._acked = asyncio.Event()
+        self._last_write = float("-inf")
+        self._srtt: float | None = None
+        self._min_rtt = float("inf")
+        self._recovery_until = float("-inf")
+
+    @property
+    def ack_timeout(self) -> float:
+        """Return the delay after which a frame is considered lost."""
+        if self._srtt is None:
+            return ACK_TIMEOUT
+        return max(MIN_ACK_TIMEOUT, 3 * self._srtt)
+
+    def acknowledge(self, notification: bytes) -> None:
+        """Handle a notification received from the device.
+
+        Notifications not matching a frame in flight are ignored.
+        """
+        key = message_id(notification)
+        index = next(
+            (
+                index
+                for index, (frame_key, _sent) in enumerate(self._in_flight)
+                if key is not None and frame_key == key
+            ),
+            None,
+        )
+        if index is None:
+            self.stats.unmatched += 1
+            return
+        for _ in range(index):
+            self._in_flight.popleft()
+        _key, sent = self._in_flight.popleft()
+        self._acks_seen = True
+        self.stats.acks += index + 1
+        self._acked.set()
+        rtt = asyncio.get_running_loop().time() - sent
+        self._min_rtt = min(self._min_rtt, rtt)
+        self._srtt = (
+            rtt
+            if self._srtt is None
+            else self._srtt + (rtt - self._srtt) * RTT_SMOOTHING
+        )
+        if rtt <= self._min_rtt * RTT_INFLATION:
+            self.window = min(self.max_window, self.window + 1 / self.window)
+
+    def _lost(self, now: float) -> None:
+        """Handle a lost frame, the window is halved at most once per timeout."""
+        self.stats.losses += 1
+        if now >= self._recovery_until:
+            self.window = max(1.0, self.window / 2)
+            self._recovery_until = now + self.ack_timeout
+
+    def _expire(self, now: float) -> None:
+        """Count the frames not acknowledged in time as lost.
+
+        The writer stops waiting for acknowledgements until the next one.
+        """
+        timeout = self.ack_timeout
+        while self._in_flight and now - self._in_flight[0][1] > timeout:
+            self._in_flight.popleft()
+            self._lost(now)
+            self._acks_seen = False
+
+    def reset(self) -> None:
+        """Forget the frames in flight and the device, e.g. after a disconnection."""
+        self._in_flight.clear()
+        self._acks_seen = False
+        self.window = float(self.initial_window)
+        self._srtt = None
+        self._min_rtt = float("inf")
+        self._recovery_until = float("-inf")
+
+    async def _wait_for_window(self) -> None:
+        """Wait until a frame can be sent."""
+        loop = asyncio.get_running_loop()
+        while self._acks_seen:
+            now = loop.time()
+            self._expire(now)
+            if len(self._in_flight) < int(self.window):
+                return
+            self._acked.clear()
+            wait = self._in_flight[0][1] + self.ack_timeout - now
+            try:
+                await asyncio.wait_for(self._acked.wait(), max(wait, 0.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def write(
+        self,
+        write_frame: Callable[[bytes], Awaitable[None]],
+        frames: list[bytes],
+        max_write_size: int | None = None,
+    ) -> None:
+        """Write the frames of a single operation, see `write_operations`."""
+        await self.write_operations(write_frame, [frames], None, max_write_size)
+
+    async def write_operations(
+        self,
+        write_frame: Callable[[bytes], Awaitable[None]],
+        operations: list[list[bytes]],
+        between_operations: Callable[[], Awaitable[None]] | None = None,
+        max_write_size: int | None = None,
+    ) -> None:
+        """Write frames with `write_frame`, as fast as the device takes them.
+
+        With `max_write_size`, consecutive frames are concatenated into writes
+        of at most that many bytes, else each frame is written alone.
+        `between_operations` is awaited before a write starting an operation
+        after a write ending the previous one, never in the middle of one.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if not self._acks_seen:
+            self._in_flight.clear()
+        frames = [frame for operation in operations for frame in operation]
+        if max_write_size is None:
+            writes = [[frame] for frame in frames]
+        else:
+            writes = pack_frames(frames, max_write_size)
+        # indexes of the first frames of the operations
+        boundaries = set(
+            itertools.accumulate(len(operation) for operation in operations)
+        )
+        written = 0
+        try:
+            for packed in writes:
+                if written and written in boundaries and between_operations:
+                    await between_operations()
+                await self._wait_for_window()
+                if (delay := self._last_write + self.min_gap - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    await write_frame(b"".join(packed))
+                except Exception:
+                    self._lost(loop.time())
+                    raise
+                self._last_write = loop.time()
+                self._in_flight.extend(
+                    (message_id(frame), self._last_write) for frame in packed
+                )
+                written += len(packed)
+                self.stats.frames += len(packed)
+                self.stats.writes += 1
+        finally:
+            self.stats.busy_time += loop.time() - start
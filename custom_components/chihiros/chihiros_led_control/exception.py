@@ -7,3 +7,11 @@ class CharacteristicMissingError(Exception):
 
 class DeviceNotFound(Exception):
     """Raised when BLE device is not found."""
+
+
+class DeviceUnavailable(Exception):
+    """Raised when a command is sent to a device known to be unreachable."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a command did not complete before its deadline."""
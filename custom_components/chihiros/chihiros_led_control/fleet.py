@@ -0,0 +1,367 @@
+"""Module converging lights to the state described by a fleet file.
+
+A fleet file maps addresses or group names to the desired state of the
+lights, e.g.
+
+    {
+        "rack": {
+            "mode": "auto",
+            "settings": [
+                {"sunrise": "08:00", "sunset": "20:00", "max-brightness": 80,
+                 "ramp-up-in-minutes": 30, "weekdays": ["everyday"]}
+            ]
+        },
+        "AA:BB:CC:DD:EE:FF": {"mode": "manual", "levels": {"white": 60}}
+    }
+
+Later entries replace the earlier ones for the same light. The state last
+applied to each light is recorded, so that only the differences are sent.
+"""
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from .batch import (
+    DeviceResult,
+    InvalidScriptError,
+    Operation,
+    parse_kwargs,
+    run_operations,
+)
+from .const import DEFAULT_MAX_CONCURRENCY
+from .device.state import DeviceMode
+from .groups import resolve_targets
+from .schedule import AutoSetting, apply_setting_operation
+from .weekday_encoding import decode_selected_weekdays
+
+if TYPE_CHECKING:
+    from .device.adapters import AdapterPool
+    from .trace import TraceRecorder
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD_VERSION = 1
+DEFAULT_RETRIES = 2
+
+
+class InvalidFleetError(Exception):
+    """Raised when a fleet file can not be parsed."""
+
+
+def default_record_path() -> Path:
+    """Return the path of the record of the applied states of the current user."""
+    if env_path := os.environ.get("CHIHIROS_APPLIED_FILE"):
+        return Path(env_path)
+    state_home = os.environ.get("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+    return Path(state_home) / "chihiros" / "applied.json"
+
+
+@dataclass
+class DesiredState:
+    """State of a light described by a fleet file."""
+
+    mode: DeviceMode
+    # levels of the colors in manual mode, keyed by color name or id
+    levels: dict[str, int] = field(default_factory=dict)
+    settings: list[AutoSetting] = field(default_factory=list)
+
+    def to_json(self) -> dict[str, Any]:
+        """Return the state as a json object."""
+        return {
+            "mode": self.mode.value,
+            "levels": self.levels,
+            "settings": [
+                {
+                    "sunrise": setting.sunrise.strftime("%H:%M"),
+                    "sunset": setting.sunset.strftime("%H:%M"),
+                    "brightness": list(setting.brightness),
+                    "ramp_up_minutes": setting.ramp_up_minutes,
+                    "weekdays": setting.weekdays,
+                }
+                for setting in self.settings
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> "DesiredState":
+        """Build a state from a json object written by `to_json`."""
+        return cls(
+            DeviceMode(data["mode"]),
+            dict(data["levels"]),
+            [
+                AutoSetting(
+                    datetime.time.fromisoformat(raw["sunrise"]),
+                    datetime.time.fromisoformat(raw["sunset"]),
+                    tuple(raw["brightness"]),
+                    raw["ramp_up_minutes"],
+                    raw["weekdays"],
+                )
+                for raw in data["settings"]
+            ],
+        )
+
+
+def _parse_state(target: str, raw: Any) -> DesiredState:
+    """Parse the desired state of a fleet file entry."""
+    if not isinstance(raw, dict):
+        raise InvalidFleetError(f"{target}: the desired state must be an object")
+    try:
+        mode = DeviceMode(raw.get("mode", DeviceMode.MANUAL.value))
+    except ValueError as ex:
+        raise InvalidFleetError(f"{target}: unknown mode `{raw.get('mode')}`") from ex
+    levels = raw.get("levels", {})
+    if not isinstance(levels, dict) or not all(
+        isinstance(level, int) and 0 <= level <= 100 for level in levels.values()
+    ):
+        raise InvalidFleetError(f"{target}: levels must map colors to 0-100")
+    if mode is DeviceMode.AUTO and levels:
+        raise InvalidFleetError(f"{target}: levels are only set in manual mode")
+    if mode is DeviceMode.MANUAL and not levels:
+        raise InvalidFleetError(f"{target}: manual mode needs levels")
+    raw_settings = raw.get("settings", [])
+    if not isinstance(raw_settings, list):
+        raise InvalidFleetError(f"{target}: settings must be a list")
+    settings: list[AutoSetting] = []
+    for index, raw_setting in enumerate(raw_settings):
+        if not isinstance(raw_setting, dict) or not {"sunrise", "sunset"} <= set(
+            raw_setting
+        ):
+            raise InvalidFleetError(
+                f"{target}: setting #{index} needs a sunrise and a sunset"
+            )
+        try:
+            kwargs = parse_kwargs("add_setting", raw_setting)
+        except InvalidScriptError as ex:
+            raise InvalidFleetError(f"{target}: setting #{index}: {ex}") from ex
+        apply_setting_operation(settings, "add_setting", kwargs)
+    return DesiredState(
+        mode, {str(color): level for color, level in levels.items()}, settings
+    )
+
+
+def parse_fleet(data: Any, groups: dict[str, list[str]]) -> dict[str, DesiredState]:
+    """Parse a fleet, keyed by the addresses of the lights."""
+    if not isinstance(data, dict):
+        raise InvalidFleetError("A fleet must map addresses or groups to states")
+    fleet: dict[str, DesiredState] = {}
+    for target, raw in data.items():
+        state = _parse_state(target, raw)
+        for address in resolve_targets([target], groups):
+            fleet[address] = state
+    return fleet
+
+
+def load_fleet(path: Path, groups: dict[str, list[str]]) -> dict[str, DesiredState]:
+    """Load a fleet from a json file."""
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError) as ex:
+        raise InvalidFleetError(f"Can not read fleet {path}: {ex}") from ex
+    return parse_fleet(data, groups)
+
+
+class AppliedRecord:
+    """On disk record of the states last applied to the lights."""
+
+    def __init__(self, path: Path | None = None) -> None:
+        """Create a record."""
+        self.path = path or default_record_path()
+        self._states: dict[str, DesiredState] | None = None
+        self._dirty = False
+
+    def _load(self) -> dict[str, DesiredState]:
+        """Load the record file once."""
+        if self._states is not None:
+            return self._states
+        self._states = {}
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return self._states
+        except (OSError, ValueError):
+            _LOGGER.debug("Ignoring unreadable record %s", self.path, exc_info=True)
+            return self._states
+        if not isinstance(data, dict) or data.get("version") != RECORD_VERSION:
+            return self._states
+        for address, raw in data.get("devices", {}).items():
+            try:
+                self._states[address] = DesiredState.from_json(raw)
+            except (KeyError, TypeError, ValueError):
+                continue
+        return self._states
+
+    def _save(self) -> None:
+        """Atomically write the record file."""
+        self._dirty = False
+        data = {
+            "version": RECORD_VERSION,
+            "devices": {
+                address: state.to_json() for address, state in self._load().items()
+            },
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(data, tmp_file, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            _LOGGER.warning("Can not write record %s", self.path, exc_info=True)
+
+    def get(self, address: str) -> DesiredState | None:
+        """Get the state last applied to a light."""
+        return self._load().get(address.upper())
+
+    def set(self, address: str, state: DesiredState) -> None:
+        """Record the state applied to a light, until the next `flush`."""
+        self._load()[address.upper()] = state
+        self._dirty = True
+
+    def invalidate(self, address: str) -> None:
+        """Forget the state of a light, until the next `flush`."""
+        if self._load().pop(address.upper(), None) is not None:
+            self._dirty = True
+
+    def flush(self) -> None:
+        """Write the record file if states have been set or forgotten."""
+        if self._dirty:
+            self._save()
+
+
+def _setting_kwargs(setting: AutoSetting) -> dict[str, Any]:
+    """Return the parameters of the commands adding or removing a setting."""
+    today = datetime.date.today()
+    return {
+        "sunrise": datetime.datetime.combine(today, setting.sunrise),
+        "sunset": datetime.datetime.combine(today, setting.sunset),
+        "ramp_up_in_minutes": setting.ramp_up_minutes,
+        "weekdays": decode_selected_weekdays(setting.weekdays),
+    }
+
+
+def plan_device(
+    address: str, desired: DesiredState, applied: DesiredState | None
+) -> list[Operation]:
+    """Return the operations converging a light from its applied state.
+
+    A light without a known applied state has its settings reset first.
+    """
+    operations: list[Operation] = []
+    if applied is None:
+        operations.append(Operation(address, "reset_settings"))
+        removed: list[AutoSetting] = []
+        added = desired.settings
+    else:
+        removed = [
+            setting
+            for setting in applied.settings
+            if not any(setting.same_slot(other) for other in desired.settings)
+        ]
+        added = [
+            setting for setting in desired.settings if setting not in applied.settings
+        ]
+    for setting in removed:
+        operations.append(
+            Operation(address, "remove_setting", _setting_kwargs(setting))
+        )
+    for setting in added:
+        kwargs = _setting_kwargs(setting)
+        if setting.brightness[1:] == (255, 255):
+            kwargs["max_brightness"] = setting.brightness[0]
+            operations.append(Operation(address, "add_setting", kwargs))
+        else:
+            kwargs["max_brightness"] = setting.brightness
+            operations.append(Operation(address, "add_rgb_setting", kwargs))
+    if desired.mode is DeviceMode.AUTO:
+        if applied is None or applied.mode is not DeviceMode.AUTO or operations:
+            operations.append(Operation(address, "enable_auto_mode"))
+        return operations
+    for color, level in desired.levels.items():
+        if applied is not None and applied.mode is DeviceMode.MANUAL:
+            if applied.levels.get(color) == level:
+                continue
+        # the light is converged from the record, not from the state it reports
+        kwargs = {
+            "brightness": level,
+            "color": int(color) if color.isdigit() else color,
+        }
+        operations.append(
+            Operation(address, "set_color_brightness", {**kwargs, "force": True})
+        )
+    return operations
+
+
+def plan_fleet(
+    fleet: dict[str, DesiredState], record: AppliedRecord, full: bool = False
+) -> dict[str, list[Operation]]:
+    """Return the operations of each light that needs changes.
+
+    With `full`, the record is ignored and every light is converged from
+    scratch.
+    """
+    plan: dict[str, list[Operation]] = {}
+    for address, desired in fleet.items():
+        applied = None if full else record.get(address)
+        if operations := plan_device(address, desired, applied):
+            plan[address] = operations
+    return plan
+
+
+async def apply_plan(
+    plan: dict[str, list[Operation]],
+    fleet: dict[str, DesiredState],
+    record: AppliedRecord,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    use_cache: bool = True,
+    timeout: float | None = None,
+    tracer: "TraceRecorder | None" = None,
+    pool: "AdapterPool | None" = None,
+    pack_frames: bool | None = None,
+) -> tuple[dict[str, DeviceResult], dict[str, int]]:
+    """Apply a plan, one connection per light and lights concurrently.
+
+    A light that failed may have received part of its operations, its
+    settings are unknown: it is retried from scratch up to `retries` times,
+    and forgotten by the record if it still fails so that the next plan
+    converges it from scratch too. The record is written once, at the end.
+    Return the last result and the number of attempts of each light.
+    """
+    results: dict[str, DeviceResult] = {}
+    attempts: dict[str, int] = {}
+    pending = dict(plan)
+    try:
+        for _ in range(retries + 1):
+            if not pending:
+                break
+            for result in await run_operations(
+                [
+                    operation
+                    for operations in pending.values()
+                    for operation in operations
+                ],
+                max_concurrency,
+                use_cache=use_cache,
+                timeout=timeout,
+                tracer=tracer,
+                pool=pool,
+                pack_frames=pack_frames,
+            ):
+                address = result.address
+                results[address] = result
+                attempts[address] = attempts.get(address, 0) + 1
+                if result.ok:
+                    record.set(address, fleet[address])
+                    del pending[address]
+                else:
+                    record.invalidate(address)
+                    pending[address] = plan_device(address, fleet[address], None)
+    finally:
+        record.flush()
+    return results, attempts
@@ -0,0 +1,63 @@
+"""Module resolving named groups of devices."""
+
+import json
+import os
+from pathlib import Path
+
+
+class InvalidGroupsError(Exception):
+    """Raised when the groups file can not be parsed."""
+
+
+def default_groups_path() -> Path:
+    """Return the path of the groups file of the current user."""
+    if env_path := os.environ.get("CHIHIROS_GROUPS_FILE"):
+        return Path(env_path)
+    config_home = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+    return Path(config_home) / "chihiros" / "groups.json"
+
+
+def load_groups(path: Path | None = None) -> dict[str, list[str]]:
+    """Load groups of device addresses.
+
+    The groups file is a json object mapping group names to lists of addresses
+    or of other group names, e.g. {"rack": ["AA:BB:CC:DD:EE:01", "shelf"]}.
+    A missing file means that no group is defined.
+    """
+    path = path or default_groups_path()
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as ex:
+        raise InvalidGroupsError(f"Can not read groups file {path}: {ex}") from ex
+    if not isinstance(data, dict) or not all(
+        isinstance(members, list) and all(isinstance(m, str) for m in members)
+        for members in data.values()
+    ):
+        raise InvalidGroupsError(
+            f"Groups file {path} must map group names to lists of addresses"
+        )
+    return data
+
+
+def resolve_targets(targets: list[str], groups: dict[str, list[str]]) -> list[str]:
+    """Expand group names into device addresses.
+
+    Targets that are not group names are addresses. Duplicates are removed
+    while keeping the order of the targets.
+    """
+    addresses: dict[str, None] = {}
+
+    def _resolve(target: str, parents: tuple[str, ...]) -> None:
+        if target not in groups:
+            addresses[target.upper()] = None
+            return
+        if target in parents:
+            raise InvalidGroupsError(f"Group `{target}` contains itself")
+        for member in groups[target]:
+            _resolve(member, (*parents, target))
+
+    for target in targets:
+        _resolve(target, ())
+    return list(addresses)
@@ -0,0 +1,275 @@
+"""Profile where the time of an operation goes.
+
+The library marks its phases (scanning, connecting, resolving services,
+waiting for the device, writing) with `phase`, which does nothing unless a
+`Profiler` is active in the current context. A profiler records:
+
+- the duration of each phase, per device;
+- optionally, samples of the stack of the event loop thread;
+- when used as an async context manager, the event loop stalls longer than
+  `block_threshold` seconds with the stack that blocked it.
+
+The report is written in the Chrome trace event format, which can be opened
+with chrome://tracing or https://ui.perfetto.dev.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
+from typing import Any, Iterator
+
+# event loop stalls longer than this are reported, in seconds
+BLOCK_THRESHOLD = 0.05
+# stack frames kept per sample, innermost first
+MAX_STACK_DEPTH = 64
+
+_active_profiler: ContextVar[Profiler | None] = ContextVar(
+    "chihiros_active_profiler", default=None
+)
+_NOOP: AbstractContextManager[None] = nullcontext()
+
+
+def phase(name: str, device: str | None = None) -> AbstractContextManager[None]:
+    """Time a block as a phase of the current profile, if any."""
+    if (profiler := _active_profiler.get()) is None:
+        return _NOOP
+    return profiler.phase(name, device)
+
+
+@dataclass
+class PhaseStats:
+    """Durations of a phase, in seconds.
+
+    Phases of concurrent operations overlap, their total can exceed the
+    elapsed time.
+    """
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+
+def _stack(frame: FrameType | None) -> tuple[str, ...]:
+    """Return the frames of a stack, outermost first."""
+    frames: list[str] = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+        )
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+class Profiler:
+    """Profile the operations run while it is active.
+
+    Use it as a context manager around synchronous code, or as an async
+    context manager inside the event loop to also report its stalls.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        sample_interval: float | None = None,
+        block_threshold: float = BLOCK_THRESHOLD,
+    ) -> None:
+        """Create a profiler writing its report to `path` when done.
+
+        The stack is sampled every `sample_interval` seconds when set.
+        """
+        self.path = Path(path)
+        self.sample_interval = sample_interval
+        self.block_threshold = block_threshold
+        self.phases: dict[str, PhaseStats] = {}
+        self.stalls = 0
+        self._events: list[dict[str, Any]] = []
+        self._tids: dict[str, int] = {}
+        self._start = 0.0
+        self._thread_id = 0
+        self._token: Token[Profiler | None] | None = None
+        self._stopped = threading.Event()
+        self._monitor: threading.Thread | None = None
+        self._heartbeat: float | None = None
+        self._heartbeat_task: asyncio.Task[None] | None = None
+        self._stack_frames: dict[tuple[str, ...], int] = {}
+        self._samples: list[dict[str, Any]] = []
+
+    def _ts(self, when: float) -> float:
+        """Return the timestamp of the report of a time, in microseconds."""
+        return (when - self._start) * 1e6
+
+    def _tid(self, device: str | None) -> int:
+        """Return the track of a device in the report."""
+        key = device or "main"
+        if (tid := self._tids.get(key)) is None:
+            tid = self._tids[key] = len(self._tids)
+        return tid
+
+    @contextmanager
+    def phase(self, name: str, device: str | None = None) -> Iterator[None]:
+        """Time a block as a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            duration = end - start
+            stats = self.phases.setdefault(name, PhaseStats())
+            stats.count += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            self._events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": self._ts(start),
+                    "dur": duration * 1e6,
+                    "pid": 0,
+                    "tid": self._tid(device),
+                }
+            )
+
+    def _stack_frame_id(self, stack: tuple[str, ...]) -> int | None:
+        """Return the id of the innermost frame of a stack in the report."""
+        parent: int | None = None
+        for depth in range(1, len(stack) + 1):
+            prefix = stack[:depth]
+            if (frame_id := self._stack_frames.get(prefix)) is None:
+                frame_id = self._stack_frames[prefix] = len(self._stack_frames)
+            parent = frame_id
+        return parent
+
+    def _monitor_loop(self) -> None:
+        """Sample the stack and watch the event loop from a thread."""
+        tick = min(
+            self.sample_interval or self.block_threshold / 4, self.block_threshold / 4
+        )
+        next_sample = time.perf_counter()
+        stalled_since: float | None = None
+        while not self._stopped.wait(tick):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self._thread_id)
+            if self.sample_interval is not None and now >= next_sample:
+                next_sample = now + self.sample_interval
+                self._samples.append(
+                    {
+                        "ts": self._ts(now),
+                        "tid": self._tid(None),
+                        "pid": 0,
+                        "name": "cpu",
+                        "sf": self._stack_frame_id(_stack(frame)),
+                        "weight": 1,
+                    }
+                )
+            heartbeat = self._heartbeat
+            if heartbeat is None or now - heartbeat < self.block_threshold:
+                stalled_since = None
+            elif stalled_since != heartbeat:
+                # report each stall once, with the stack blocking the loop
+                stalled_since = heartbeat
+                self.stalls += 1
+                self._events.append(
+                    {
+                        "name": "event loop blocked",
+                        "ph": "i",
+                        "s": "g",
+                        "ts": self._ts(now),
+                        "pid": 0,
+                        "tid": self._tid(None),
+                        "args": {"stack": list(_stack(frame))},
+                    }
+                )
+
+    async def _beat(self) -> None:
+        """Show the monitor that the event loop runs."""
+        interval = self.block_threshold / 4
+        while True:
+            self._heartbeat = time.perf_counter()
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        """Start profiling the current context and thread."""
+        self._start = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        self._tid(None)
+        self._token = _active_profiler.set(self)
+        self._monitor = threading.Thread(
+            target=self._monitor_loop, name="chihiros-profiler", daemon=True
+        )
+        self._monitor.start()
+
+    def stop(self) -> None:
+        """Stop profiling and write the report."""
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        if self._token is not None:
+            _active_profiler.reset(self._token)
+            self._token = None
+        self.write()
+
+    def write(self) -> None:
+        """Write the report in the Chrome trace event format."""
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 0,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for name, tid in self._tids.items()
+        ]
+        stack_frames: dict[str, dict[str, Any]] = {}
+        for stack, frame_id in self._stack_frames.items():
+            frame: dict[str, Any] = {"name": stack[-1]}
+            if len(stack) > 1:
+                frame["parent"] = str(self._stack_frames[stack[:-1]])
+            stack_frames[str(frame_id)] = frame
+        samples = [
+            {**sample, "sf": str(sample["sf"])}
+            for sample in self._samples
+            if sample["sf"] is not None
+        ]
+        report = {
+            "traceEvents": metadata + self._events,
+            "stackFrames": stack_frames,
+            "samples": samples,
+            "displayTimeUnit": "ms",
+        }
+        self.path.write_text(json.dumps(report))
+
+    def __enter__(self) -> Profiler:
+        """Start profiling."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Stop profiling and write the report."""
+        self.stop()
+
+    async def __aenter__(self) -> Profiler:
+        """Start profiling, watching the running event loop."""
+        self.start()
+        self._heartbeat_task = asyncio.create_task(self._beat())
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Stop profiling and write the report."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        self._heartbeat = None
+        self.stop()
@@ -0,0 +1,186 @@
+"""Predict the output of lights in auto mode from their settings.
+
+A light in auto mode can not be queried, its levels are computed from the auto
+settings written to it. The settings of a whole fleet are compiled into flat
+tables, evaluated for all the lights at once with numpy when it is installed.
+"""
+
+from __future__ import annotations
+
+import datetime
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable, Mapping
+
+from .weekday_encoding import WeekdaySelect, encode_selected_weekdays, weekday_bit
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+    from .batch import Operation
+
+MINUTES_PER_DAY = 1440
+CHANNELS = 3
+# brightness values above this mark a channel unused by a setting
+MAX_LEVEL = 100
+
+
+def _minutes(value: datetime.time) -> int:
+    return value.hour * 60 + value.minute
+
+
+@dataclass(frozen=True)
+class AutoSetting:
+    """Auto setting of a light, as written by `add_setting`.
+
+    The light ramps up for `ramp_up_minutes` from sunrise to the brightness of
+    its channels, and down for as long before sunset. Settings passing midnight
+    belong to the weekday of their sunrise.
+    """
+
+    sunrise: datetime.time
+    sunset: datetime.time
+    brightness: tuple[int, int, int]
+    ramp_up_minutes: int = 0
+    weekdays: int = 127
+
+    def same_slot(self, other: AutoSetting) -> bool:
+        """Return whether both settings are deleted by the same command."""
+        return (
+            self.sunrise == other.sunrise
+            and self.sunset == other.sunset
+            and self.ramp_up_minutes == other.ramp_up_minutes
+            and self.weekdays == other.weekdays
+        )
+
+
+def apply_setting_operation(
+    settings: list[AutoSetting], command: str, kwargs: Mapping[str, Any]
+) -> None:
+    """Update the settings of a light with a command sent to it."""
+    if command == "reset_settings":
+        settings.clear()
+        return
+    if command not in ("add_setting", "add_rgb_setting", "remove_setting"):
+        return
+    brightness = kwargs.get("max_brightness", 100)
+    if isinstance(brightness, int):
+        brightness = (brightness, 255, 255)
+    setting = AutoSetting(
+        kwargs["sunrise"].time(),
+        kwargs["sunset"].time(),
+        tuple(brightness),
+        kwargs.get("ramp_up_in_minutes", 0),
+        encode_selected_weekdays(kwargs.get("weekdays", [WeekdaySelect.everyday])),
+    )
+    settings[:] = [other for other in settings if not other.same_slot(setting)]
+    if command != "remove_setting":
+        settings.append(setting)
+
+
+class ScheduleEvaluator:
+    """Evaluate the expected channel levels of many lights at once."""
+
+    def __init__(self, schedules: Mapping[str, Iterable[AutoSetting]]) -> None:
+        """Compile the settings of each light, keyed by address."""
+        self.addresses: list[str] = list(schedules)
+        owners: list[int] = []
+        starts: list[int] = []
+        durations: list[int] = []
+        ramps: list[int] = []
+        masks: list[int] = []
+        levels: list[tuple[int, ...]] = []
+        for index, settings in enumerate(schedules.values()):
+            for setting in settings:
+                owners.append(index)
+                starts.append(_minutes(setting.sunrise))
+                durations.append(
+                    (_minutes(setting.sunset) - _minutes(setting.sunrise))
+                    % MINUTES_PER_DAY
+                )
+                ramps.append(setting.ramp_up_minutes)
+                masks.append(setting.weekdays)
+                levels.append(
+                    tuple(
+                        level if level <= MAX_LEVEL else 0
+                        for level in setting.brightness
+                    )
+                )
+        self._tables: tuple[Any, ...] = (
+            owners,
+            starts,
+            durations,
+            ramps,
+            masks,
+            levels,
+        )
+        if np is not None:
+            self._tables = (
+                np.array(owners, dtype=np.intp),
+                np.array(starts, dtype=np.float64),
+                np.array(durations, dtype=np.float64),
+                np.array(ramps, dtype=np.float64),
+                np.array(masks, dtype=np.int64),
+                np.array(levels, dtype=np.float64).reshape(-1, CHANNELS),
+            )
+
+    @classmethod
+    def from_operations(cls, operations: Iterable[Operation]) -> ScheduleEvaluator:
+        """Compile the settings written by batch operations."""
+        schedules: dict[str, list[AutoSetting]] = {}
+        for operation in operations:
+            settings = schedules.setdefault(operation.address.upper(), [])
+            apply_setting_operation(settings, operation.command, operation.kwargs)
+        return cls(schedules)
+
+    def evaluate(self, when: datetime.datetime) -> dict[str, tuple[int, ...]]:
+        """Return the expected levels (0-100) of the channels of each light."""
+        minute = when.hour * 60 + when.minute + when.second / 60
+        if np is not None:
+            rows = self._evaluate_numpy(when.weekday(), minute).round().astype(int)
+            return {
+                address: tuple(row.tolist())
+                for address, row in zip(self.addresses, rows)
+            }
+        return dict(zip(self.addresses, self._evaluate_python(when.weekday(), minute)))
+
+    def _evaluate_numpy(self, weekday: int, minute: float) -> Any:
+        """Evaluate all the settings in one vectorized pass."""
+        owners, starts, durations, ramps, masks, levels = self._tables
+        fraction = np.zeros(len(starts))
+        # occurrences started today and yesterday, for settings passing midnight
+        for days_ago in (0, 1):
+            bit = weekday_bit((weekday - days_ago) % 7)
+            elapsed = minute + days_ago * MINUTES_PER_DAY - starts
+            active = ((masks & bit) != 0) & (elapsed >= 0) & (elapsed < durations)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ramp = np.minimum(elapsed, durations - elapsed) / ramps
+            ramp = np.where(ramps > 0, np.clip(ramp, 0.0, 1.0), 1.0)
+            fraction = np.maximum(fraction, np.where(active, ramp, 0.0))
+        fleet = np.zeros((len(self.addresses), CHANNELS))
+        np.maximum.at(fleet, owners, fraction[:, None] * levels)
+        return fleet
+
+    def _evaluate_python(self, weekday: int, minute: float) -> list[tuple[int, ...]]:
+        """Evaluate the settings one by one."""
+        fleet = [[0.0] * CHANNELS for _ in self.addresses]
+        for owner, start, duration, ramp, mask, levels in zip(*self._tables):
+            fraction = 0.0
+            for days_ago in (0, 1):
+                elapsed = minute + days_ago * MINUTES_PER_DAY - start
+                if not mask & weekday_bit((weekday - days_ago) % 7):
+                    continue
+                if not 0 <= elapsed < duration:
+                    continue
+                if ramp > 0:
+                    fraction = max(
+                        fraction, min(1.0, elapsed / ramp, (duration - elapsed) / ramp)
+                    )
+                else:
+                    fraction = 1.0
+            row = fleet[owner]
+            for channel, level in enumerate(levels):
+                row[channel] = max(row[channel], fraction * level)
+        return [tuple(round(level) for level in row) for row in fleet]
@@ -0,0 +1,505 @@
+"""Drive the levels of a fleet of lights from the host.
+
+The auto mode of the lights only knows sunrise and sunset windows with short
+ramps. Richer programs, e.g. clouds, a siesta or the phases of the moon, are
+sequences of timed levels sent by the host. A `FleetScheduler` holds the
+timed actions of many lights in a hierarchical timer wheel, fires the actions
+due at each tick in one batch and sends the levels of each light once per
+batch, the latest action winning.
+
+Actions are due at wall clock times, daily at a local time or once at a given
+datetime, or after a delay. The wheel itself runs on the monotonic clock of
+the event loop: wall clock jumps, e.g. by NTP or after a suspend, are detected
+and the wall clock actions placed again, and daily actions follow daylight
+saving time changes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Generic, Mapping, Sequence, TypeVar
+
+from .const import DEFAULT_MAX_CONCURRENCY
+from .device.base_device import BLEAK_EXCEPTIONS, BaseDevice, deadline_from_timeout
+from .device.priority import Priority, command_priority
+from .exception import CharacteristicMissingError, DeadlineExceeded, DeviceUnavailable
+from .spans import span
+from .weekday_encoding import WeekdaySelect, encode_selected_weekdays, weekday_bit
+
+_LOGGER = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+# bits of the slot index of each level of the wheel, the first level holds
+# the next 256 ticks and the whole wheel 2 ** 26 ticks, later ones overflow
+WHEEL_BITS = (8, 6, 6, 6)
+# duration of a tick, in seconds
+DEFAULT_RESOLUTION = 0.05
+# the scheduler wakes up at least this often to notice wall clock jumps
+MAX_SLEEP = 1.0
+# a change of the offset between the wall and the monotonic clocks above this
+# is a clock jump, in seconds
+CLOCK_JUMP_THRESHOLD = 1.0
+# wall clock actions found late by more than this after a clock jump are
+# skipped, in seconds
+DEFAULT_MISFIRE_GRACE = 60.0
+# number of recent tick lags kept for the percentiles
+LAG_HISTORY = 1024
+
+
+class TimerWheel(Generic[_T]):
+    """Hierarchical timer wheel of items due at integer ticks.
+
+    Each level has a slot per tick of the level below it turning once. Items
+    are placed in the lowest level that reaches their tick and cascade down
+    a level each time the level below it starts a new turn. Adding an item
+    is O(1), and advancing skips the turns of the empty levels.
+    """
+
+    def __init__(self, bits: tuple[int, ...] = WHEEL_BITS) -> None:
+        """Create an empty wheel at tick 0."""
+        self.now = 0
+        self._bits = bits
+        self._shifts = [sum(bits[:level]) for level in range(len(bits))]
+        self._span = 1 << sum(bits)
+        self._slots: list[list[list[tuple[int, _T]]]] = [
+            [[] for _ in range(1 << level_bits)] for level_bits in bits
+        ]
+        self._counts = [0] * len(bits)
+        # items beyond the span of the wheel
+        self._overflow: list[tuple[int, _T]] = []
+
+    def __len__(self) -> int:
+        """Return the number of items in the wheel."""
+        return sum(self._counts) + len(self._overflow)
+
+    def add(self, tick: int, item: _T) -> None:
+        """Add an item, due at the next tick if `tick` has passed."""
+        self._place(max(tick, self.now + 1), item)
+
+    def _place(self, tick: int, item: _T) -> None:
+        """Put an item in the lowest level reaching its tick."""
+        delta = tick - self.now
+        for level, (shift, level_bits) in enumerate(zip(self._shifts, self._bits)):
+            if delta < 1 << (shift + level_bits):
+                slot = (tick >> shift) & ((1 << level_bits) - 1)
+                self._slots[level][slot].append((tick, item))
+                self._counts[level] += 1
+                return
+        self._overflow.append((tick, item))
+
+    def _cascade(self) -> None:
+        """Move down the items of the slots starting a turn at the current tick."""
+        if not self.now % self._span and self._overflow:
+            overflow, self._overflow = self._overflow, []
+            for tick, item in overflow:
+                self._place(tick, item)
+        for level in range(len(self._bits) - 1, 0, -1):
+            shift = self._shifts[level]
+            if self.now & ((1 << shift) - 1):
+                continue
+            slot = self._slots[level][
+                (self.now >> shift) & ((1 << self._bits[level]) - 1)
+            ]
+            if not slot:
+                continue
+            items = slot[:]
+            slot.clear()
+            self._counts[level] -= len(items)
+            for tick, item in items:
+                self._place(tick, item)
+
+    def _next_turn(self) -> int | None:
+        """Return the next tick an item can cascade to the first level at."""
+        for level in range(1, len(self._bits)):
+            if self._counts[level]:
+                shift = self._shifts[level]
+                return ((self.now >> shift) + 1) << shift
+        if self._overflow:
+            return (self.now // self._span + 1) * self._span
+        return None
+
+    def advance(self, target: int) -> list[tuple[int, _T]]:
+        """Advance to the `target` tick and return the items due until then."""
+        due: list[tuple[int, _T]] = []
+        first_bits = self._bits[0]
+        while self.now < target:
+            if not self._counts[0]:
+                # nothing can expire before the next turn of a higher level
+                turn = self._next_turn()
+                if turn is None or turn > target:
+                    self.now = target
+                    break
+                self.now = turn - 1
+            self.now += 1
+            self._cascade()
+            slot = self._slots[0][self.now & ((1 << first_bits) - 1)]
+            if not slot:
+                continue
+            items = slot[:]
+            slot.clear()
+            self._counts[0] -= len(items)
+            due.extend(items)
+        return due
+
+    def next_expiry(self) -> int | None:
+        """Return the next tick something may expire at, or None when empty."""
+        turn = self._next_turn()
+        if self._counts[0]:
+            # items of higher levels may be due before the ones of the first one
+            size = 1 << self._bits[0]
+            end = self.now + size if turn is None else min(turn, self.now + size)
+            for tick in range(self.now + 1, end + 1):
+                if self._slots[0][tick & (size - 1)]:
+                    return tick
+        return turn
+
+    def drain(self) -> list[tuple[int, _T]]:
+        """Remove and return all the items."""
+        items = list(self._overflow)
+        self._overflow.clear()
+        for level in self._slots:
+            for slot in level:
+                items.extend(slot)
+                slot.clear()
+        self._counts = [0] * len(self._bits)
+        return items
+
+
+@dataclass
+class SchedulerStats:
+    """Counters of a scheduler, lags are in seconds."""
+
+    ticks: int = 0
+    fired: int = 0
+    sends: int = 0
+    # actions merged into the levels of a send not started yet
+    coalesced: int = 0
+    failed: int = 0
+    # wall clock actions skipped because a clock jump made them too late
+    missed: int = 0
+    clock_jumps: int = 0
+    max_lag: float = 0.0
+    total_lag: float = 0.0
+    recent_lags: deque[float] = field(default_factory=lambda: deque(maxlen=LAG_HISTORY))
+
+    @property
+    def mean_lag(self) -> float | None:
+        """Return the mean delay between the due time of a tick and its firing."""
+        if not self.ticks:
+            return None
+        return self.total_lag / self.ticks
+
+    def lag_percentile(self, percentile: float) -> float | None:
+        """Return a percentile (0-100) of the recent tick lags."""
+        if not self.recent_lags:
+            return None
+        lags = sorted(self.recent_lags)
+        return lags[min(len(lags) - 1, int(len(lags) * percentile / 100))]
+
+    def record_lag(self, lag: float) -> None:
+        """Record the lag of a fired tick."""
+        self.ticks += 1
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+        self.recent_lags.append(lag)
+
+
+class ScheduledAction:
+    """Levels to set on a light at a time, returned to cancel them."""
+
+    def __init__(
+        self,
+        address: str,
+        levels: Mapping[str | int, int],
+        wall_time: float | None = None,
+        deadline: float | None = None,
+        daily: datetime.time | None = None,
+        weekdays: int = 127,
+        tz: datetime.tzinfo | None = None,
+    ) -> None:
+        """Create an action, see the `schedule_` methods of `FleetScheduler`."""
+        self.address = address.upper()
+        self.levels = dict(levels)
+        # due time on the wall clock, as a timestamp, None after a delay or once
+        # a single action fired
+        self.wall_time = wall_time
+        # due time on the clock of the event loop
+        self.deadline = deadline
+        self.daily = daily
+        self.weekdays = weekdays
+        self.tz = tz
+        self.cancelled = False
+
+    @property
+    def next_run(self) -> datetime.datetime | None:
+        """Return when the action is due next on the wall clock."""
+        if self.cancelled or self.wall_time is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.wall_time, self.tz)
+
+    def cancel(self) -> None:
+        """Do not fire the action anymore."""
+        self.cancelled = True
+
+    def next_occurrence(self, after: float) -> float | None:
+        """Return the timestamp of the next daily run after a timestamp."""
+        if self.daily is None:
+            return None
+        day = datetime.datetime.fromtimestamp(after, self.tz).date()
+        for _ in range(8):
+            if self.weekdays & weekday_bit(day.weekday()):
+                # naive local times follow the daylight saving time of the host,
+                # nonexistent ones are shifted by the gap and ambiguous ones
+                # are the first of both
+                when = datetime.datetime.combine(day, self.daily, self.tz).timestamp()
+                if when > after:
+                    return when
+            day += datetime.timedelta(days=1)
+        return None
+
+
+class FleetScheduler:
+    """Send timed levels to the lights of a fleet.
+
+    Actions are held in a timer wheel ticking every `resolution` seconds.
+    The actions due at a tick are fired together: the levels of each light
+    are merged, and sent in the automation priority class to at most
+    `max_concurrency` lights at once. Levels fired while the previous ones
+    of a light still wait for their turn are merged into them.
+    """
+
+    def __init__(
+        self,
+        devices: Mapping[str, BaseDevice],
+        resolution: float = DEFAULT_RESOLUTION,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        misfire_grace: float = DEFAULT_MISFIRE_GRACE,
+        send_timeout: float | None = None,
+    ) -> None:
+        """Create a scheduler of the lights of `devices`, keyed by address."""
+        self.devices = devices
+        self.resolution = resolution
+        self.max_concurrency = max(1, max_concurrency)
+        self.misfire_grace = misfire_grace
+        self.send_timeout = send_timeout
+        self.stats = SchedulerStats()
+        self._wheel: TimerWheel[ScheduledAction] = TimerWheel()
+        self._origin = asyncio.get_running_loop().time()
+        self._wall_offset = self._current_wall_offset()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._workers: list[asyncio.Task[None]] = []
+        # levels fired and not sent yet, keyed by address
+        self._pending: dict[str, dict[str | int, int]] = {}
+        # addresses waiting for a worker, and the ones being sent to
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._sending: set[str] = set()
+
+    def __len__(self) -> int:
+        """Return the number of scheduled actions, cancelled ones included."""
+        return len(self._wheel)
+
+    @staticmethod
+    def _current_wall_offset() -> float:
+        """Return the wall clock time at the time 0 of the event loop clock."""
+        return time.time() - asyncio.get_running_loop().time()
+
+    def _tick(self, deadline: float) -> int:
+        """Return the first tick at or after an event loop time."""
+        return math.ceil((deadline - self._origin) / self.resolution)
+
+    def _tick_time(self, tick: int) -> float:
+        """Return the event loop time of a tick."""
+        return self._origin + tick * self.resolution
+
+    def _add(self, action: ScheduledAction) -> ScheduledAction:
+        """Put an action in the wheel and wake the scheduler up."""
+        if action.wall_time is not None:
+            action.deadline = action.wall_time - self._wall_offset
+        assert action.deadline is not None  # nosec
+        self._wheel.add(self._tick(action.deadline), action)
+        self._wakeup.set()
+        return action
+
+    def schedule_in(
+        self, address: str, delay: float, levels: Mapping[str | int, int]
+    ) -> ScheduledAction:
+        """Set levels of a light after a delay in seconds, clock jumps aside."""
+        loop_time = asyncio.get_running_loop().time()
+        return self._add(ScheduledAction(address, levels, deadline=loop_time + delay))
+
+    def schedule_at(
+        self,
+        address: str,
+        when: datetime.datetime,
+        levels: Mapping[str | int, int],
+    ) -> ScheduledAction:
+        """Set levels of a light at a datetime, naive ones are local times."""
+        return self._add(ScheduledAction(address, levels, wall_time=when.timestamp()))
+
+    def schedule_daily(
+        self,
+        address: str,
+        at: datetime.time,
+        levels: Mapping[str | int, int],
+        weekdays: Sequence[WeekdaySelect] = (WeekdaySelect.everyday,),
+        tz: datetime.tzinfo | None = None,
+    ) -> ScheduledAction:
+        """Set levels of a light every selected weekday at a time.
+
+        The time is in the time zone `tz`, or the local time of the host.
+        """
+        action = ScheduledAction(
+            address,
+            levels,
+            daily=at,
+            weekdays=encode_selected_weekdays(list(weekdays)),
+            tz=tz,
+        )
+        action.wall_time = action.next_occurrence(time.time())
+        if action.wall_time is None:
+            raise ValueError("No weekday selected")
+        return self._add(action)
+
+    def start(self) -> None:
+        """Start firing the actions."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.max_concurrency)
+            ]
+
+    async def stop(self) -> None:
+        """Stop firing the actions once the fired ones are sent."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await self._ready.join()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(self._task, *self._workers, return_exceptions=True)
+        self._task = None
+        self._workers = []
+
+    async def __aenter__(self) -> FleetScheduler:
+        """Start the scheduler."""
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Stop the scheduler."""
+        await self.stop()
+
+    def _check_clock(self) -> None:
+        """Place the wall clock actions again after a clock jump."""
+        offset = self._current_wall_offset()
+        if abs(offset - self._wall_offset) <= CLOCK_JUMP_THRESHOLD:
+            return
+        _LOGGER.debug("Wall clock jumped by %.1f s", offset - self._wall_offset)
+        self.stats.clock_jumps += 1
+        self._wall_offset = offset
+        now = time.time()
+        for _, action in self._wheel.drain():
+            if action.cancelled:
+                continue
+            if action.wall_time is not None and action.wall_time < now - (
+                self.misfire_grace
+            ):
+                self.stats.missed += 1
+                action.wall_time = action.next_occurrence(now)
+                if action.wall_time is None:
+                    continue
+            self._add(action)
+
+    def _fire(self, due: list[tuple[int, ScheduledAction]]) -> None:
+        """Fire the actions due at the same time in one batch."""
+        loop_time = asyncio.get_running_loop().time()
+        batch: dict[str, dict[str | int, int]] = {}
+        for tick in sorted({tick for tick, _ in due}):
+            self.stats.record_lag(loop_time - self._tick_time(tick))
+        for _, action in sorted(due, key=lambda item: item[0]):
+            if action.cancelled:
+                continue
+            self.stats.fired += 1
+            batch.setdefault(action.address, {}).update(action.levels)
+            if action.wall_time is not None and action.daily is not None:
+                action.wall_time = action.next_occurrence(action.wall_time)
+                if action.wall_time is not None:
+                    self._add(action)
+            else:
+                action.wall_time = None
+        for address, levels in batch.items():
+            if (pending := self._pending.get(address)) is not None:
+                self.stats.coalesced += 1
+                pending.update(levels)
+                continue
+            self._pending[address] = levels
+            if address not in self._sending:
+                self._ready.put_nowait(address)
+
+    async def _work(self) -> None:
+        """Send the pending levels of the lights, one light at a time."""
+        while True:
+            address = await self._ready.get()
+            self._sending.add(address)
+            try:
+                await self._send_levels(address, self._pending.pop(address))
+            except Exception:  # pylint: disable=broad-except
+                # the worker keeps serving the later levels of all the lights
+                _LOGGER.exception("%s: scheduled levels failed", address)
+                self.stats.failed += 1
+            finally:
+                self._sending.discard(address)
+                # levels fired meanwhile wait for their turn again
+                if address in self._pending:
+                    self._ready.put_nowait(address)
+                self._ready.task_done()
+
+    async def _send_levels(self, address: str, levels: dict[str | int, int]) -> None:
+        """Send levels to a light, in the automation priority class."""
+        if (device := self.devices.get(address)) is None:
+            _LOGGER.debug("%s: not scheduled, unknown light", address)
+            self.stats.failed += 1
+            return
+        try:
+            with (
+                command_priority(Priority.AUTOMATION),
+                span("scheduled_levels", device=address),
+            ):
+                await device.set_colors_brightness(
+                    levels, deadline_from_timeout(self.send_timeout)
+                )
+        except (
+            DeviceUnavailable,
+            DeadlineExceeded,
+            CharacteristicMissingError,
+            *BLEAK_EXCEPTIONS,
+        ) as ex:
+            _LOGGER.debug("%s: scheduled levels failed: %s", address, ex)
+            self.stats.failed += 1
+            return
+        self.stats.sends += 1
+
+    async def _run(self) -> None:
+        """Fire the due actions tick after tick."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._check_clock()
+            now_tick = math.floor((loop.time() - self._origin) / self.resolution)
+            if due := self._wheel.advance(now_tick):
+                self._fire(due)
+            delay = MAX_SLEEP
+            if (next_tick := self._wheel.next_expiry()) is not None:
+                delay = min(delay, self._tick_time(next_tick) - loop.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(delay, 0.0))
+            except asyncio.TimeoutError:
+                pass
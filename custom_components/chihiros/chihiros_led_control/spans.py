@@ -0,0 +1,148 @@
+"""Span tracing of the steps of the commands.
+
+A span times a step of a command. Spans opened while another one is active
+in the same context, including the tasks it starts, are its children and
+share its correlation id, so the steps of concurrent commands on the same
+event loop can be told apart. Finished spans go to the exporter set with
+`set_span_exporter`, spans cost a context variable lookup while none is set.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Protocol, TextIO
+
+_LOGGER = logging.getLogger(__name__)
+
+_current_span: ContextVar[Span | None] = ContextVar(
+    "chihiros_current_span", default=None
+)
+_NOOP: AbstractContextManager[None] = nullcontext()
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+@dataclass
+class Span:
+    """Step of a command."""
+
+    name: str
+    # shared by all the spans of a command
+    correlation_id: str
+    span_id: str
+    parent_id: str | None
+    # wall clock time of the start, in seconds since the epoch
+    start: float
+    duration: float | None = None
+    error: str | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+
+class SpanExporter(Protocol):
+    """Receiver of the finished spans."""
+
+    def export(self, span: Span) -> None:
+        """Handle a finished span."""
+
+
+class InMemorySpanExporter:
+    """Keep the finished spans in a list."""
+
+    def __init__(self) -> None:
+        """Create an empty exporter."""
+        self.spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        """Keep a finished span."""
+        self.spans.append(span)
+
+    def clear(self) -> None:
+        """Forget the spans kept so far."""
+        self.spans.clear()
+
+
+class JsonLinesSpanExporter:
+    """Append the finished spans to a file, one json object per line."""
+
+    def __init__(self, path: Path | str) -> None:
+        """Open the file."""
+        self._file: TextIO = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        """Write a finished span."""
+        self._file.write(json.dumps(asdict(span), default=str) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+    def __enter__(self) -> JsonLinesSpanExporter:
+        """Return the exporter."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the file."""
+        self.close()
+
+
+_exporter: SpanExporter | None = None
+
+
+def set_span_exporter(exporter: SpanExporter | None) -> SpanExporter | None:
+    """Send the finished spans to an exporter, or disable tracing.
+
+    Return the previous exporter.
+    """
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def current_span() -> Span | None:
+    """Return the span active in the current context."""
+    return _current_span.get()
+
+
+def span(name: str, **attributes: Any) -> AbstractContextManager[Span | None]:
+    """Trace a block as a span, a child of the current one."""
+    if _exporter is None:
+        return _NOOP
+    return _span(name, attributes)
+
+
+@contextmanager
+def _span(name: str, attributes: dict[str, Any]) -> Iterator[Span]:
+    parent = _current_span.get()
+    current = Span(
+        name,
+        _new_id() if parent is None else parent.correlation_id,
+        _new_id(),
+        None if parent is None else parent.span_id,
+        time.time(),
+        attributes=attributes,
+    )
+    start = time.perf_counter()
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as ex:
+        current.error = f"{ex.__class__.__name__}: {ex}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        if (exporter := _exporter) is not None:
+            try:
+                exporter.export(current)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to export span %s", name)
@@ -0,0 +1,424 @@
+"""Record and replay the bluetooth sessions of devices.
+
+A trace is a binary file of records crossing the bluetooth boundary of the
+devices: commands, connection attempts, resolved services, writes,
+notifications, disconnections and errors, each with a monotonic timestamp.
+
+Replaying a trace sends the recorded commands at their recorded times while
+a fake transport answers like the devices did, so that the library can be
+benchmarked against real world sessions.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Iterator
+
+from bleak import exc as bleak_exc
+from bleak.backends.device import BLEDevice
+from bleak_retry_connector import BleakNotFoundError
+
+if TYPE_CHECKING:
+    from .device.base_device import BaseDevice
+
+TRACE_MAGIC = b"CHTRACE1"
+# time since the start of the trace, event, device id and payload length
+_RECORD_HEADER = struct.Struct("<dBBH")
+
+
+class InvalidTraceError(Exception):
+    """Raised when a trace file can't be read."""
+
+
+class TraceEvent(IntEnum):
+    """Event of a trace record."""
+
+    DEVICE = 0  # address and name of the device using the id, NUL separated
+    COMMAND = 1  # sequence number, priority then frames prefixed by their length
+    COMMAND_DONE = 2  # sequence number
+    CONNECT = 3
+    CONNECTED = 4
+    SERVICES = 5  # resolved characteristic uuids, comma separated
+    WRITE = 6  # frame
+    WRITTEN = 7
+    NOTIFICATION = 8  # data
+    DISCONNECT = 9  # disconnection requested by the library
+    DISCONNECTED = 10  # unexpected disconnection
+    ERROR = 11  # exception class and message, NUL separated
+    COMMAND_FAILED = 12  # sequence number then like an error
+
+
+@dataclass
+class TraceRecord:
+    """Record of a trace."""
+
+    time: float
+    event: TraceEvent
+    device: int
+    payload: bytes = b""
+
+
+_COMMAND_HEADER = struct.Struct("<HB")
+_SEQUENCE = struct.Struct("<H")
+
+
+def encode_command(sequence: int, priority: int, frames: list[bytes]) -> bytes:
+    """Encode the payload of a command record."""
+    return _COMMAND_HEADER.pack(sequence & 0xFFFF, priority) + b"".join(
+        bytes([len(frame)]) + frame for frame in frames
+    )
+
+
+def decode_command(payload: bytes) -> tuple[int, int, list[bytes]]:
+    """Decode the sequence number, priority and frames of a command record."""
+    sequence, priority = _COMMAND_HEADER.unpack_from(payload)
+    frames: list[bytes] = []
+    index = _COMMAND_HEADER.size
+    while index < len(payload):
+        start = index + 1
+        index = start + payload[index]
+        frames.append(payload[start:index])
+    return sequence, priority, frames
+
+
+def _encode_error(ex: BaseException) -> bytes:
+    name = ex.__class__.__name__
+    message = getattr(ex, "dbus_error", None) or str(ex)
+    return f"{name}\0{message}".encode()
+
+
+class TraceRecorder:
+    """Write the records of the devices using it to a trace file."""
+
+    def __init__(self, path: Path | str) -> None:
+        """Create the trace file."""
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(TRACE_MAGIC)
+        self._start = time.monotonic()
+        self._devices: dict[str, int] = {}
+
+    def register(self, address: str, name: str | None) -> int:
+        """Return the id of a device in the trace."""
+        if (device := self._devices.get(address)) is None:
+            if len(self._devices) > 255:
+                raise ValueError("A trace can't record more than 256 devices")
+            device = self._devices[address] = len(self._devices)
+            self.record(device, TraceEvent.DEVICE, f"{address}\0{name or ''}".encode())
+        return device
+
+    def record(self, device: int, event: TraceEvent, payload: bytes = b"") -> None:
+        """Write a record."""
+        self._file.write(
+            _RECORD_HEADER.pack(
+                time.monotonic() - self._start, event, device, len(payload)
+            )
+        )
+        self._file.write(payload)
+
+    def record_error(self, device: int, ex: BaseException) -> None:
+        """Write the record of an exception of the transport."""
+        self.record(device, TraceEvent.ERROR, _encode_error(ex))
+
+    def record_command(
+        self, device: int, sequence: int, priority: int, frames: list[bytes]
+    ) -> None:
+        """Write the record of a command sent by the library."""
+        self.record(
+            device, TraceEvent.COMMAND, encode_command(sequence, priority, frames)
+        )
+
+    def record_command_end(
+        self, device: int, sequence: int, ex: BaseException | None = None
+    ) -> None:
+        """Write the record of the end of a command."""
+        if ex is None:
+            self.record(device, TraceEvent.COMMAND_DONE, _SEQUENCE.pack(sequence))
+        else:
+            self.record(
+                device,
+                TraceEvent.COMMAND_FAILED,
+                _SEQUENCE.pack(sequence) + _encode_error(ex),
+            )
+
+    def close(self) -> None:
+        """Close the trace file."""
+        self._file.close()
+
+    def __enter__(self) -> TraceRecorder:
+        """Return the recorder."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the trace file."""
+        self.close()
+
+
+def read_trace(path: Path | str) -> Iterator[TraceRecord]:
+    """Read the records of a trace file."""
+    with open(path, "rb") as trace:
+        if trace.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise InvalidTraceError(f"{path} is not a trace file")
+        while header := trace.read(_RECORD_HEADER.size):
+            if len(header) < _RECORD_HEADER.size:
+                raise InvalidTraceError(f"{path} is truncated")
+            timestamp, event, device, length = _RECORD_HEADER.unpack(header)
+            yield TraceRecord(timestamp, TraceEvent(event), device, trace.read(length))
+
+
+def _exception(payload: bytes) -> Exception:
+    """Build the exception of an error record."""
+    name, _, message = payload.decode().partition("\0")
+    if name == BleakNotFoundError.__name__:
+        return BleakNotFoundError(message)
+    if name == bleak_exc.BleakDBusError.__name__:
+        return bleak_exc.BleakDBusError(message, [])
+    if name in ("TimeoutError", "CancelledError"):
+        return asyncio.TimeoutError(message)
+    error_class = getattr(bleak_exc, name, bleak_exc.BleakError)
+    return error_class(message)
+
+
+@dataclass
+class _Outcome:
+    """Recorded outcome of a connection or a write."""
+
+    duration: float
+    error: bytes | None = None
+    # delays of the notifications following a write and their data
+    notifications: list[tuple[float, bytes]] = field(default_factory=list)
+    # delay of an unexpected disconnection following a connection
+    disconnect_after: float | None = None
+
+
+class _ReplayCharacteristic:
+    """Characteristic of a replayed device."""
+
+    def __init__(self, uuid: str) -> None:
+        self.uuid = uuid
+
+
+class _ReplayServices:
+    """Services of a replayed device."""
+
+    def __init__(self, uuids: set[str] | None) -> None:
+        self._uuids = uuids
+
+    def get_characteristic(self, uuid: str) -> _ReplayCharacteristic | None:
+        if self._uuids is not None and uuid not in self._uuids:
+            return None
+        return _ReplayCharacteristic(uuid)
+
+
+class ReplayTransport:
+    """Bluetooth transport answering like a device did in a trace.
+
+    Connections and writes take their recorded durations divided by `speed`
+    and fail like they did; notifications follow the writes with their
+    recorded delays. Attempts beyond the recorded ones take the median time.
+    """
+
+    def __init__(self, records: list[TraceRecord], speed: float = 1.0) -> None:
+        """Build the transport from the records of one device."""
+        self.speed = speed
+        self._connects: deque[_Outcome] = deque()
+        self._writes: deque[_Outcome] = deque()
+        self._services: set[str] | None = None
+        # connection or write in progress and its start
+        pending: TraceRecord | None = None
+        connection: _Outcome | None = None
+        connected_at = 0.0
+        last_write: _Outcome | None = None
+        last_write_end = 0.0
+        for record in records:
+            event = record.event
+            if event in (TraceEvent.CONNECT, TraceEvent.WRITE):
+                pending = record
+            elif event == TraceEvent.CONNECTED and pending is not None:
+                connection = _Outcome(record.time - pending.time)
+                connected_at = record.time
+                self._connects.append(connection)
+                pending = None
+            elif event == TraceEvent.WRITTEN and pending is not None:
+                last_write = _Outcome(record.time - pending.time)
+                last_write_end = record.time
+                self._writes.append(last_write)
+                pending = None
+            elif event == TraceEvent.ERROR and pending is not None:
+                outcome = _Outcome(record.time - pending.time, record.payload)
+                if pending.event == TraceEvent.CONNECT:
+                    self._connects.append(outcome)
+                else:
+                    self._writes.append(outcome)
+                pending = None
+            elif event == TraceEvent.NOTIFICATION and last_write is not None:
+                last_write.notifications.append(
+                    (record.time - last_write_end, record.payload)
+                )
+            elif event == TraceEvent.SERVICES:
+                self._services = set(filter(None, record.payload.decode().split(",")))
+            elif event == TraceEvent.DISCONNECT:
+                connection = None
+            elif event == TraceEvent.DISCONNECTED and connection is not None:
+                connection.disconnect_after = record.time - connected_at
+                connection = None
+        self._connect_time = statistics.median(
+            [outcome.duration for outcome in self._connects] or [0.0]
+        )
+        self._write_time = statistics.median(
+            [outcome.duration for outcome in self._writes] or [0.0]
+        )
+
+    async def connect(
+        self, ble_device: BLEDevice, disconnected_callback: Callable[[Any], None]
+    ) -> ReplayClient:
+        """Connect like the device did."""
+        outcome = (
+            self._connects.popleft() if self._connects else _Outcome(self._connect_time)
+        )
+        await asyncio.sleep(outcome.duration / self.speed)
+        if outcome.error is not None:
+            raise _exception(outcome.error)
+        client = ReplayClient(self, _ReplayServices(self._services))
+        if outcome.disconnect_after is not None:
+            asyncio.get_running_loop().call_later(
+                outcome.disconnect_after / self.speed,
+                client.drop,
+                disconnected_callback,
+            )
+        return client
+
+    def next_write(self) -> _Outcome:
+        """Return the outcome of the next write."""
+        return self._writes.popleft() if self._writes else _Outcome(self._write_time)
+
+
+class ReplayClient:
+    """Client of a replayed device."""
+
+    def __init__(self, transport: ReplayTransport, services: _ReplayServices) -> None:
+        """Create a connected client."""
+        self.is_connected = True
+        self.services = services
+        self._transport = transport
+        self._notify: Callable[[Any, bytearray], None] | None = None
+
+    async def get_services(self) -> _ReplayServices:
+        """Return the services."""
+        return self.services
+
+    async def start_notify(
+        self, char: Any, callback: Callable[[Any, bytearray], None]
+    ) -> None:
+        """Subscribe to the notifications."""
+        self._notify = callback
+
+    async def stop_notify(self, char: Any) -> None:
+        """Unsubscribe from the notifications."""
+        self._notify = None
+
+    async def write_gatt_char(self, char: Any, data: bytes, response: bool) -> None:
+        """Write a frame like the device took it."""
+        outcome = self._transport.next_write()
+        speed = self._transport.speed
+        await asyncio.sleep(outcome.duration / speed)
+        if outcome.error is not None:
+            raise _exception(outcome.error)
+        loop = asyncio.get_running_loop()
+        for delay, payload in outcome.notifications:
+            loop.call_later(delay / speed, self._notification, char, payload)
+
+    def _notification(self, char: Any, payload: bytes) -> None:
+        if self._notify is not None and self.is_connected:
+            self._notify(char, bytearray(payload))
+
+    def drop(self, disconnected_callback: Callable[[Any], None]) -> None:
+        """Disconnect unexpectedly, like the device did."""
+        if self.is_connected:
+            self.is_connected = False
+            disconnected_callback(self)
+
+    async def disconnect(self) -> None:
+        """Disconnect."""
+        self.is_connected = False
+
+
+@dataclass
+class ReplayResult:
+    """Latencies of the commands of a device, recorded and replayed."""
+
+    address: str
+    name: str
+    recorded: list[float] = field(default_factory=list)
+    replayed: list[float] = field(default_factory=list)
+    errors: int = 0
+    recorded_errors: int = 0
+
+
+async def replay_trace(path: Path | str, speed: float = 1.0) -> list[ReplayResult]:
+    """Replay the commands of a trace against its recorded transport."""
+    from .device import get_model_class_from_name
+    from .device.priority import Priority
+
+    by_device: dict[int, list[TraceRecord]] = {}
+    for record in read_trace(path):
+        by_device.setdefault(record.device, []).append(record)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    results: list[ReplayResult] = []
+    devices: list[BaseDevice] = []
+    tasks: list[asyncio.Task[None]] = []
+
+    async def _replay_command(
+        device: BaseDevice, result: ReplayResult, record: TraceRecord
+    ) -> None:
+        _, priority, frames = decode_command(record.payload)
+        await asyncio.sleep(max(0.0, start + record.time / speed - loop.time()))
+        command_start = loop.time()
+        try:
+            await device.send_commands(frames, priority=Priority(priority))
+        except Exception:  # pylint: disable=broad-except
+            result.errors += 1
+        result.replayed.append(loop.time() - command_start)
+
+    for records in by_device.values():
+        declaration = records[0]
+        if declaration.event != TraceEvent.DEVICE:
+            raise InvalidTraceError(f"{path}: device {declaration.device} undeclared")
+        address, _, name = declaration.payload.decode().partition("\0")
+        result = ReplayResult(address, name)
+        results.append(result)
+        device = get_model_class_from_name(name)(BLEDevice(address, name, None, 0))
+        # the replayed client only implements what the device uses
+        device.set_connector(
+            ReplayTransport(records, speed).connect  # type: ignore[arg-type]
+        )
+        devices.append(device)
+
+        started: dict[int, float] = {}
+        for record in records:
+            if record.event == TraceEvent.COMMAND:
+                started[decode_command(record.payload)[0]] = record.time
+                tasks.append(
+                    asyncio.create_task(_replay_command(device, result, record))
+                )
+            elif record.event in (TraceEvent.COMMAND_DONE, TraceEvent.COMMAND_FAILED):
+                (sequence,) = _SEQUENCE.unpack_from(record.payload)
+                if (command_time := started.pop(sequence, None)) is not None:
+                    result.recorded.append(record.time - command_time)
+                if record.event == TraceEvent.COMMAND_FAILED:
+                    result.recorded_errors += 1
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for device in devices:
+            await device.disconnect()
+    return results
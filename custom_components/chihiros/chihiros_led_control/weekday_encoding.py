@@ -16,23 +16,33 @@ class WeekdaySelect(str, Enum):
     everyday = "everyday"
 
 
+# bit of each day in an encoded selection, all of them select every day
+WEEKDAY_BITS = {
+    WeekdaySelect.monday: 64,
+    WeekdaySelect.tuesday: 32,
+    WeekdaySelect.wednesday: 16,
+    WeekdaySelect.thursday: 8,
+    WeekdaySelect.friday: 4,
+    WeekdaySelect.saturday: 2,
+    WeekdaySelect.sunday: 1,
+}
+EVERYDAY_MASK = 127
+
+
 def encode_selected_weekdays(selection: list[WeekdaySelect]) -> int:
     """Encode list of weekdays."""
-    encoding = 0
     if WeekdaySelect.everyday in selection:
-        return 127
-    if WeekdaySelect.monday in selection:
-        encoding += 64
-    if WeekdaySelect.tuesday in selection:
-        encoding += 32
-    if WeekdaySelect.wednesday in selection:
-        encoding += 16
-    if WeekdaySelect.thursday in selection:
-        encoding += 8
-    if WeekdaySelect.friday in selection:
-        encoding += 4
-    if WeekdaySelect.saturday in selection:
-        encoding += 2
-    if WeekdaySelect.sunday in selection:
-        encoding += 1
-    return encoding
+        return EVERYDAY_MASK
+    return sum(bit for weekday, bit in WEEKDAY_BITS.items() if weekday in selection)
+
+
+def decode_selected_weekdays(encoding: int) -> list[WeekdaySelect]:
+    """Decode an encoded list of weekdays."""
+    if encoding == EVERYDAY_MASK:
+        return [WeekdaySelect.everyday]
+    return [weekday for weekday, bit in WEEKDAY_BITS.items() if encoding & bit]
+
+
+def weekday_bit(weekday: int) -> int:
+    """Return the bit of a weekday (0 is monday) in an encoded list of weekdays."""
+    return 1 << (6 - weekday)
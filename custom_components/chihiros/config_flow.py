@@ -2,27 +2,92 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 from typing import Any
 
-import voluptuous as vol  # type: ignore
+import voluptuous as vol  # type: ignore[import, unused-ignore]
 from homeassistant.components.bluetooth import (
     BluetoothServiceInfoBleak,
     async_discovered_service_info,
 )
-from homeassistant.config_entries import ConfigFlow
-from homeassistant.const import CONF_ADDRESS
-from homeassistant.data_entry_flow import FlowResult
+from homeassistant.config_entries import (
+    SOURCE_INTEGRATION_DISCOVERY,
+    ConfigEntry,
+    ConfigFlow,
+    OptionsFlow,
+)
+from homeassistant.const import CONF_ADDRESS, CONF_MODEL, CONF_NAME
+from homeassistant.core import callback
+from homeassistant.data_entry_flow import FlowResult, FlowResultType
+from homeassistant.helpers import config_validation as cv
 
-from .chihiros_led_control.device import BaseDevice, get_model_class_from_name
-from .const import DOMAIN
+from .chihiros_led_control.device import (
+    ProbeResult,
+    get_model_class_from_name,
+    is_chihiros_advertisement,
+    probe_devices,
+)
+from .const import (
+    CONF_ADDRESSES,
+    CONF_COMBINED_LIGHT,
+    CONF_PERCEPTUAL_BRIGHTNESS,
+    CONF_RESYNC_ON_START,
+    DEFAULT_PERCEPTUAL_BRIGHTNESS,
+    DEFAULT_RESYNC_ON_START,
+    DOMAIN,
+    PROBE_MAX_CONCURRENCY,
+    PROBE_TIMEOUT,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
 ADDITIONAL_DISCOVERY_TIMEOUT = 60
 
+CONF_ADD_UNREACHABLE = "add_unreachable"
+
+
+def _title(discovery_info: BluetoothServiceInfoBleak) -> str:
+    """Return the title of the entry of a device."""
+    title: str = discovery_info.name or discovery_info.address
+    return title
+
+
+def _entry_data(
+    discovery_info: BluetoothServiceInfoBleak, model: str | None = None
+) -> dict[str, Any]:
+    """Return the entry data needed to set up the device before it advertises."""
+    if model is None:
+        model = get_model_class_from_name(
+            discovery_info.name, discovery_info.service_uuids
+        ).__name__
+    return {
+        CONF_ADDRESS: discovery_info.address,
+        CONF_NAME: discovery_info.name,
+        CONF_MODEL: model,
+    }
+
 
-class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
+def _probe_report(
+    discovered: dict[str, BluetoothServiceInfoBleak], results: list[ProbeResult]
+) -> str:
+    """Return a markdown list of the outcome of the probes."""
+    lines = []
+    for result in results:
+        model = result.model if result.known_model else f"{result.model} (unknown name)"
+        rssi = f"{result.rssi} dBm" if result.rssi is not None else "no RSSI"
+        if result.ok:
+            outcome = f"connected in {result.connect_time or 0:.1f} s"
+        else:
+            outcome = f"**unreachable**: {result.error}"
+        lines.append(
+            f"- {_title(discovered[result.address])} ({result.address}): "
+            f"{model}, {rssi}, {outcome}"
+        )
+    return "\n".join(lines)
+
+
+class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):  # type: ignore[call-arg, unused-ignore]
     """Handle a config flow for chihiros."""
 
     VERSION = 1
@@ -30,8 +95,16 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
     def __init__(self) -> None:
         """Initialize the config flow."""
         self._discovery_info: BluetoothServiceInfoBleak | None = None
-        self._discovered_device: BaseDevice | None = None
         self._discovered_devices: dict[str, BluetoothServiceInfoBleak] = {}
+        self._selected: list[str] = []
+        self._probe_task: asyncio.Task[list[ProbeResult]] | None = None
+        self._probe_results: list[ProbeResult] = []
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: ConfigEntry) -> OptionsFlow:
+        """Get the options flow for this handler."""
+        return ChihirosOptionsFlow(config_entry)
 
     async def async_step_bluetooth(
         self, discovery_info: BluetoothServiceInfoBleak
@@ -39,10 +112,7 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
         """Handle the bluetooth discovery step."""
         await self.async_set_unique_id(discovery_info.address)
         self._abort_if_unique_id_configured()
-        model_class = get_model_class_from_name(discovery_info.name)
-        device = model_class(discovery_info.device)
         self._discovery_info = discovery_info
-        self._discovered_device = device
         _LOGGER.debug(
             "async_step_bluetooth - discovered device %s", discovery_info.name
         )
@@ -52,13 +122,13 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Confirm discovery."""
-        assert self._discovered_device is not None
-        device = self._discovered_device
         assert self._discovery_info is not None
         discovery_info = self._discovery_info
-        title = device.name or discovery_info.name
+        title = _title(discovery_info)
         if user_input is not None:
-            return self.async_create_entry(title=title, data={})
+            return self.async_create_entry(
+                title=title, data=_entry_data(discovery_info)
+            )
 
         self._set_confirm_only()
         placeholders = {"name": title}
@@ -70,25 +140,19 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
-        """Handle the user step to pick discovered device."""
+        """Handle the user step to pick discovered devices."""
         errors: dict[str, str] = {}
 
         if user_input is not None:
-            address = user_input[CONF_ADDRESS]
-            discovery_info = self._discovered_devices[address]
-            await self.async_set_unique_id(
-                discovery_info.address, raise_on_progress=False
-            )
-            self._abort_if_unique_id_configured()
-            model_class = get_model_class_from_name(discovery_info.name)
-            device = model_class(discovery_info.device)
-
-            self._discovery_info = discovery_info
-            self._discovered_device = device
-            title = device.name or discovery_info.name
-            return self.async_create_entry(
-                title=title, data={CONF_ADDRESS: discovery_info.address}
-            )
+            current_addresses = self._async_current_ids()
+            self._selected = [
+                address
+                for address in user_input[CONF_ADDRESSES]
+                if address not in current_addresses
+            ]
+            if self._selected:
+                return await self.async_step_probe()
+            errors["base"] = "no_devices_selected"
 
         if discovery := self._discovery_info:
             self._discovered_devices[discovery.address] = discovery
@@ -98,6 +162,9 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
                 if (
                     discovery.address in current_addresses
                     or discovery.address in self._discovered_devices
+                    or not is_chihiros_advertisement(
+                        discovery.name, discovery.service_uuids
+                    )
                 ):
                     continue
                 self._discovered_devices[discovery.address] = discovery
@@ -107,7 +174,7 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
 
         data_schema = vol.Schema(
             {
-                vol.Required(CONF_ADDRESS): vol.In(
+                vol.Required(CONF_ADDRESSES): cv.multi_select(
                     {
                         service_info.address: (
                             f"{service_info.name} ({service_info.address})"
@@ -120,3 +187,152 @@ class ChihirosConfigFlow(ConfigFlow, domain=DOMAIN):
         return self.async_show_form(
             step_id="user", data_schema=data_schema, errors=errors
         )
+
+    @callback
+    def async_remove(self) -> None:
+        """Stop probing the devices when the flow is closed."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+
+    async def async_step_probe(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Connect to the selected devices while showing the progress."""
+        if self._probe_task is None:
+            self._probe_task = self.hass.async_create_task(
+                probe_devices(
+                    (
+                        (
+                            self._discovered_devices[address].device,
+                            self._discovered_devices[address].advertisement,
+                        )
+                        for address in self._selected
+                    ),
+                    PROBE_MAX_CONCURRENCY,
+                    PROBE_TIMEOUT,
+                ),
+                "chihiros probe devices",
+            )
+        if not self._probe_task.done():
+            return self.async_show_progress(
+                step_id="probe",
+                progress_action="probe",
+                description_placeholders={"count": str(len(self._selected))},
+                progress_task=self._probe_task,
+            )
+        self._probe_results = self._probe_task.result()
+        return self.async_show_progress_done(next_step_id="probe_report")
+
+    async def async_step_probe_report(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Report the probed devices and add them all at once."""
+        if user_input is not None:
+            add_unreachable = user_input.get(CONF_ADD_UNREACHABLE, False)
+            entries = [
+                _entry_data(self._discovered_devices[result.address], result.model)
+                for result in self._probe_results
+                if result.ok or add_unreachable
+            ]
+            if not entries:
+                return self.async_abort(reason="cannot_connect")
+            data, *others = entries
+            await self.async_set_unique_id(data[CONF_ADDRESS], raise_on_progress=False)
+            self._abort_if_unique_id_configured()
+            # the other devices are added by flows of their own, awaited to
+            # report the ones that could not be added
+            results = await asyncio.gather(
+                *(
+                    self.hass.config_entries.flow.async_init(
+                        DOMAIN,
+                        context={"source": SOURCE_INTEGRATION_DISCOVERY},
+                        data=other,
+                    )
+                    for other in others
+                ),
+                return_exceptions=True,
+            )
+            failed = []
+            for other, result in zip(others, results):
+                if isinstance(result, BaseException):
+                    _LOGGER.warning(
+                        "Failed to add %s", other[CONF_ADDRESS], exc_info=result
+                    )
+                elif result["type"] != FlowResultType.CREATE_ENTRY:
+                    _LOGGER.warning(
+                        "Failed to add %s: %s",
+                        other[CONF_ADDRESS],
+                        result.get("reason"),
+                    )
+                else:
+                    continue
+                failed.append(other[CONF_NAME] or other[CONF_ADDRESS])
+            return self.async_create_entry(
+                title=data[CONF_NAME] or data[CONF_ADDRESS],
+                data=data,
+                description="partially_added" if failed else None,
+                description_placeholders={"failed": ", ".join(failed)},
+            )
+
+        reachable = sum(result.ok for result in self._probe_results)
+        return self.async_show_form(
+            step_id="probe_report",
+            data_schema=vol.Schema(
+                {vol.Optional(CONF_ADD_UNREACHABLE, default=not reachable): bool}
+            ),
+            description_placeholders={
+                "devices": _probe_report(self._discovered_devices, self._probe_results),
+                "reachable": str(reachable),
+                "count": str(len(self._probe_results)),
+            },
+        )
+
+    async def async_step_integration_discovery(
+        self, discovery_info: dict[str, Any]
+    ) -> FlowResult:
+        """Add a device probed by the flow of the user."""
+        await self.async_set_unique_id(
+            discovery_info[CONF_ADDRESS], raise_on_progress=False
+        )
+        self._abort_if_unique_id_configured()
+        return self.async_create_entry(
+            title=discovery_info[CONF_NAME] or discovery_info[CONF_ADDRESS],
+            data=discovery_info,
+        )
+
+
+class ChihirosOptionsFlow(OptionsFlow):
+    """Handle the options of a chihiros entry."""
+
+    def __init__(self, config_entry: ConfigEntry) -> None:
+        """Initialize the options flow."""
+        self.config_entry = config_entry
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        data_schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_COMBINED_LIGHT,
+                    default=self.config_entry.options.get(CONF_COMBINED_LIGHT, False),
+                ): bool,
+                vol.Optional(
+                    CONF_RESYNC_ON_START,
+                    default=self.config_entry.options.get(
+                        CONF_RESYNC_ON_START, DEFAULT_RESYNC_ON_START
+                    ),
+                ): bool,
+                vol.Optional(
+                    CONF_PERCEPTUAL_BRIGHTNESS,
+                    default=self.config_entry.options.get(
+                        CONF_PERCEPTUAL_BRIGHTNESS, DEFAULT_PERCEPTUAL_BRIGHTNESS
+                    ),
+                ): bool,
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=data_schema)
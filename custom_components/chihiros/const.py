@@ -2,3 +2,33 @@
 
 MANUFACTURER = "Chihiros"
 DOMAIN = "chihiros"
+
+CONF_COMBINED_LIGHT = "combined_light"
+
+# seconds a light command may take, waiting for other commands included
+COMMAND_TIMEOUT = 15.0
+
+CONF_RESYNC_ON_START = "resync_on_start"
+# opt-in: manual levels sent to a light take it out of its auto program
+DEFAULT_RESYNC_ON_START = False
+
+CONF_PERCEPTUAL_BRIGHTNESS = "perceptual_brightness"
+# opt-in: the levels sent for a brightness follow a gamma curve instead of
+# being proportional to it, which changes the output of existing lights
+DEFAULT_PERCEPTUAL_BRIGHTNESS = False
+
+# the startup resync starts this long after Home Assistant started, in seconds
+RESYNC_DELAY = 2.0
+# lights resynchronized at once, for all the entries
+RESYNC_MAX_CONCURRENCY = 4
+# lights starting their resync together, waves are this far apart at least
+RESYNC_WAVE_SIZE = 2
+RESYNC_WAVE_INTERVAL = 0.1
+# lights that have not advertised this long after the start are not resynchronized
+RESYNC_WAIT_FOR_DEVICE = 60.0
+
+CONF_ADDRESSES = "addresses"
+
+# lights probed at once while onboarding, each within the timeout in seconds
+PROBE_MAX_CONCURRENCY = 4
+PROBE_TIMEOUT = 20.0
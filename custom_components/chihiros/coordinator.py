@@ -1,9 +1,11 @@
-"""Integration to integrate Keymitt BLE devices with Home Assistant."""
+"""Coordinator of the advertisements of Chihiros devices."""
 
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING, Any
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, TypeVar
 
 try:
     from homeassistant.components import bluetooth
@@ -22,8 +24,14 @@ except ModuleNotFoundError:
 
         pass
 
+    _CallableT = TypeVar("_CallableT", bound=Callable[..., Any])
+
+    def _fake_callback(func: _CallableT) -> _CallableT:
+        """Return the function unchanged, as the callback decorator does."""
+        return func
+
     CoordinatorParent = _FakeParent  # type :ignore
-    callback = property  # type: ignore
+    callback = _fake_callback
 
 
 from .chihiros_led_control.device.base_device import BaseDevice
@@ -33,14 +41,115 @@ if TYPE_CHECKING:
 
 _LOGGER: logging.Logger = logging.getLogger(__package__)
 
+# smoothed RSSI change needed before the device and the listeners are updated
+RSSI_CHANGE_THRESHOLD = 6
+# minimum delay between two listener updates only caused by a RSSI change
+RSSI_UPDATE_INTERVAL = 60.0
+# weight of a new advertisement in the smoothed RSSI
+RSSI_SMOOTHING = 0.25
+
+
+@dataclass
+class ChihirosPresence:
+    """Presence of a device computed from its advertisements."""
+
+    rssi: float | None = None
+    last_seen: float = 0.0
+    advertisements: int = 0
+    device_updates: int = 0
+    listener_updates: int = 0
+
+
+@dataclass
+class ChihirosTimings:
+    """Startup timings of an entry, in seconds."""
+
+    setup_started: float = 0.0
+    setup_duration: float | None = None
+    time_to_first_command: float | None = None
+
+
+def _device_key(ble_device: BLEDevice) -> tuple[str, Any]:
+    """Return what identifies the path to a device.
+
+    BlueZ details hold the properties of the last advertisement next to the
+    path of the device, only the path is compared.
+    """
+    details = ble_device.details
+    if isinstance(details, dict):
+        details = details.get("path")
+    return ble_device.address, details
+
+
+class PresenceTracker:
+    """Turn advertisements into presence and RSSI changes.
+
+    The tracker only keeps a few numbers per advertisement so that it stays
+    cheap when a busy environment floods the coordinator.
+    """
+
+    def __init__(
+        self,
+        rssi_change_threshold: float = RSSI_CHANGE_THRESHOLD,
+        rssi_update_interval: float = RSSI_UPDATE_INTERVAL,
+    ) -> None:
+        """Initialize the tracker."""
+        self.presence = ChihirosPresence()
+        self._rssi_change_threshold = rssi_change_threshold
+        self._rssi_update_interval = rssi_update_interval
+        self._device_key: tuple[str, Any] | None = None
+        self._pushed_rssi: float | None = None
+        self._last_listener_update = float("-inf")
+
+    def process(
+        self, ble_device: BLEDevice, rssi: int, now: float, was_available: bool
+    ) -> tuple[bool, bool]:
+        """Process an advertisement.
+
+        Return whether the device handle must be updated and whether the
+        listeners must be updated.
+        """
+        presence = self.presence
+        presence.advertisements += 1
+        presence.last_seen = now
+        smoothed = presence.rssi
+        smoothed = (
+            rssi if smoothed is None else smoothed + (rssi - smoothed) * RSSI_SMOOTHING
+        )
+        presence.rssi = smoothed
+
+        rssi_changed = (
+            self._pushed_rssi is None
+            or abs(smoothed - self._pushed_rssi) >= self._rssi_change_threshold
+        )
+        # a new BLEDevice object may come with every advertisement
+        device_key = _device_key(ble_device)
+        device_changed = device_key != self._device_key
+        push_device = device_changed or rssi_changed
+        if push_device:
+            self._device_key = device_key
+            self._pushed_rssi = smoothed
+            presence.device_updates += 1
+
+        notify = not was_available or (
+            rssi_changed
+            and now - self._last_listener_update >= self._rssi_update_interval
+        )
+        if notify:
+            self._last_listener_update = now
+            presence.listener_updates += 1
+        return push_device, notify
+
 
 class ChihirosDataUpdateCoordinator(CoordinatorParent):  # type: ignore
     """Class to manage fetching data from the Chihiros.
 
-    TODO: See if the _async_handle_bluetooth_event is called.
-    If not, that means this class is useless, so we can delete it
+    Advertisements only update the presence of the device: the device handle
+    and the entities are updated when the presence changes enough.
     """
 
+    _available: bool
+
     def __init__(
         self,
         hass: HomeAssistant,
@@ -51,11 +160,32 @@ class ChihirosDataUpdateCoordinator(CoordinatorParent):  # type: ignore
         self.api: BaseDevice = client
         self.data: dict[str, Any] = {}
         self.ble_device = ble_device
+        self.tracker = PresenceTracker()
+        self.timings = ChihirosTimings(setup_started=time.monotonic())
         super().__init__(
             hass,
             _LOGGER,
             ble_device.address,
             bluetooth.BluetoothScanningMode.ACTIVE,
+            connectable=True,
+        )
+        client.register_availability_callback(self._async_handle_device_availability)
+
+    @property
+    def presence(self) -> ChihirosPresence:
+        """Return the presence of the device."""
+        return self.tracker.presence
+
+    def record_command(self) -> None:
+        """Record that a command has been sent to the device."""
+        timings = self.timings
+        if timings.time_to_first_command is not None:
+            return
+        timings.time_to_first_command = time.monotonic() - timings.setup_started
+        _LOGGER.debug(
+            "%s: first command sent %.2f s after setup",
+            self.address,
+            timings.time_to_first_command,
         )
 
     @callback
@@ -65,14 +195,39 @@ class ChihirosDataUpdateCoordinator(CoordinatorParent):  # type: ignore
         change: bluetooth.BluetoothChange,
     ) -> None:
         """Handle a Bluetooth event."""
-        _LOGGER.critical("%s: CHIHIROS data: %s", self.ble_device.address, self.data)
-        super()._async_handle_bluetooth_event(service_info, change)
+        was_available = self._available
+        self._available = True
+        push_device, notify = self.tracker.process(
+            service_info.device, service_info.rssi, service_info.time, was_available
+        )
+        # a device rejecting commands since a failed connection is reachable again
+        if push_device or not self.api.available:
+            self.ble_device = service_info.device
+            self.api.set_ble_device_and_advertisement_data(
+                service_info.device, service_info.advertisement
+            )
+        if notify:
+            _LOGGER.debug(
+                "%s: presence updated: %s", self.address, self.tracker.presence
+            )
+            self.async_update_listeners()
+
+    @callback
+    def _async_handle_device_availability(self, available: bool) -> None:
+        """Mark the device unavailable as soon as connecting to it fails.
+
+        It becomes available again with its next advertisement.
+        """
+        if available or not self._available:
+            return
+        _LOGGER.debug("%s: device unreachable", self.address)
+        self._available = False
+        self.async_update_listeners()
 
     @callback
     def _async_handle_unavailable(
         self, service_info: bluetooth.BluetoothServiceInfoBleak
     ) -> None:
         """Handle the device going unavailable."""
-        _LOGGER.critical("%s: CHIHIROS device unavailable: %s", self.ble_device.address)
+        _LOGGER.debug("%s: device unavailable", self.address)
         super()._async_handle_unavailable(service_info)
-        # self._was_unavailable = True
@@ -0,0 +1,55 @@
+"""Diagnostics support for the chihiros integration."""
+
+from __future__ import annotations
+
+from dataclasses import asdict
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+from .models import ChihirosData
+
+
+def _percentiles(values: list[float]) -> dict[str, float] | None:
+    """Return the median and the maximum of some durations."""
+    if not values:
+        return None
+    values = sorted(values)
+    return {"p50": values[len(values) // 2], "max": values[-1]}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return the diagnostics of an entry.
+
+    The startup timings of all the entries are summarized too, to compare the
+    entry with the rest of a large install.
+    """
+    entries: dict[str, ChihirosData] = hass.data[DOMAIN]
+    data = entries[entry.entry_id]
+    timings = [other.coordinator.timings for other in entries.values()]
+    return {
+        "model": data.device.__class__.__name__,
+        "available": data.coordinator.available,
+        "timings": asdict(data.coordinator.timings),
+        "presence": asdict(data.coordinator.presence),
+        "all_entries": {
+            "entries": len(timings),
+            "setup_duration": _percentiles(
+                [t.setup_duration for t in timings if t.setup_duration is not None]
+            ),
+            "time_to_first_command": _percentiles(
+                [
+                    t.time_to_first_command
+                    for t in timings
+                    if t.time_to_first_command is not None
+                ]
+            ),
+            "waiting_for_first_command": sum(
+                t.time_to_first_command is None for t in timings
+            ),
+        },
+    }
@@ -3,27 +3,67 @@
 from __future__ import annotations
 
 import logging
-from typing import Any
+from contextlib import AbstractContextManager
+from typing import Any, Awaitable
 
 from homeassistant.components.bluetooth.passive_update_coordinator import (
     PassiveBluetoothCoordinatorEntity,
 )
-from homeassistant.components.light import ATTR_BRIGHTNESS, ColorMode, LightEntity
+from homeassistant.components.light import (
+    ATTR_BRIGHTNESS,
+    ATTR_RGB_COLOR,
+    ATTR_RGBW_COLOR,
+    ColorMode,
+    LightEntity,
+)
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import STATE_ON
-from homeassistant.core import HomeAssistant
+from homeassistant.const import STATE_OFF, STATE_ON
+from homeassistant.core import HomeAssistant, State
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers.debounce import Debouncer
 from homeassistant.helpers.device_registry import DeviceInfo
+from homeassistant.helpers.entity import Entity
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.restore_state import RestoreEntity
 
+from .chihiros_led_control.color import ColorPipeline
 from .chihiros_led_control.device import BaseDevice
-from .const import DOMAIN, MANUFACTURER
+from .chihiros_led_control.device.base_device import (
+    BLEAK_EXCEPTIONS,
+    deadline_from_timeout,
+)
+from .chihiros_led_control.device.catalog import PERCEPTUAL_GAMMA
+from .chihiros_led_control.device.state import DeviceMode
+from .chihiros_led_control.exception import (
+    CharacteristicMissingError,
+    DeadlineExceeded,
+    DeviceUnavailable,
+)
+from .chihiros_led_control.spans import span
+from .const import (
+    COMMAND_TIMEOUT,
+    CONF_COMBINED_LIGHT,
+    CONF_PERCEPTUAL_BRIGHTNESS,
+    CONF_RESYNC_ON_START,
+    DEFAULT_PERCEPTUAL_BRIGHTNESS,
+    DEFAULT_RESYNC_ON_START,
+    DOMAIN,
+    MANUFACTURER,
+)
 from .coordinator import ChihirosDataUpdateCoordinator
 from .models import ChihirosData
+from .resync import async_get_resync_manager
 
 _LOGGER = logging.getLogger(__name__)
 
+RGB_CHANNELS = ("red", "green", "blue")
+WHITE_CHANNEL = "white"
+# state writes of the combined light are coalesced within this delay
+STATE_WRITE_COOLDOWN = 0.5
+# mode of the light last set by Home Assistant, kept in the restored state
+ATTR_MODE = "mode"
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -33,20 +73,132 @@ async def async_setup_entry(
     """Set up the light platform for LEDBLE."""
     chihiros_data: ChihirosData = hass.data[DOMAIN][entry.entry_id]
     _LOGGER.debug("Setup chihiros entry: %s", chihiros_data.device.address)
-    for color in chihiros_data.device.colors:
+    color_mode = _combined_color_mode(chihiros_data.device.colors)
+    if entry.options.get(CONF_COMBINED_LIGHT) and color_mode is not None:
         _LOGGER.debug(
-            "Setup chihiros light entity: %s - %s", chihiros_data.device.address, color
+            "Setup chihiros combined light entity: %s - %s",
+            chihiros_data.device.address,
+            color_mode,
         )
         async_add_entities(
             [
-                ChihirosLightEntity(
-                    chihiros_data.coordinator,
-                    chihiros_data.device,
-                    entry,
-                    color=color,
+                ChihirosCombinedLightEntity(
+                    chihiros_data.coordinator, chihiros_data.device, entry, color_mode
                 )
             ]
         )
+        return
+
+    entities: list[LightEntity] = []
+    for color in chihiros_data.device.colors:
+        _LOGGER.debug(
+            "Setup chihiros light entity: %s - %s", chihiros_data.device.address, color
+        )
+        entities.append(
+            ChihirosLightEntity(
+                chihiros_data.coordinator,
+                chihiros_data.device,
+                entry,
+                color=color,
+            )
+        )
+    async_add_entities(entities)
+
+
+def _combined_color_mode(colors: dict[str, int]) -> ColorMode | None:
+    """Return the color mode of a single entity driving all the colors."""
+    rgb = [colors.get(color) for color in RGB_CHANNELS]
+    if None in rgb:
+        return None
+    white = colors.get(WHITE_CHANNEL)
+    if white is not None and white not in rgb:
+        return ColorMode.RGBW
+    return ColorMode.RGB
+
+
+def _device_info(device: BaseDevice, address: str) -> DeviceInfo:
+    """Return the device info shared by the entities of a device."""
+    model_name: str = device.model_name
+    return DeviceInfo(
+        connections={(dr.CONNECTION_BLUETOOTH, address)},
+        manufacturer=MANUFACTURER,
+        model=model_name,
+        name=device.name,
+    )
+
+
+def _pipeline(device: BaseDevice, config_entry: ConfigEntry) -> ColorPipeline:
+    """Return the color pipeline of a light, perceptual if chosen in the options."""
+    gamma = None
+    if config_entry.options.get(
+        CONF_PERCEPTUAL_BRIGHTNESS, DEFAULT_PERCEPTUAL_BRIGHTNESS
+    ):
+        gamma = PERCEPTUAL_GAMMA
+    return ColorPipeline.for_model(type(device).__name__, gamma)
+
+
+def _async_resync(
+    entity: PassiveBluetoothCoordinatorEntity[ChihirosDataUpdateCoordinator],
+    device: BaseDevice,
+    config_entry: ConfigEntry,
+    levels: dict[str, int],
+) -> None:
+    """Resynchronize a light with the levels restored by one of its entities."""
+    if not config_entry.options.get(CONF_RESYNC_ON_START, DEFAULT_RESYNC_ON_START):
+        return
+    manager = async_get_resync_manager(entity.hass)
+    if manager.is_set_up_again(config_entry.entry_id):
+        return
+    entity.async_on_remove(manager.async_register(entity.coordinator, device, levels))
+
+
+def _device_mode(device: BaseDevice, restored: str | None) -> str | None:
+    """Return the mode of a light, the restored one until a command sets it."""
+    mode = device.state.mode
+    return restored if mode is None else mode.value
+
+
+def _can_resync(last_state: State) -> bool:
+    """Return whether a restored state can be sent to the light again.
+
+    An unavailable or unknown state says nothing of the levels, and levels
+    sent to a light running its auto program would take it out of auto mode.
+    """
+    return (
+        last_state.state in (STATE_ON, STATE_OFF)
+        and last_state.attributes.get(ATTR_MODE) == DeviceMode.MANUAL.value
+    )
+
+
+def _command_span(entity: Entity, action: str) -> AbstractContextManager[Any]:
+    """Trace a command of an entity, correlated with its Home Assistant context."""
+    context = entity._context  # pylint: disable=protected-access
+    return span(
+        f"light.{action}",
+        entity_id=entity.entity_id,
+        context_id=None if context is None else context.id,
+    )
+
+
+async def _async_send(
+    coordinator: ChihirosDataUpdateCoordinator,
+    device: BaseDevice,
+    command: Awaitable[None],
+) -> None:
+    """Await a device command, turning its failures into Home Assistant errors."""
+    try:
+        await command
+    except DeviceUnavailable as ex:
+        raise HomeAssistantError(f"{device.name} is unavailable") from ex
+    except DeadlineExceeded as ex:
+        raise HomeAssistantError(
+            f"{device.name} did not respond within {COMMAND_TIMEOUT}s"
+        ) from ex
+    except (CharacteristicMissingError, *BLEAK_EXCEPTIONS) as ex:
+        raise HomeAssistantError(
+            f"Failed to send command to {device.name}: {ex}"
+        ) from ex
+    coordinator.record_command()
 
 
 class ChihirosLightEntity(
@@ -73,27 +225,41 @@ class ChihirosLightEntity(
         self._device = chihiros_device
         self._address = coordinator.address
         self._color = color
+        self._pipeline = _pipeline(chihiros_device, config_entry)
 
         self._attr_name = f"{self._device.name} {self._color}"
         self._attr_unique_id = f"{self._address}_{self._color}"
         self._attr_color = self._color
-        self._attr_extra_state_attributes = {"color": self._color}
-
-        model_name: str = self._device.model_name
-        self._attr_device_info = DeviceInfo(
-            connections={(dr.CONNECTION_BLUETOOTH, self._address)},
-            manufacturer=MANUFACTURER,
-            model=model_name,
-            name=self._device.name,
-        )
+        self._restored_mode: str | None = None
+
+        self._attr_device_info = _device_info(self._device, self._address)
+        self._config_entry = config_entry
 
     async def async_added_to_hass(self) -> None:
         """Handle entity about to be added to hass event."""
         _LOGGER.debug("Called async_added_to_hass: %s", self.name)
         await super().async_added_to_hass()
-        if last_state := await self.async_get_last_state():
+        if (last_state := await self.async_get_last_state()) is None:
+            return
+        self._restored_mode = last_state.attributes.get(ATTR_MODE)
+        if last_state.state in (STATE_ON, STATE_OFF):
             self._attr_is_on = last_state.state == STATE_ON
             self._attr_brightness = last_state.attributes.get("brightness")
+        if _can_resync(last_state):
+            level = 0
+            if self._attr_is_on:
+                level = self._pipeline.channel_level(
+                    self._color, self._attr_brightness or 255
+                )
+            _async_resync(self, self._device, self._config_entry, {self._color: level})
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the color and the mode of the light."""
+        return {
+            "color": self._color,
+            ATTR_MODE: _device_mode(self._device, self._restored_mode),
+        }
 
     @property
     def brightness(self) -> int | None:
@@ -107,27 +273,176 @@ class ChihirosLightEntity(
 
     async def async_turn_on(self, **kwargs: Any) -> None:
         """Instruct the light to turn on."""
+        deadline = deadline_from_timeout(COMMAND_TIMEOUT)
+        brightness = self._pipeline.channel_level(
+            self._color, kwargs.get(ATTR_BRIGHTNESS, 255)
+        )
+        _LOGGER.debug("Turning on: %s to %s", self.name, brightness)
+        with _command_span(self, "turn_on"):
+            await _async_send(
+                self.coordinator,
+                self._device,
+                self._device.set_color_brightness(brightness, self._color, deadline),
+            )
         if ATTR_BRIGHTNESS in kwargs:
-            brightness = int((kwargs[ATTR_BRIGHTNESS] / 255) * 100)
-            _LOGGER.debug("Turning on: %s to %s", self.name, brightness)
-            # TODO: handle error and availability False
-            await self._device.set_color_brightness(brightness, self._color)
             self._attr_brightness = kwargs[ATTR_BRIGHTNESS]
-        else:
-            _LOGGER.debug("Turning on: %s", self.name)
-            await self._device.set_color_brightness(100, self._color)
         self._attr_is_on = True
-        self._attr_available = True
         self.schedule_update_ha_state()
         _LOGGER.debug("Turned on: %s", self.name)
 
     async def async_turn_off(self, **kwargs: Any) -> None:
         """Instruct the light to turn off."""
         _LOGGER.debug("Turning off: %s", self.name)
-        # TODO handle error and availability False
-        await self._device.set_color_brightness(0, self._color)
+        with _command_span(self, "turn_off"):
+            await _async_send(
+                self.coordinator,
+                self._device,
+                self._device.set_color_brightness(
+                    0, self._color, deadline_from_timeout(COMMAND_TIMEOUT)
+                ),
+            )
         self._attr_is_on = False
         self._attr_brightness = 0
-        self._attr_available = True
         self.schedule_update_ha_state()
         _LOGGER.debug("Turned off: %s", self.name)
+
+
+class ChihirosCombinedLightEntity(
+    PassiveBluetoothCoordinatorEntity[ChihirosDataUpdateCoordinator],
+    LightEntity,
+    RestoreEntity,
+):
+    """Single RGB or RGBW light driving all the colors of a Chihiros device."""
+
+    _attr_assumed_state = True
+    _attr_should_poll = False
+
+    def __init__(
+        self,
+        coordinator: ChihirosDataUpdateCoordinator,
+        chihiros_device: BaseDevice,
+        config_entry: ConfigEntry,
+        color_mode: ColorMode,
+    ) -> None:
+        """Initialise the entity."""
+        super().__init__(coordinator)
+        self._device = chihiros_device
+        self._address = coordinator.address
+        self._channels: tuple[str, ...] = RGB_CHANNELS
+        if color_mode == ColorMode.RGBW:
+            self._channels = (*RGB_CHANNELS, WHITE_CHANNEL)
+        self._color: tuple[int, ...] = (255,) * len(self._channels)
+        self._pipeline = _pipeline(chihiros_device, config_entry)
+        self._state_debouncer: Debouncer[None] | None = None
+        self._restored_mode: str | None = None
+
+        self._attr_name = self._device.name
+        self._attr_unique_id = f"{self._address}_combined"
+        self._attr_supported_color_modes = {color_mode}
+        self._attr_color_mode = color_mode
+        self._attr_brightness = 255
+        self._attr_device_info = _device_info(self._device, self._address)
+        self._config_entry = config_entry
+
+    async def async_added_to_hass(self) -> None:
+        """Handle entity about to be added to hass event."""
+        _LOGGER.debug("Called async_added_to_hass: %s", self.name)
+        await super().async_added_to_hass()
+        self._state_debouncer = Debouncer(
+            self.hass,
+            _LOGGER,
+            cooldown=STATE_WRITE_COOLDOWN,
+            immediate=True,
+            function=self.async_write_ha_state,
+        )
+        if (last_state := await self.async_get_last_state()) is None:
+            return
+        self._restored_mode = last_state.attributes.get(ATTR_MODE)
+        if last_state.state in (STATE_ON, STATE_OFF):
+            self._attr_is_on = last_state.state == STATE_ON
+            self._attr_brightness = last_state.attributes.get(ATTR_BRIGHTNESS) or 255
+            color_attribute = (
+                ATTR_RGBW_COLOR if len(self._channels) == 4 else ATTR_RGB_COLOR
+            )
+            if color := last_state.attributes.get(color_attribute):
+                self._color = tuple(color)
+        if _can_resync(last_state):
+            levels = dict.fromkeys(self._channels, 0)
+            if self._attr_is_on:
+                levels = self._channel_levels(self._color, self._attr_brightness or 255)
+            _async_resync(self, self._device, self._config_entry, levels)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the mode of the light."""
+        return {ATTR_MODE: _device_mode(self._device, self._restored_mode)}
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Handle entity being removed from hass."""
+        if self._state_debouncer is not None:
+            self._state_debouncer.async_cancel()
+        await super().async_will_remove_from_hass()
+
+    @property
+    def rgb_color(self) -> tuple[int, int, int] | None:
+        """Return the rgb color."""
+        if len(self._channels) != 3:
+            return None
+        return self._color  # type: ignore[return-value]
+
+    @property
+    def rgbw_color(self) -> tuple[int, int, int, int] | None:
+        """Return the rgbw color."""
+        if len(self._channels) != 4:
+            return None
+        return self._color  # type: ignore[return-value]
+
+    def _channel_levels(
+        self, color: tuple[int, ...], brightness: int
+    ) -> dict[str, int]:
+        """Map a HA color and brightness to channel levels (0-100)."""
+        white = color[3] if len(color) == 4 else None
+        return self._pipeline.levels([color[:3]], brightness, white)[0]
+
+    async def _async_write_state(self) -> None:
+        """Write the state, coalescing bursts of changes."""
+        if self._state_debouncer is None:
+            self.async_write_ha_state()
+            return
+        await self._state_debouncer.async_call()
+
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        """Instruct the light to turn on."""
+        color = kwargs.get(ATTR_RGBW_COLOR) or kwargs.get(ATTR_RGB_COLOR) or self._color
+        brightness = kwargs.get(ATTR_BRIGHTNESS, self._attr_brightness or 255)
+        color = tuple(color)[: len(self._channels)]
+        levels = self._channel_levels(color, brightness)
+        _LOGGER.debug("Turning on: %s to %s", self.name, levels)
+        with _command_span(self, "turn_on"):
+            await _async_send(
+                self.coordinator,
+                self._device,
+                self._device.set_colors_brightness(
+                    levels,  # type: ignore[arg-type]
+                    deadline_from_timeout(COMMAND_TIMEOUT),
+                ),
+            )
+        self._color = color
+        self._attr_brightness = brightness
+        self._attr_is_on = True
+        await self._async_write_state()
+
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        """Instruct the light to turn off."""
+        _LOGGER.debug("Turning off: %s", self.name)
+        with _command_span(self, "turn_off"):
+            await _async_send(
+                self.coordinator,
+                self._device,
+                self._device.set_colors_brightness(
+                    dict.fromkeys(self._channels, 0),
+                    deadline_from_timeout(COMMAND_TIMEOUT),
+                ),
+            )
+        self._attr_is_on = False
+        await self._async_write_state()
@@ -0,0 +1,289 @@
+"""Resynchronize the lights with their restored state after a restart."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.start import async_at_started
+
+from .chihiros_led_control.device import BaseDevice
+from .chihiros_led_control.device.base_device import (
+    BLEAK_EXCEPTIONS,
+    deadline_from_timeout,
+)
+from .chihiros_led_control.device.priority import Priority, command_priority
+from .chihiros_led_control.device.state import DeviceMode
+from .chihiros_led_control.exception import (
+    CharacteristicMissingError,
+    DeadlineExceeded,
+    DeviceUnavailable,
+)
+from .chihiros_led_control.spans import span
+from .const import (
+    COMMAND_TIMEOUT,
+    DOMAIN,
+    RESYNC_DELAY,
+    RESYNC_MAX_CONCURRENCY,
+    RESYNC_WAIT_FOR_DEVICE,
+    RESYNC_WAVE_INTERVAL,
+    RESYNC_WAVE_SIZE,
+)
+from .coordinator import ChihirosDataUpdateCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_RESYNC = f"{DOMAIN}_resync"
+
+
+@dataclass
+class ResyncReport:
+    """Outcome of a resync of the lights."""
+
+    devices: int = 0
+    resynced: int = 0
+    # lights already at their restored levels, e.g. set again since the start
+    skipped: int = 0
+    failed: int = 0
+    # lights that did not advertise in time
+    unreachable: int = 0
+    duration: float = 0.0
+
+
+@dataclass
+class _ResyncTarget:
+    """Light waiting for its resync."""
+
+    coordinator: ChihirosDataUpdateCoordinator
+    device: BaseDevice
+    # channel levels restored by the entities of the light, keyed by color
+    levels: dict[str, int]
+
+    @property
+    def priority(self) -> int:
+        """Return the priority of the light, lights meant to be lit go first."""
+        return int(any(self.levels.values()))
+
+    @property
+    def rssi(self) -> float:
+        """Return the smoothed rssi of the light."""
+        rssi = self.coordinator.presence.rssi
+        return -127.0 if rssi is None else rssi
+
+    def changed_levels(self) -> dict[int, int]:
+        """Return the levels the light is not known to have."""
+        colors = self.device.colors
+        return self.device.state.changed_levels(
+            {
+                colors[color]: level
+                for color, level in self.levels.items()
+                if color in colors
+            }
+        )
+
+
+@callback
+def async_get_resync_manager(hass: HomeAssistant) -> ResyncManager:
+    """Return the resync manager shared by the entries."""
+    manager: ResyncManager | None = hass.data.get(DATA_RESYNC)
+    if manager is None:
+        manager = hass.data[DATA_RESYNC] = ResyncManager(hass)
+    return manager
+
+
+class ResyncManager:
+    """Send their restored levels to the lights once Home Assistant started.
+
+    The lights are resynchronized in small waves, at most `max_concurrency`
+    at once for all the entries, so that the adapters are not flooded with
+    connections. Lights meant to be lit go first, then the ones with the
+    strongest signal. Lights already known to be at their levels or put in
+    auto mode since the start are skipped, and the ones that have not
+    advertised yet wait for it. Commands are sent in the background priority
+    class, so that the commands of the users overtake them.
+
+    Only the first setup of an entry since the start resynchronizes its
+    lights: when it is set up again, e.g. reloaded after a change of its
+    options, its new device starts with an empty state but the lights kept
+    their levels.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        max_concurrency: int = RESYNC_MAX_CONCURRENCY,
+        wave_size: int = RESYNC_WAVE_SIZE,
+        wave_interval: float = RESYNC_WAVE_INTERVAL,
+        wait_for_device: float = RESYNC_WAIT_FOR_DEVICE,
+    ) -> None:
+        """Initialize the manager."""
+        self.hass = hass
+        self.max_concurrency = max_concurrency
+        self.wave_size = wave_size
+        self.wave_interval = wave_interval
+        self.wait_for_device = wait_for_device
+        self.last_report: ResyncReport | None = None
+        self._pending: dict[str, _ResyncTarget] = {}
+        self._unloaded_entries: set[str] = set()
+        self._scheduled: CALLBACK_TYPE | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @callback
+    def async_entry_unloaded(self, entry_id: str) -> None:
+        """Record that an entry has been unloaded since the start."""
+        self._unloaded_entries.add(entry_id)
+
+    def is_set_up_again(self, entry_id: str) -> bool:
+        """Return whether an entry has already been set up since the start."""
+        return entry_id in self._unloaded_entries
+
+    @callback
+    def async_register(
+        self,
+        coordinator: ChihirosDataUpdateCoordinator,
+        device: BaseDevice,
+        levels: dict[str, int],
+    ) -> Callable[[], None]:
+        """Resynchronize channels of a light with their restored levels.
+
+        The entities of a light register their channels separately. Return a
+        function cancelling the resync of these channels.
+        """
+        address = device.address
+        if (target := self._pending.get(address)) is None:
+            target = self._pending[address] = _ResyncTarget(coordinator, device, {})
+        target.levels.update(levels)
+        self._async_schedule()
+
+        @callback
+        def _cancel() -> None:
+            if self._pending.get(address) is not target:
+                return
+            for color in levels:
+                target.levels.pop(color, None)
+            if not target.levels:
+                del self._pending[address]
+
+        return _cancel
+
+    @callback
+    def _async_schedule(self) -> None:
+        """Start a resync shortly after Home Assistant started."""
+        if self._scheduled is not None or self._task is not None:
+            return
+
+        @callback
+        def _start(_: Any) -> None:
+            self._scheduled = None
+            self._task = self.hass.async_create_background_task(
+                self._async_run(), f"{DOMAIN} resync"
+            )
+
+        @callback
+        def _started(_: HomeAssistant) -> None:
+            self._scheduled = async_call_later(self.hass, RESYNC_DELAY, _start)
+
+        self._scheduled = async_at_started(self.hass, _started)
+
+    def _next_wave(
+        self, size: int, report: ResyncReport, elapsed: float
+    ) -> list[_ResyncTarget]:
+        """Take the lights of the next wave out of the pending ones."""
+        ready: list[_ResyncTarget] = []
+        for address, target in list(self._pending.items()):
+            # auto mode enabled since the start, the levels would leave it
+            if target.device.state.mode is DeviceMode.AUTO:
+                report.skipped += 1
+                del self._pending[address]
+            elif not target.changed_levels():
+                report.skipped += 1
+                del self._pending[address]
+            elif target.device.available:
+                ready.append(target)
+            elif elapsed >= self.wait_for_device:
+                _LOGGER.debug("%s: not resynchronized, it did not advertise", address)
+                report.unreachable += 1
+                del self._pending[address]
+        ready.sort(key=lambda target: (-target.priority, -target.rssi))
+        wave = ready[:size]
+        for target in wave:
+            del self._pending[target.device.address]
+        return wave
+
+    async def _async_resync(self, target: _ResyncTarget, report: ResyncReport) -> None:
+        """Send its restored levels to a light."""
+        device = target.device
+        try:
+            with (
+                command_priority(Priority.BACKGROUND),
+                span("resync", device=device.address),
+            ):
+                await device.set_colors_brightness(
+                    target.levels,  # type: ignore[arg-type]
+                    deadline_from_timeout(COMMAND_TIMEOUT),
+                )
+        except (
+            DeviceUnavailable,
+            DeadlineExceeded,
+            CharacteristicMissingError,
+            *BLEAK_EXCEPTIONS,
+        ) as ex:
+            _LOGGER.debug("%s: resync failed: %s", device.address, ex)
+            report.failed += 1
+            return
+        report.resynced += 1
+        target.coordinator.record_command()
+
+    async def _async_run(self) -> None:
+        """Resynchronize the pending lights, wave after wave."""
+        start = time.monotonic()
+        report = ResyncReport()
+        in_flight: set[asyncio.Task[None]] = set()
+        next_wave = start
+        try:
+            while self._pending or in_flight:
+                now = time.monotonic()
+                if now >= next_wave:
+                    size = min(self.wave_size, self.max_concurrency - len(in_flight))
+                    if wave := self._next_wave(size, report, now - start):
+                        next_wave = now + self.wave_interval
+                    for target in wave:
+                        in_flight.add(
+                            asyncio.create_task(self._async_resync(target, report))
+                        )
+                timeout: float | None = None
+                if self._pending:
+                    # wait for the next wave, or poll the lights not seen yet
+                    timeout = next_wave - time.monotonic()
+                    if timeout <= 0:
+                        timeout = self.wave_interval
+                if in_flight:
+                    _, in_flight = await asyncio.wait(
+                        in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                elif timeout is not None:
+                    await asyncio.sleep(timeout)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            self._task = None
+        report.devices = (
+            report.resynced + report.skipped + report.failed + report.unreachable
+        )
+        report.duration = time.monotonic() - start
+        self.last_report = report
+        _LOGGER.info(
+            "Resynchronized %d of %d lights in %.1f s "
+            "(%d already up to date, %d failed, %d unreachable)",
+            report.resynced,
+            report.devices,
+            report.duration,
+            report.skipped,
+            report.failed,
+            report.unreachable,
+        )
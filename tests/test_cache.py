@@ -0,0 +1,86 @@
+"""Tests of the on disk cache of discovered devices."""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+from bleak.backends.device import BLEDevice
+
+from custom_components.chihiros.chihiros_led_control import cache
+from custom_components.chihiros.chihiros_led_control.cache import DeviceCache
+
+ADDRESS = "aa:bb:cc:dd:ee:ff"
+
+
+def _ble_device(name: str | None = "DYNA2N0123456789AB") -> BLEDevice:
+    props = {"Adapter": "/org/bluez/hci1"}
+    return BLEDevice(
+        ADDRESS, name, {"path": "/org/bluez/hci1/dev", "props": props}, -60
+    )
+
+
+def test_device_expires_after_the_ttl(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A device is only returned within the ttl of its last advertisement."""
+    now = 1000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    device_cache = DeviceCache(tmp_path / "devices.json", ttl=60)
+    device_cache.update(_ble_device(), "A II", rssi=-60)
+
+    cached = device_cache.get(ADDRESS)
+    assert cached is not None
+    assert cached.address == ADDRESS.upper()
+    assert cached.adapter == "/org/bluez/hci1"
+    now += 61
+    assert device_cache.get(ADDRESS) is None
+
+
+def test_flush_writes_the_file_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Updates are only written by a flush, with a temporary file replaced atomically."""
+    path = tmp_path / "sub" / "devices.json"
+    device_cache = DeviceCache(path)
+    replaced: list[str] = []
+    replace = os.replace
+
+    def _replace(src: str, dst: Path) -> None:
+        replaced.append(src)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", _replace)
+    device_cache.update(_ble_device(), "A II")
+    device_cache.update(_ble_device(), "A II")
+    assert not path.exists()
+
+    device_cache.flush()
+    device_cache.flush()
+    assert len(replaced) == 1
+    assert list(path.parent.iterdir()) == [path]
+    data = json.loads(path.read_text())
+    assert data["version"] == cache.CACHE_VERSION
+    assert [device["model"] for device in data["devices"]] == ["A II"]
+
+    reloaded = DeviceCache(path).get(ADDRESS)
+    assert reloaded is not None
+    ble_device = reloaded.to_ble_device()
+    assert ble_device is not None
+    assert ble_device.details["path"] == "/org/bluez/hci1/dev"
+
+
+def test_invalidate_and_unreadable_file(tmp_path: Path) -> None:
+    """Removed devices are gone after a flush and a corrupt file is an empty cache."""
+    path = tmp_path / "devices.json"
+    device_cache = DeviceCache(path)
+    device_cache.update(_ble_device(), "A II")
+    device_cache.update(_ble_device(name=None), "A II")
+    device_cache.flush()
+    device_cache.invalidate(ADDRESS)
+    device_cache.flush()
+    assert DeviceCache(path).get(ADDRESS) is None
+
+    path.write_text("{not json")
+    assert DeviceCache(path).get(ADDRESS) is None
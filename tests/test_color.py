@@ -0,0 +1,81 @@
+"""Tests of the mapping of colors to channel levels."""
+
+import random
+
+import pytest
+
+from custom_components.chihiros.chihiros_led_control import color
+from custom_components.chihiros.chihiros_led_control.color import (
+    ColorPipeline,
+    fleet_levels,
+)
+from custom_components.chihiros.chihiros_led_control.device.catalog import (
+    MODEL_CATALOG,
+    MODEL_SPECS,
+    PERCEPTUAL_GAMMA,
+)
+
+
+def _linear(brightness: int) -> int:
+    """Return the level the lights got before the pipeline."""
+    return int(brightness / 255 * 100)
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_default_mapping_is_linear(
+    monkeypatch: pytest.MonkeyPatch, numpy: bool
+) -> None:
+    """The catalog models keep the level they always got for a brightness."""
+    if numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(color, "np", None)
+    pipeline = ColorPipeline(MODEL_SPECS["AII"])
+    for brightness in range(256):
+        expected = _linear(brightness) or min(brightness, 1)
+        assert pipeline.channel_level("white", brightness) == expected
+        levels = pipeline.levels([(255, 255, 255)], brightness)
+        assert levels == [{"white": expected}]
+
+
+def test_perceptual_curve_is_opt_in() -> None:
+    """The perceptual gamma dims half brightness well below half the level."""
+    assert all(spec.gamma == 1.0 for spec in MODEL_CATALOG)
+    pipeline = ColorPipeline.for_model("AII", PERCEPTUAL_GAMMA)
+    assert ColorPipeline.for_model("AII").channel_level("white", 128) == 50
+    assert pipeline.channel_level("white", 128) == 21
+    assert pipeline.channel_level("white", 255) == 100
+    # a dim light stays on
+    assert pipeline.channel_level("white", 3) == 1
+    assert pipeline.channel_level("white", 0) == 0
+
+
+def test_lookup_tables_fit_a_byte() -> None:
+    """Each channel has a table of 256 levels of one byte."""
+    np = pytest.importorskip("numpy")
+    pipeline = ColorPipeline(MODEL_SPECS["WRGBIIPro"], PERCEPTUAL_GAMMA)
+    luts = pipeline._numpy_luts
+    assert luts.shape == (len(pipeline.channels), 256)
+    assert luts.dtype == np.uint8
+    assert luts[:, 0].tolist() == [0] * len(pipeline.channels)
+    assert luts[:, 1:].min() == 1
+
+
+def test_numpy_and_python_agree(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Both mappings give the same levels for every model."""
+    pytest.importorskip("numpy")
+    rng = random.Random(0)
+    models = [spec.class_name for spec in MODEL_CATALOG] * 20
+    rng.shuffle(models)
+    rgb = [tuple(rng.randrange(256) for _ in range(3)) for _ in models]
+    brightness = [rng.randrange(256) for _ in models]
+    white = [rng.randrange(256) for _ in models]
+    expected = fleet_levels(models, rgb, brightness)
+    expected_white = fleet_levels(models, rgb, brightness, white)
+    monkeypatch.setattr(color, "np", None)
+    color._pipeline_for_model.cache_clear()
+    try:
+        assert fleet_levels(models, rgb, brightness) == expected
+        assert fleet_levels(models, rgb, brightness, white) == expected_white
+    finally:
+        color._pipeline_for_model.cache_clear()
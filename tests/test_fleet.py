@@ -0,0 +1,123 @@
+"""Tests of the convergence of a fleet of lights to a desired state."""
+
+import asyncio
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from custom_components.chihiros.chihiros_led_control import fleet
+from custom_components.chihiros.chihiros_led_control.batch import (
+    DeviceResult,
+    Operation,
+)
+from custom_components.chihiros.chihiros_led_control.fleet import (
+    AppliedRecord,
+    DesiredState,
+    apply_plan,
+    parse_fleet,
+    plan_device,
+)
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+OTHER = "AA:BB:CC:DD:EE:00"
+
+
+def _state(*settings: dict[str, Any], mode: str = "auto") -> DesiredState:
+    raw = {"mode": mode, "settings": list(settings)}
+    return parse_fleet({ADDRESS: raw}, {})[ADDRESS]
+
+
+def _commands(operations: list[Operation]) -> list[str]:
+    return [operation.command for operation in operations]
+
+
+MORNING = {"sunrise": "08:00", "sunset": "12:00", "max-brightness": 80}
+EVENING = {"sunrise": "14:00", "sunset": "20:00", "max-brightness": [10, 20, 30]}
+
+
+def test_plan_from_scratch_and_up_to_date() -> None:
+    """Unknown lights are reset, recorded ones only get their differences."""
+    desired = _state(MORNING, EVENING)
+    assert _commands(plan_device(ADDRESS, desired, None)) == [
+        "reset_settings",
+        "add_setting",
+        "add_rgb_setting",
+        "enable_auto_mode",
+    ]
+    assert plan_device(ADDRESS, desired, desired) == []
+
+
+def test_plan_differences() -> None:
+    """Settings of other slots are removed, changed ones are added again."""
+    applied = _state(MORNING, EVENING)
+    desired = _state({**MORNING, "max-brightness": 60})
+    operations = plan_device(ADDRESS, desired, applied)
+    assert _commands(operations) == [
+        "remove_setting",
+        "add_setting",
+        "enable_auto_mode",
+    ]
+    assert operations[0].kwargs["sunrise"].hour == 14
+    assert operations[1].kwargs["max_brightness"] == 60
+
+    manual = parse_fleet({ADDRESS: {"mode": "manual", "levels": {"white": 60}}}, {})
+    operations = plan_device(ADDRESS, manual[ADDRESS], applied)
+    assert _commands(operations) == [
+        "remove_setting",
+        "remove_setting",
+        "set_color_brightness",
+    ]
+    assert plan_device(ADDRESS, manual[ADDRESS], manual[ADDRESS]) == []
+
+
+def test_retries_from_scratch_and_single_write(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A failed light is retried from scratch and the record is written once."""
+    record = AppliedRecord(tmp_path / "applied.json")
+    old = _state(MORNING)
+    record.set(ADDRESS, old)
+    record.set(OTHER, old)
+    record.flush()
+    desired = _state(MORNING, EVENING)
+    fleet_state = {ADDRESS: desired, OTHER: desired}
+    plan = fleet.plan_fleet(fleet_state, record)
+    assert _commands(plan[ADDRESS]) == ["add_rgb_setting", "enable_auto_mode"]
+
+    sent: list[list[Operation]] = []
+
+    async def _run_operations(
+        operations: list[Operation], *args: Any, **kwargs: Any
+    ) -> list[DeviceResult]:
+        sent.append(operations)
+        addresses = dict.fromkeys(operation.address for operation in operations)
+        # the first light always fails, the other one the first time only
+        return [
+            DeviceResult(
+                address,
+                error=("lost" if address == ADDRESS or len(sent) == 1 else None),
+            )
+            for address in addresses
+        ]
+
+    saves = 0
+    save = AppliedRecord._save
+
+    def _save(self: AppliedRecord) -> None:
+        nonlocal saves
+        saves += 1
+        save(self)
+
+    monkeypatch.setattr(fleet, "run_operations", _run_operations)
+    monkeypatch.setattr(AppliedRecord, "_save", _save)
+    results, attempts = asyncio.run(apply_plan(plan, fleet_state, record, retries=2))
+
+    assert attempts == {ADDRESS: 3, OTHER: 2}
+    assert not results[ADDRESS].ok and results[OTHER].ok
+    retried = [op for op in sent[1] if op.address == OTHER]
+    assert _commands(retried)[0] == "reset_settings"
+    assert saves == 1
+    reloaded = AppliedRecord(record.path)
+    assert reloaded.get(ADDRESS) is None
+    assert reloaded.get(OTHER) == desired
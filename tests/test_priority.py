@@ -0,0 +1,172 @@
+"""Tests of the priority lock of the operations queued on a device."""
+
+import asyncio
+from typing import Any, Awaitable
+
+from bleak.backends.device import BLEDevice
+
+from custom_components.chihiros.chihiros_led_control.device.a2 import AII
+from custom_components.chihiros.chihiros_led_control.device.priority import (
+    Priority,
+    PriorityLock,
+)
+from custom_components.chihiros.chihiros_led_control.device.state import DeviceMode
+
+# mode byte of the manual level and of the auto mode switch frames
+MANUAL_MODE = 7
+AUTO_MODE = 5
+
+
+async def _within(awaitable: Awaitable[object], timeout: float = 1.0) -> None:
+    """Await in the current task, failing with a cancellation after the timeout."""
+    task = asyncio.current_task()
+    assert task is not None
+    watchdog = asyncio.get_running_loop().call_later(timeout, task.cancel)
+    try:
+        await awaitable
+    finally:
+        watchdog.cancel()
+
+
+def test_acquire_after_cancelled_waiter_is_released() -> None:
+    """A waiter cancelled before the release does not block the next acquire."""
+
+    async def _run() -> None:
+        lock = PriorityLock()
+        await lock.acquire(Priority.INTERACTIVE)
+        waiter = asyncio.create_task(lock.acquire(Priority.BACKGROUND))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        lock.release()
+        await _within(lock.acquire(Priority.INTERACTIVE))
+        assert lock.locked()
+        lock.release()
+        assert not lock.locked()
+
+    asyncio.run(_run())
+
+
+def test_cancelled_waiter_wakes_up_the_next_one() -> None:
+    """The lock goes to a live waiter when the one before it is cancelled."""
+
+    async def _run() -> None:
+        lock = PriorityLock()
+        await lock.acquire(Priority.INTERACTIVE)
+        cancelled = asyncio.create_task(lock.acquire(Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(lock.acquire(Priority.BACKGROUND))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        lock.release()
+        await _within(waiting)
+        assert cancelled.cancelled()
+        assert lock.locked()
+
+    asyncio.run(_run())
+
+
+def test_waiter_cancelled_while_granted_passes_the_lock_on() -> None:
+    """A waiter granted the lock while being cancelled releases it."""
+
+    async def _run() -> None:
+        lock = PriorityLock()
+        await lock.acquire(Priority.INTERACTIVE)
+        granted = asyncio.create_task(lock.acquire(Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(lock.acquire(Priority.BACKGROUND))
+        await asyncio.sleep(0)
+        lock.release()
+        granted.cancel()
+        await _within(waiting)
+        assert lock.locked()
+
+    asyncio.run(_run())
+
+
+class _Characteristic:
+    uuid = "simulated"
+
+
+class _Services:
+    def get_characteristic(self, uuid: str) -> _Characteristic:
+        return _Characteristic()
+
+
+class _Client:
+    """Client recording the frames, each write taking a few milliseconds."""
+
+    def __init__(self) -> None:
+        self.is_connected = True
+        self.services = _Services()
+        self.mtu_size = 23
+        self.frames: list[bytes] = []
+        self.writing = asyncio.Event()
+
+    async def start_notify(self, *args: Any) -> None:
+        pass
+
+    async def stop_notify(self, *args: Any) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def write_gatt_char(self, char: Any, data: bytes, response: bool) -> None:
+        self.writing.set()
+        await asyncio.sleep(0.005)
+        self.frames.append(bytes(data))
+
+
+def _device(client: _Client) -> AII:
+    async def _connector(ble_device: BLEDevice, disconnected: Any) -> Any:
+        return client
+
+    device = AII(BLEDevice("AA:BB:CC:DD:EE:FF", "DYNA2N0123456789AB", None, 0))
+    device.set_connector(_connector)
+    return device
+
+
+def test_manual_set_never_splits_the_auto_mode_switch() -> None:
+    """A preempting manual set runs after the frames of enable_auto_mode."""
+
+    async def _run() -> None:
+        client = _Client()
+        device = _device(client)
+        auto = asyncio.create_task(device.enable_auto_mode(force=True))
+        await _within(client.writing.wait())
+        await _within(device.set_brightness(40))
+        await _within(auto)
+        await device.disconnect()
+
+        assert [frame[5] for frame in client.frames] == [AUTO_MODE, 9, MANUAL_MODE]
+        assert device.state.mode is DeviceMode.MANUAL
+        assert device.state.levels == {0: 40}
+        # the next switch to auto mode is not suppressed
+        with device.capture_commands() as frames:
+            await device.enable_auto_mode()
+        assert [frame[5] for frame in frames] == [AUTO_MODE]
+
+    asyncio.run(_run())
+
+
+def test_manual_set_preempts_between_operations() -> None:
+    """Operations of a higher class run between the operations of a burst."""
+
+    async def _run() -> None:
+        client = _Client()
+        device = _device(client)
+        with device.capture_commands() as first:
+            await device.enable_auto_mode(force=True)
+        with device.capture_commands() as second:
+            await device.reset_settings()
+        burst = asyncio.create_task(device.send_operations([first, second]))
+        await _within(client.writing.wait())
+        await _within(device.set_brightness(40))
+        await _within(burst)
+        await device.disconnect()
+
+        assert client.frames == [*first, client.frames[2], *second]
+        assert client.frames[2][5] == MANUAL_MODE
+        assert device.queue_stats[Priority.AUTOMATION].preemptions == 1
+
+    asyncio.run(_run())
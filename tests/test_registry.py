@@ -0,0 +1,68 @@
+"""Tests of the classification of advertised names into models."""
+
+from types import MappingProxyType
+
+from custom_components.chihiros.chihiros_led_control.const import UART_SERVICE_UUID
+from custom_components.chihiros.chihiros_led_control.device.catalog import (
+    FALLBACK_SPEC,
+    ModelSpec,
+)
+from custom_components.chihiros.chihiros_led_control.device.registry import (
+    MODEL_REGISTRY,
+    ModelRegistry,
+)
+
+OTHER_SERVICE_UUID = "0000ffe0-0000-1000-8000-00805f9b34fb"
+
+
+def _spec(
+    name: str, codes: tuple[str, ...], service_uuids: tuple[str, ...] = ()
+) -> ModelSpec:
+    return ModelSpec(
+        name,
+        "fallback",
+        name,
+        codes,
+        MappingProxyType({"white": 0}),
+        service_uuids=service_uuids,
+    )
+
+
+def test_catalog_names() -> None:
+    """Names of the catalog resolve to their model, the longest code winning."""
+    cases = {
+        "DYNA2N0123456789AB": "A II",
+        "DYNA20123456789AB": "A II",
+        "DYNWRGB0123456789AB": "WRGB II",
+        "DYU6000123456789AB": "Universal WRGB",
+        # unknown size of a family
+        "DYU4200123456789AB": "Universal WRGB",
+        "DYWPRO1500123456789AB": "WRGB II Pro",
+    }
+    for name, model_name in cases.items():
+        spec = MODEL_REGISTRY.match(name)
+        assert spec is not None, name
+        assert spec.model_name == model_name, name
+
+
+def test_unknown_names() -> None:
+    """Unknown names are only Chihiros devices when they advertise the UART service."""
+    assert MODEL_REGISTRY.match("Govee_H6001") is None
+    assert MODEL_REGISTRY.match(None) is None
+    assert MODEL_REGISTRY.match("Govee_H6001", [UART_SERVICE_UUID]) is FALLBACK_SPEC
+    assert MODEL_REGISTRY.match(None, [UART_SERVICE_UUID.lower()]) is FALLBACK_SPEC
+    assert MODEL_REGISTRY.get_class_from_name("Govee_H6001").__name__ == "Fallback"
+
+
+def test_advertised_services_break_ties() -> None:
+    """The longest matching model advertising all its services wins."""
+    short = _spec("Short", ("DYX",), (UART_SERVICE_UUID.lower(),))
+    long = _spec("Long", ("DYXL",), (OTHER_SERVICE_UUID,))
+    registry = ModelRegistry((short, long))
+
+    assert registry.match_candidates("DYXL01") == (long, short)
+    assert registry.match_name("DYXL01") is long
+    assert registry.match("DYXL01") is long
+    assert registry.match("DYXL01", [OTHER_SERVICE_UUID.upper()]) is long
+    assert registry.match("DYXL01", [UART_SERVICE_UUID]) is short
+    assert registry.match("DYX01", [OTHER_SERVICE_UUID]) is short
@@ -0,0 +1,117 @@
+"""Tests of the prediction of the levels of lights in auto mode."""
+
+import datetime
+import random
+
+import pytest
+
+from custom_components.chihiros.chihiros_led_control import schedule
+from custom_components.chihiros.chihiros_led_control.schedule import (
+    AutoSetting,
+    ScheduleEvaluator,
+    apply_setting_operation,
+)
+from custom_components.chihiros.chihiros_led_control.weekday_encoding import (
+    WeekdaySelect,
+    encode_selected_weekdays,
+)
+
+# 2024-01-01 is a monday
+MONDAY = datetime.datetime(2024, 1, 1)
+
+
+def _time(hour: int, minute: int = 0) -> datetime.time:
+    return datetime.time(hour, minute)
+
+
+def _evaluate(
+    schedules: dict[str, list[AutoSetting]], when: datetime.datetime
+) -> dict[str, tuple[int, ...]]:
+    return ScheduleEvaluator(schedules).evaluate(when)
+
+
+def _random_schedules(seed: int) -> dict[str, list[AutoSetting]]:
+    rng = random.Random(seed)
+    schedules = {}
+    for light in range(20):
+        settings = []
+        for _ in range(rng.randrange(4)):
+            settings.append(
+                AutoSetting(
+                    _time(rng.randrange(24), rng.randrange(60)),
+                    _time(rng.randrange(24), rng.randrange(60)),
+                    (rng.randrange(101), rng.randrange(101), rng.choice((50, 255))),
+                    rng.choice((0, 0, 1, 30, 150)),
+                    rng.randrange(1, 128),
+                )
+            )
+        schedules[f"AA:BB:CC:DD:EE:{light:02X}"] = settings
+    return schedules
+
+
+def test_numpy_and_python_agree(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Both evaluations give the same levels over a week."""
+    pytest.importorskip("numpy")
+    schedules = _random_schedules(0)
+    times = [MONDAY + datetime.timedelta(minutes=17 * step) for step in range(600)]
+    vectorized = ScheduleEvaluator(schedules)
+    with monkeypatch.context() as patch:
+        patch.setattr(schedule, "np", None)
+        pure = ScheduleEvaluator(schedules)
+        expected = [pure.evaluate(when) for when in times]
+    assert [vectorized.evaluate(when) for when in times] == expected
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_levels(monkeypatch: pytest.MonkeyPatch, numpy: bool) -> None:
+    """Ramps, weekdays, settings passing midnight and empty settings."""
+    if numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(schedule, "np", None)
+    monday = encode_selected_weekdays([WeekdaySelect.monday])
+    schedules = {
+        "ramp": [AutoSetting(_time(8), _time(20), (100, 50, 255), 60, 127)],
+        "night": [AutoSetting(_time(22), _time(2), (40, 0, 0), 0, monday)],
+        "empty": [AutoSetting(_time(9), _time(9), (100, 100, 100), 0, 127)],
+        "none": [],
+    }
+    at = MONDAY.replace
+    assert _evaluate(schedules, at(hour=8, minute=30))["ramp"] == (50, 25, 0)
+    assert _evaluate(schedules, at(hour=12))["ramp"] == (100, 50, 0)
+    assert _evaluate(schedules, at(hour=19, minute=45))["ramp"] == (25, 12, 0)
+    assert _evaluate(schedules, at(hour=20))["ramp"] == (0, 0, 0)
+
+    # the monday night setting still runs on tuesday morning, not on monday's
+    assert _evaluate(schedules, at(hour=1))["night"] == (0, 0, 0)
+    assert _evaluate(schedules, at(hour=23))["night"] == (40, 0, 0)
+    tuesday = MONDAY + datetime.timedelta(days=1)
+    assert _evaluate(schedules, tuesday.replace(hour=1))["night"] == (40, 0, 0)
+    assert _evaluate(schedules, tuesday.replace(hour=23))["night"] == (0, 0, 0)
+
+    # sunrise == sunset is an empty setting
+    for hour in (0, 9, 12):
+        levels = _evaluate(schedules, at(hour=hour))
+        assert levels["empty"] == (0, 0, 0)
+        assert levels["none"] == (0, 0, 0)
+
+
+def test_apply_setting_operation() -> None:
+    """Settings replace the ones of their slot and are removed by slot."""
+    settings: list[AutoSetting] = []
+    sunrise = datetime.datetime(2024, 1, 1, 8)
+    sunset = datetime.datetime(2024, 1, 1, 20)
+    apply_setting_operation(
+        settings, "add_setting", {"sunrise": sunrise, "sunset": sunset}
+    )
+    apply_setting_operation(
+        settings,
+        "add_rgb_setting",
+        {"sunrise": sunrise, "sunset": sunset, "max_brightness": (10, 20, 30)},
+    )
+    assert [setting.brightness for setting in settings] == [(10, 20, 30)]
+    apply_setting_operation(settings, "enable_auto_mode", {})
+    apply_setting_operation(
+        settings, "remove_setting", {"sunrise": sunrise, "sunset": sunset}
+    )
+    assert settings == []
@@ -0,0 +1,152 @@
+"""Tests of the timer wheel and the fleet scheduler."""
+
+import asyncio
+import datetime
+import random
+import time
+from typing import Any, cast
+
+import pytest
+
+from custom_components.chihiros.chihiros_led_control.device.base_device import (
+    BaseDevice,
+)
+from custom_components.chihiros.chihiros_led_control.scheduler import (
+    FleetScheduler,
+    TimerWheel,
+)
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+
+
+def test_wheel_fires_each_item_once_in_order() -> None:
+    """Items of every level and of the overflow fire at their tick."""
+    wheel: TimerWheel[int] = TimerWheel((2, 2, 2))
+    rng = random.Random(0)
+    ticks = [rng.randrange(1, 200) for _ in range(300)]
+    for index, tick in enumerate(ticks):
+        wheel.add(tick, index)
+    assert len(wheel) == len(ticks)
+
+    fired: list[tuple[int, int]] = []
+    while (expiry := wheel.next_expiry()) is not None:
+        assert expiry > wheel.now
+        target = expiry + rng.randrange(3)
+        due = wheel.advance(target)
+        assert all(wheel.now - 3 < tick <= wheel.now for tick, _ in due)
+        fired.extend(due)
+    assert sorted(fired) == sorted((tick, index) for index, tick in enumerate(ticks))
+    assert len(wheel) == 0
+
+    # a passed tick is due at the next one
+    wheel.add(wheel.now - 5, -1)
+    assert wheel.advance(wheel.now + 1) == [(wheel.now, -1)]
+
+
+class _Light:
+    """Light recording its levels, blocking while `gate` is not set."""
+
+    def __init__(self) -> None:
+        self.sends: list[dict[str | int, int]] = []
+        self.sending = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    async def set_colors_brightness(self, levels: Any, deadline: Any = None) -> None:
+        self.sending.set()
+        await self.gate.wait()
+        self.sends.append(dict(levels))
+
+
+def _devices(light: _Light) -> dict[str, BaseDevice]:
+    return {ADDRESS: cast(BaseDevice, light)}
+
+
+async def _within(awaitable: Any, timeout: float = 1.0) -> None:
+    await asyncio.wait_for(awaitable, timeout)
+
+
+def test_levels_fired_while_sending_are_coalesced() -> None:
+    """Actions of a tick are merged, later ones wait in a single send."""
+
+    async def _run() -> None:
+        light = _Light()
+        async with FleetScheduler(_devices(light), resolution=0.01) as scheduler:
+            scheduler.schedule_in(ADDRESS, 0, {"white": 10})
+            await _within(light.sending.wait())
+            later: list[dict[str | int, int]] = [
+                {"white": 20},
+                {"red": 5},
+                {"white": 30},
+            ]
+            for levels in later:
+                scheduler.schedule_in(ADDRESS, 0.02, levels)
+                await asyncio.sleep(0.05)
+            light.gate.set()
+        assert light.sends == [{"white": 10}, {"white": 30, "red": 5}]
+        assert scheduler.stats.fired == 4
+        assert scheduler.stats.sends == 2
+        assert scheduler.stats.coalesced == 2
+
+    asyncio.run(_run())
+
+
+@pytest.fixture
+def wall_clock(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    """Return the offset of the patched wall clock, in seconds."""
+    offset = [0.0]
+    now = time.time
+    monkeypatch.setattr(time, "time", lambda: now() + offset[0])
+    return offset
+
+
+def test_clock_jump_places_wall_clock_actions_again(wall_clock: list[float]) -> None:
+    """Wall clock actions follow a jump, the ones too late are skipped."""
+
+    async def _run() -> None:
+        light = _Light()
+        light.gate.set()
+        scheduler = FleetScheduler(_devices(light), resolution=0.01)
+        soon = datetime.datetime.now() + datetime.timedelta(seconds=30)
+        scheduler.schedule_at(ADDRESS, soon, {"white": 1})
+        scheduler.schedule_at(ADDRESS, soon, {"red": 2}).cancel()
+        later = scheduler.schedule_at(ADDRESS, soon, {"blue": 3})
+        # the wall clock moves forward, the actions are now due
+        wall_clock[0] = 30.0
+        async with scheduler:
+            await _within(light.sending.wait())
+        assert light.sends == [{"white": 1, "blue": 3}]
+        assert scheduler.stats.clock_jumps == 1
+        assert later.next_run is None
+
+        light.sends.clear()
+        scheduler = FleetScheduler(_devices(light), resolution=0.01, misfire_grace=60)
+        due = datetime.datetime.fromtimestamp(time.time() + 10)
+        missed = scheduler.schedule_at(ADDRESS, due, {"white": 4})
+        daily = scheduler.schedule_daily(ADDRESS, due.time(), {"white": 5})
+        wall_clock[0] += 3600.0
+        async with scheduler:
+            await asyncio.sleep(0.05)
+        assert light.sends == []
+        assert scheduler.stats.missed == 2
+        assert missed.next_run is None
+        # the daily action runs again the next day
+        assert daily.next_run is not None
+        tomorrow = due + datetime.timedelta(days=1)
+        assert abs((daily.next_run - tomorrow).total_seconds()) < 1
+
+    asyncio.run(_run())
+
+
+def test_daily_weekdays_default_to_every_day() -> None:
+    """A daily action runs every day unless weekdays are given."""
+
+    async def _run() -> None:
+        scheduler = FleetScheduler(_devices(_Light()))
+        at = datetime.time(12)
+        first = scheduler.schedule_daily(ADDRESS, at, {"white": 1})
+        second = scheduler.schedule_daily(ADDRESS, at, {"white": 2})
+        assert first.weekdays == second.weekdays == 127
+        assert first.next_run is not None
+        assert first.next_run - datetime.datetime.now() < datetime.timedelta(days=1)
+
+    asyncio.run(_run())
@@ -0,0 +1,89 @@
+"""Tests of the flow controlled writer."""
+
+import asyncio
+
+from custom_components.chihiros.chihiros_led_control.device.writer import (
+    MIN_ACK_TIMEOUT,
+    FlowControlledWriter,
+)
+
+
+def _frame(index: int) -> bytes:
+    return bytes([90, 1, 6, 0, index, 7])
+
+
+def test_only_matching_notifications_acknowledge() -> None:
+    """Notifications acknowledge the frame with their message id and the ones before."""
+
+    async def _run() -> None:
+        writer = FlowControlledWriter()
+        written: list[bytes] = []
+
+        async def _write(frame: bytes) -> None:
+            written.append(frame)
+
+        await writer.write(_write, [_frame(1), _frame(2), _frame(3)])
+        writer.acknowledge(bytes([91, 1, 6, 0, 42, 7]))
+        writer.acknowledge(b"\x01")
+        assert writer.stats.acks == 0
+        assert writer.stats.unmatched == 2
+
+        writer.acknowledge(_frame(2))
+        assert writer.stats.acks == 2
+        writer.acknowledge(_frame(2))
+        assert writer.stats.unmatched == 3
+        assert written == [_frame(1), _frame(2), _frame(3)]
+
+    asyncio.run(_run())
+
+
+def test_missing_acks_stop_the_wait() -> None:
+    """A device acknowledging once is not waited for on every later burst."""
+
+    async def _run() -> None:
+        loop = asyncio.get_running_loop()
+        writer = FlowControlledWriter()
+
+        async def _write(frame: bytes) -> None:
+            pass
+
+        await writer.write(_write, [_frame(0)])
+        writer.acknowledge(_frame(0))
+
+        start = loop.time()
+        await writer.write(_write, [_frame(index) for index in range(1, 21)])
+        first_burst = loop.time() - start
+        start = loop.time()
+        await writer.write(_write, [_frame(index) for index in range(21, 41)])
+        second_burst = loop.time() - start
+
+        # one ack timeout before the writer stops waiting, none afterwards
+        assert MIN_ACK_TIMEOUT <= first_burst < 0.4
+        assert second_burst < MIN_ACK_TIMEOUT
+        assert writer.stats.losses >= 1
+
+    asyncio.run(_run())
+
+
+def test_reset_forgets_the_device() -> None:
+    """A new connection starts without acknowledgements nor round trip times."""
+
+    async def _run() -> None:
+        writer = FlowControlledWriter(initial_window=2)
+
+        async def _write(frame: bytes) -> None:
+            pass
+
+        await writer.write(_write, [_frame(0)])
+        writer.acknowledge(_frame(0))
+        assert writer.window > 2
+        writer.reset()
+        assert writer.window == 2
+        assert writer.ack_timeout > MIN_ACK_TIMEOUT
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await writer.write(_write, [_frame(index) for index in range(1, 11)])
+        assert loop.time() - start < MIN_ACK_TIMEOUT
+
+    asyncio.run(_run())